@@ -10,7 +10,7 @@ app_class = 'ueb_app.app:UebApp'
 app_package_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tethysapp', app_package)
 
 ### Python Dependencies ###
-dependencies = []
+dependencies = ['futures']
 
 setup(
     name=release_package,
@@ -53,6 +53,11 @@ class UebApp(TethysAppBase):
                            url='ueb-app/help_page',
                            controller='ueb_app.controllers.help_page'),
 
+                    # url for HydroDS service call metrics
+                    UrlMap(name='hydrods_metrics',
+                           url='ueb-app/hydrods_metrics',
+                           controller='ueb_app.controllers.hydrods_metrics'),
+
                     # testing url
                     UrlMap(name='test',
                            url='ueb-app/test',
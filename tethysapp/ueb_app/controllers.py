@@ -13,6 +13,8 @@ from tethys_sdk.gizmos import TextInput, SelectInput,DatePicker, GoogleMapView
 from hs_restclient import HydroShare, HydroShareAuthOAuth2, HydroShareNotAuthorized, HydroShareNotFound
 
 from epsg_list import EPSG_List
+from hydrogate import hydrods_service_endpoints
+from hydrods_metrics import service_metrics
 from model_run_utils import *
 from model_input_utils import *
 from user_settings import *
@@ -353,13 +355,13 @@ def check_status(request):
 
 def get_job_status_list(hs_username):
     try:
-        url = 'http://129.123.41.218:20199/api/dataservice/job/check_job_status'
+        url_path = '/api/dataservice/job/check_job_status'
         auth = (hydrods_name, hydrods_password)
         payload = {
             'extra_data': 'HydroShare: ' + hs_username
         }
 
-        response = requests.get(url, params=payload,auth=auth)
+        response = hydrods_service_endpoints.get(url_path, params=payload, auth=auth)
 
         if response.status_code == 200:
             result = json.loads(response.text)
@@ -392,6 +394,18 @@ def help_page(request):
     return render(request, 'ueb_app/help.html', context)
 
 
+# metrics of the HydroDS service calls (Prometheus text format, or json with ?format=json)
+@login_required
+def hydrods_metrics(request):
+    if not request.user.is_staff:
+        return HttpResponse('Only staff users can view the HydroDS metrics.', status=403)
+
+    if request.GET.get('format') == 'json':
+        return HttpResponse(service_metrics.dump(), content_type='application/json')
+
+    return HttpResponse(service_metrics.to_prometheus(), content_type='text/plain; version=0.0.4')
+
+
 # get hs object through oauth
 def get_OAuthHS(request):
     OAuthHS = {}
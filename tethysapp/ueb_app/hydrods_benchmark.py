@@ -0,0 +1,93 @@
+"""
+Benchmarks of the model input preparation stages against the local stand-in HydroDS server
+
+Run from the command line:
+    python hydrods_benchmark.py --latency 0.2 --repeat 3
+"""
+
+import time
+import argparse
+
+import requests
+
+from hydrogate import HydroDS
+from hydrods_stub_server import HydroDSStubServer
+from hydrods_model_input import _raster_to_model_netcdf
+
+
+def benchmark_netcdf_conversion(variables=('watershed', 'aspect', 'slope'), latency=0.2, repeat=3, dxRes=100):
+    """
+    Compares the conversion of the model input rasters to netcdf files in one fused service call
+    (raster_to_netcdf_and_rename_variable) with the conversion through an intermediate netcdf file (raster_to_netcdf
+    followed by netcdf_rename_variable)
+
+    :param variables: (optional) model input variables to convert
+    :param latency: (optional) seconds each service call takes on the stand-in server (default is 0.2)
+    :param repeat: (optional) number of times each conversion is timed (default is 3)
+    :param dxRes: (optional) cell size used in the name of the intermediate netcdf files (default is 100)
+    :return: a dict with the conversion ('two_step' or 'fused') as key and a dict of variable name to a dict with
+             keys 'seconds' (mean wall time), 'calls' (service calls) and 'files' and 'bytes' (number and size of the
+             netcdf files written to the workspace) as value
+
+    Example usage:
+        results = benchmark_netcdf_conversion(latency=0.2)
+        print(format_results(results))
+    """
+    results = {'two_step': {}, 'fused': {}}
+    with HydroDSStubServer(latency=latency) as server:
+        hds = HydroDS(username='benchmark', password='benchmark', hydro_ds_base_url=server.base_url)
+        try:
+            input_raster = hds.subset_raster(left=-111.8, top=41.7, right=-111.6, bottom=41.5,
+                                             input_raster='nedWesternUS.tif', output_raster='benchmark.tif')
+            for conversion, fused in (('two_step', False), ('fused', True)):
+                for var in variables:
+                    seconds = []
+                    for _ in range(repeat):
+                        hds.delete_my_files(pattern='*.nc')
+                        request_count = sum(server.get_request_counts().values())
+                        start_time = time.time()
+                        _raster_to_model_netcdf(hds, input_raster['output_raster'], var, dxRes, fused=fused)
+                        seconds.append(time.time() - start_time)
+                        calls = sum(server.get_request_counts().values()) - request_count
+
+                    netcdf_files = [file_url for file_url in hds.list_my_files() if file_url.endswith('.nc')]
+                    results[conversion][var] = {
+                        'seconds': sum(seconds) / len(seconds),
+                        'calls': calls,
+                        'files': len(netcdf_files),
+                        'bytes': sum(int(requests.head(file_url).headers.get('Content-Length', 0))
+                                     for file_url in netcdf_files),
+                    }
+        finally:
+            hds.close()
+
+    return results
+
+
+def format_results(results):
+    """
+    :return: a text table of the benchmark_netcdf_conversion results with the savings of the fused conversion
+    """
+    lines = ['{0:<12}{1:>12}{2:>12}{3:>8}{4:>8}{5:>14}{6:>14}'.format('variable', 'two-step s', 'fused s', 'calls',
+                                                                      'files', 'bytes saved', 'time saved')]
+    for var in sorted(results['fused']):
+        two_step = results['two_step'][var]
+        fused = results['fused'][var]
+        time_saved = 1 - fused['seconds'] / two_step['seconds'] if two_step['seconds'] else 0
+        lines.append('{0:<12}{1:>12.3f}{2:>12.3f}{3:>8}{4:>8}{5:>14}{6:>13.0%}'.format(
+            var, two_step['seconds'], fused['seconds'], '{0}->{1}'.format(two_step['calls'], fused['calls']),
+            '{0}->{1}'.format(two_step['files'], fused['files']), two_step['bytes'] - fused['bytes'], time_saved))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the fused raster to netcdf conversion')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds each service call takes')
+    parser.add_argument('--repeat', type=int, default=3, help='number of times each conversion is timed')
+    args = parser.parse_args()
+
+    print(format_results(benchmark_netcdf_conversion(latency=args.latency, repeat=args.repeat)))
+
+
+if __name__ == '__main__':
+    main()
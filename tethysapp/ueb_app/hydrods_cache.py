@@ -0,0 +1,614 @@
+"""
+Local caches used by the HydroDS client
+"""
+
+import os
+import json
+import collections
+import math
+import time
+import shutil
+import stat
+import hashlib
+import fnmatch
+import tempfile
+import threading
+import contextlib
+from concurrent import futures
+
+try:
+    import fcntl
+except ImportError:
+    # windows - the index file is then not locked between processes
+    fcntl = None
+
+
+class DownloadCache(object):
+    def __init__(self, cache_dir=None, max_size=2 * 1024 ** 3):
+        """
+        Create an on-disk cache for files downloaded from the HydroDS api server. A downloaded file is stored once
+        by its content hash (sha256) and is looked up by its url together with the ETag (or Last-Modified) and size
+        reported by the server, so a file is served from the cache only as long as the server copy has not changed.
+        Files the server reports neither an ETag nor a Last-Modified time for are not cached, as HydroDS reuses the
+        output file names and an overwritten file often has the same size. Least recently used files are removed
+        once the total size of the cached files goes over max_size
+
+        :param cache_dir: (optional) directory to store the cached files (default is hydrods_cache in the system
+                          temp directory)
+        :type cache_dir: string
+        :param max_size: (optional) max total size in bytes of the cached files (default is 2 GB)
+        :type max_size: int
+        :return: DownloadCache object
+
+        Example usage:
+            hds = HydroDS(username=your_username, password=your_password)
+            hds.set_download_cache(DownloadCache(cache_dir=r'C:\\hydro-ds\\cache'))
+
+            # the 2nd download of the same file is served from the cache
+            hds.download_file(file_url_path=provide_download_file_url_path_here, save_as=r'C:\\hydro-ds\\dem_1.tif')
+            hds.download_file(file_url_path=provide_download_file_url_path_here, save_as=r'C:\\hydro-ds\\dem_2.tif')
+        """
+        if cache_dir is None:
+            cache_dir = os.path.join(tempfile.gettempdir(), 'hydrods_cache')
+
+        self._cache_dir = cache_dir
+        self._objects_dir = os.path.join(cache_dir, 'objects')
+        self._index_file = os.path.join(cache_dir, 'index.json')
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+        if not os.path.isdir(self._objects_dir):
+            os.makedirs(self._objects_dir)
+        self._index = self._load_index()
+
+    def get(self, url, etag, size, save_as, last_modified=None):
+        """
+        Saves a copy of the cached file as save_as
+
+        :return: True if the file was found in the cache, otherwise False
+        """
+        if not etag and not last_modified:
+            # no way to tell if the cached copy is still current
+            return False
+
+        with self._lock:
+            url_entry = self._index['urls'].get(url)
+            if url_entry is None or url_entry['etag'] != etag or url_entry.get('last_modified') != last_modified or \
+                    url_entry['size'] != size:
+                self._misses += 1
+                return False
+
+            content_hash = url_entry['sha256']
+            object_path = self._get_object_path(content_hash)
+            if content_hash not in self._index['objects'] or not os.path.isfile(object_path):
+                self._remove_object(content_hash)
+                self._misses += 1
+                return False
+
+            self._materialize(object_path, save_as)
+            self._index['objects'][content_hash]['last_access'] = time.time()
+            self._hits += 1
+            self._save_index()
+            return True
+
+    def put(self, url, etag, size, file_path, last_modified=None):
+        """
+        Adds a downloaded file to the cache
+
+        :return: sha256 hex digest of the file content (None if the file was not cached)
+        """
+        if not etag and not last_modified:
+            return None
+
+        content_hash = self._get_file_hash(file_path)
+        object_path = self._get_object_path(content_hash)
+        with self._lock:
+            if not os.path.isfile(object_path):
+                object_dir = os.path.dirname(object_path)
+                if not os.path.isdir(object_dir):
+                    os.makedirs(object_dir)
+                # the cached file is a read-only copy, so later writes to file_path don't change it
+                temp_object_path = '{0}.{1}.tmp'.format(object_path, os.getpid())
+                shutil.copyfile(file_path, temp_object_path)
+                os.chmod(temp_object_path, stat.S_IREAD)
+                if os.path.isfile(object_path):
+                    self._remove_file(object_path)
+                os.rename(temp_object_path, object_path)
+
+            self._index['objects'][content_hash] = {'size': os.path.getsize(object_path), 'last_access': time.time()}
+            self._index['urls'][url] = {'etag': etag, 'last_modified': last_modified, 'size': size,
+                                        'sha256': content_hash}
+            self._evict()
+            self._save_index()
+        return content_hash
+
+    def get_stats(self):
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses, 'files': len(self._index['objects']),
+                    'bytes': sum(entry['size'] for entry in self._index['objects'].values())}
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self._objects_dir, onerror=self._on_remove_error)
+            os.makedirs(self._objects_dir)
+            self._index = {'urls': {}, 'objects': {}}
+            self._save_index()
+
+    def _evict(self):
+        # removes least recently used files till the total size is within the max size
+        total_size = sum(entry['size'] for entry in self._index['objects'].values())
+        if total_size <= self._max_size:
+            return
+
+        objects_by_access = sorted(self._index['objects'].items(), key=lambda item: item[1]['last_access'])
+        for content_hash, entry in objects_by_access:
+            if total_size <= self._max_size:
+                break
+            self._remove_object(content_hash)
+            total_size -= entry['size']
+
+    def _remove_object(self, content_hash):
+        self._index['objects'].pop(content_hash, None)
+        object_path = self._get_object_path(content_hash)
+        if os.path.isfile(object_path):
+            self._remove_file(object_path)
+        for url in [url for url, entry in self._index['urls'].items() if entry['sha256'] == content_hash]:
+            del self._index['urls'][url]
+
+    def _get_object_path(self, content_hash):
+        return os.path.join(self._objects_dir, content_hash[:2], content_hash)
+
+    @staticmethod
+    def _materialize(source_path, target_path):
+        # a copy rather than a hard link - a later write to target_path must not change the cached file
+        if os.path.isfile(target_path):
+            os.remove(target_path)
+        shutil.copyfile(source_path, target_path)
+
+    @staticmethod
+    def _on_remove_error(remove_function, path, _):
+        # retries removing a read-only cached file - other failures are ignored
+        try:
+            os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+            remove_function(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _remove_file(file_path):
+        # the cached files are read-only (which stops their removal on windows)
+        os.chmod(file_path, stat.S_IREAD | stat.S_IWRITE)
+        os.remove(file_path)
+
+    @staticmethod
+    def _get_file_hash(file_path):
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as file_obj:
+            for block in iter(lambda: file_obj.read(1024 * 1024), b''):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def _load_index(self):
+        if os.path.isfile(self._index_file):
+            try:
+                with open(self._index_file, 'r') as f:
+                    return json.load(f)
+            except ValueError:
+                pass
+        return {'urls': {}, 'objects': {}}
+
+    def _save_index(self):
+        # processes sharing the cache dir write the index one at a time, each through a temp file of its own
+        temp_index_file = '{0}.{1}.tmp'.format(self._index_file, os.getpid())
+        with _locked_file(self._index_file + '.lock'):
+            with open(temp_index_file, 'w') as f:
+                json.dump(self._index, f)
+            if os.name == 'nt' and os.path.isfile(self._index_file):
+                os.remove(self._index_file)
+            os.rename(temp_index_file, self._index_file)
+
+
+class OperationMemo(object):
+    def __init__(self, ttl=24 * 3600, index_file=None, max_entries=10000):
+        """
+        Create a memo of HydroDS operation results. Each result is recorded against the HydroDS account and host,
+        the operation name, its parameters and a fingerprint of each of its input files. A recorded result is reused
+        only if it is not older than ttl and all its output files still exist unchanged on the HydroDS server. Least
+        recently used results are removed once there are more than max_entries results
+
+        :param ttl: (optional) number of seconds a recorded result can be reused (default is 24 hours)
+        :type ttl: int
+        :param index_file: (optional) json file to keep the memo in, so that it can be shared between processes
+                           (default is to keep the memo in memory only)
+        :type index_file: string
+        :param max_entries: (optional) max number of recorded results (default is 10000)
+        :type max_entries: int
+        :return: OperationMemo object
+
+        Example usage:
+            hds = HydroDS(username=your_username, password=your_password)
+            hds.set_operation_memo(OperationMemo(index_file=r'C:\\hydro-ds\\hydrods_memo.json'))
+        """
+        self._ttl = ttl
+        self._index_file = index_file
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        # results from the least to the most recently used
+        self._entries = collections.OrderedDict()
+        # keys of the results that have each file url as an output
+        self._keys_by_output = collections.defaultdict(set)
+        if index_file and os.path.isfile(index_file):
+            try:
+                with open(index_file, 'r') as f:
+                    entries = json.load(f)
+            except ValueError:
+                entries = {}
+            for key, entry in sorted(entries.items(), key=lambda item: item[1]['created']):
+                self._add_entry(key, entry)
+            self._evict()
+
+    def make_key(self, operation, params, get_file_validator, owner=None):
+        """
+        Generates the memo key for an operation call
+
+        :param operation: name of the operation
+        :param params: parameters of the operation call
+        :param get_file_validator: function that returns a validator (e.g. ETag, size) for a file url
+        :param owner: (optional) the HydroDS account and host the output files are created for (e.g. [username,
+                      base url]) - the output of another account is not reused as it is not owned by this one
+        """
+        normalized_params = []
+        input_fingerprints = []
+        for name, value in sorted((params or {}).items()):
+            if isinstance(value, float):
+                value = repr(round(value, 10))
+            normalized_params.append([name, value])
+
+            if _is_url(value):
+                input_fingerprints.append([value, self._get_input_fingerprint(value, get_file_validator)])
+
+        key_data = json.dumps([owner, operation, normalized_params, input_fingerprints], sort_keys=True)
+        return hashlib.sha256(key_data.encode('utf-8')).hexdigest()
+
+    def get(self, key, get_file_validator):
+        """
+        Gets the recorded result for a memo key
+
+        :return: the recorded result - None if there is no valid recorded result
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+
+        if entry is not None and time.time() - entry['created'] <= self._ttl:
+            # outputs that were deleted or overwritten on the server invalidate the result
+            if all(get_file_validator(url) == validator for url, validator in entry['outputs'].items()):
+                with self._lock:
+                    self._hits += 1
+                    if self._entries.get(key) is entry:
+                        # most recently used
+                        del self._entries[key]
+                        self._entries[key] = entry
+                return entry['result']
+
+        with self._lock:
+            if entry is not None:
+                self._remove_entry(key)
+                self._save()
+            self._misses += 1
+        return None
+
+    def put(self, key, result, get_file_validator):
+        outputs = {}
+        for value in result.values():
+            if _is_url(value):
+                validator = get_file_validator(value)
+                if validator is None:
+                    # can't check later if the output still exists
+                    return
+                outputs[value] = validator
+
+        with self._lock:
+            self._remove_entry(key)
+            self._add_entry(key, {'result': result, 'outputs': outputs, 'created': time.time()})
+            self._evict()
+            self._save()
+
+    def invalidate(self, file_url_path=None):
+        """
+        Removes recorded results - all results or only the ones that have the given file as an output
+        """
+        with self._lock:
+            if file_url_path is None:
+                self._entries.clear()
+                self._keys_by_output.clear()
+            else:
+                for key in list(self._keys_by_output.get(file_url_path, ())):
+                    self._remove_entry(key)
+            self._save()
+
+    def get_stats(self):
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses, 'entries': len(self._entries)}
+
+    def _get_input_fingerprint(self, file_url_path, get_file_validator):
+        # a file produced by a recorded operation (and not changed since) is identified by the operation that
+        # produced it, so that re-running the same chain of operations gives the same keys
+        validator = get_file_validator(file_url_path)
+        if validator is None:
+            return None
+        with self._lock:
+            for key in self._keys_by_output.get(file_url_path, ()):
+                if self._entries[key]['outputs'][file_url_path] == validator:
+                    return key
+        return validator
+
+    def _add_entry(self, key, entry):
+        self._entries[key] = entry
+        for url in entry['outputs']:
+            self._keys_by_output[url].add(key)
+
+    def _remove_entry(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for url in entry['outputs']:
+            keys = self._keys_by_output.get(url)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_output[url]
+
+    def _evict(self):
+        # removes the least recently used results till there are max_entries results
+        while len(self._entries) > self._max_entries:
+            self._remove_entry(next(iter(self._entries)))
+
+    def _save(self):
+        if not self._index_file:
+            return
+        temp_index_file = '{0}.{1}.tmp'.format(self._index_file, os.getpid())
+        with _locked_file(self._index_file + '.lock'):
+            with open(temp_index_file, 'w') as f:
+                json.dump(self._entries, f)
+            if os.name == 'nt' and os.path.isfile(self._index_file):
+                os.remove(self._index_file)
+            os.rename(temp_index_file, self._index_file)
+
+
+@contextlib.contextmanager
+def _locked_file(lock_file_name):
+    # an exclusive lock between processes for the duration of the with block
+    with open(lock_file_name, 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _is_url(value):
+    return hasattr(value, 'startswith') and value.startswith(('http://', 'https://'))
+
+
+class TileCache(object):
+    def __init__(self, tile_size=0.25, margin=0.01, max_tiles=16, max_workers=4, tile_prefix='tile',
+                 max_stored_tiles=256, max_tile_age=30 * 24 * 3600):
+        """
+        Create a cache of tiles of the static rasters on HydroDS that are in geographic coordinates (e.g.
+        nedWesternUS.tif - not nlcd2011CONUS.tif, which is in a projected coordinate system). Bounding boxes are
+        snapped to a fixed grid of tile_size degree tiles and each tile of a source raster is subset once into the
+        user's workspace on the HydroDS server, where it is reused by later jobs of that user. For a new bounding box
+        only the missing tiles are subset, and the tiles are combined into a mosaic that the job then subsets, so
+        nearby watersheds share most of their tiles. When the workspace is cleaned up only the max_stored_tiles most
+        recently used tiles that were used within max_tile_age are kept
+
+        :param tile_size: (optional) size of the tiles in decimal degrees (default is 0.25)
+        :type tile_size: float
+        :param margin: (optional) margin in decimal degrees added around a bounding box before it is snapped to the
+                       tiles (default is 0.01)
+        :type margin: float
+        :param max_tiles: (optional) max number of tiles for a bounding box - larger bounding boxes are subset from
+                          the static raster directly (default is 16)
+        :type max_tiles: int
+        :param max_workers: (optional) max number of tiles to subset or combine at the same time (default is 4)
+        :type max_workers: int
+        :param tile_prefix: (optional) prefix of the names of the tile files in the workspace (default is 'tile')
+        :type tile_prefix: string
+        :param max_stored_tiles: (optional) max number of tiles kept in the workspace of a user (default is 256)
+        :type max_stored_tiles: int
+        :param max_tile_age: (optional) seconds since a tile was last used after which it is not kept in the
+                             workspace (default is 30 days)
+        :type max_tile_age: float
+        :return: TileCache object
+
+        Example usage:
+            tile_cache = TileCache(tile_size=0.25)
+            hds = HydroDS(username=your_username, password=your_password)
+            response_data = tile_cache.subset_raster(hds, left=-111.97, top=42.11, right=-111.35, bottom=41.66,
+                                                     input_raster='nedWesternUS.tif',
+                                                     output_raster='subset_dem_logan.tif')
+            # the recently used tile files stay in the workspace when it is cleaned up
+            hds.delete_my_files(keep=tile_cache.get_tiles_to_keep(hds))
+        """
+        self._tile_size = tile_size
+        self._margin = margin
+        self._max_tiles = max_tiles
+        self._max_workers = max_workers
+        self._tile_prefix = tile_prefix
+        self._max_stored_tiles = max_stored_tiles
+        self._max_tile_age = max_tile_age
+        # tile size in arc seconds - part of the tile file names so that tiles of different grids don't mix
+        self._grid_name = '{0}{1}'.format(tile_prefix, int(round(tile_size * 3600)))
+        self._lock = threading.Lock()
+        # (HydroDS base url, user name, tile file name) -> [event set when done, url of the tile or None if failed]
+        # for the tiles being subset by this process
+        self._pending_tiles = {}
+        # (HydroDS base url, user name, tile file name) -> (url of the tile, time it was done) for the tiles subset by
+        # this process
+        self._recent_tiles = {}
+        # (HydroDS base url, user name, tile file name) -> time the tile was last used (or first seen in the
+        # workspace) by this process
+        self._tile_use_times = {}
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def tile_pattern(self):
+        # shell style pattern of the names of the tile files
+        return self._grid_name + '_*.tif'
+
+    def get_tiles(self, left, top, right, bottom):
+        """
+        Gets the tiles that cover a bounding box (with the margin added)
+
+        :return: a list of (column, row) of the tiles
+        """
+        first_column = int(math.floor((left - self._margin) / self._tile_size))
+        last_column = int(math.ceil((right + self._margin) / self._tile_size)) - 1
+        first_row = int(math.floor((bottom - self._margin) / self._tile_size))
+        last_row = int(math.ceil((top + self._margin) / self._tile_size)) - 1
+        return [(column, row) for row in range(last_row, first_row - 1, -1)
+                for column in range(first_column, last_column + 1)]
+
+    def get_tile_bounds(self, column, row):
+        """
+        :return: (left, top, right, bottom) of a tile
+        """
+        return (column * self._tile_size, (row + 1) * self._tile_size, (column + 1) * self._tile_size,
+                row * self._tile_size)
+
+    def get_tile_file_name(self, input_raster, column, row):
+        dataset_name = os.path.splitext(os.path.basename(input_raster))[0]
+        return '{0}_{1}_{2}_{3}.tif'.format(self._grid_name, dataset_name, column, row)
+
+    def get_mosaic(self, hds, input_raster, left, top, right, bottom, output_raster):
+        """
+        Gets a mosaic of the tiles of a static raster that cover a bounding box, subsetting the missing tiles
+
+        :param hds: HydroDS object to make the service calls with
+        :param input_raster: name of the static raster file on the HydroDS server
+        :param output_raster: name for the mosaic raster file
+        :return: a dictionary with key 'output_raster' and value of url path for the mosaic raster file
+        """
+        tiles = self.get_tiles(left, top, right, bottom)
+        list_time = time.time()
+        file_urls = dict((file_url.split('/')[-1], file_url) for file_url in hds.list_my_files())
+
+        def get_tile(tile):
+            tile_file_name = self.get_tile_file_name(input_raster, *tile)
+            key = (hds.hydro_ds_base_url, hds.username, tile_file_name)
+            with self._lock:
+                pending_tile = self._pending_tiles.get(key)
+                recent_tile = self._recent_tiles.get(key)
+                if pending_tile is None and tile_file_name in file_urls:
+                    self._hits += 1
+                    return file_urls[tile_file_name]
+                if pending_tile is None and recent_tile is not None and recent_tile[1] >= list_time:
+                    # subset by another job after the files were listed
+                    self._hits += 1
+                    return recent_tile[0]
+                if pending_tile is None:
+                    pending_tile = self._pending_tiles[key] = [threading.Event(), None]
+                    is_owner = True
+                else:
+                    is_owner = False
+
+            if not is_owner:
+                # another job of this process is subsetting the same tile
+                pending_tile[0].wait()
+                if pending_tile[1] is not None:
+                    with self._lock:
+                        self._hits += 1
+                    return pending_tile[1]
+                return self._subset_tile(hds, input_raster, tile, tile_file_name)
+
+            try:
+                pending_tile[1] = self._subset_tile(hds, input_raster, tile, tile_file_name)
+                return pending_tile[1]
+            finally:
+                with self._lock:
+                    self._pending_tiles.pop(key, None)
+                    if pending_tile[1] is not None:
+                        self._recent_tiles[key] = (pending_tile[1], time.time())
+                pending_tile[0].set()
+
+        executor = futures.ThreadPoolExecutor(max_workers=min(self._max_workers, len(tiles)))
+        try:
+            tile_urls = list(executor.map(get_tile, tiles))
+        finally:
+            executor.shutdown(wait=True)
+
+        use_time = time.time()
+        with self._lock:
+            for tile_url in tile_urls:
+                self._tile_use_times[(hds.hydro_ds_base_url, hds.username, tile_url.split('/')[-1])] = use_time
+
+        return hds.combine_raster_files(input_raster_url_paths=tile_urls, output_raster=output_raster,
+                                        max_workers=self._max_workers)
+
+    def subset_raster(self, hds, left, top, right, bottom, input_raster, output_raster):
+        """
+        Subsets a static raster to a bounding box from its tiles (same as HydroDS.subset_raster)
+
+        :return: a dictionary with key 'output_raster' and value of url path for the generated raster file
+        """
+        if len(self.get_tiles(left, top, right, bottom)) > self._max_tiles:
+            return hds.subset_raster(left=left, top=top, right=right, bottom=bottom, input_raster=input_raster,
+                                     output_raster=output_raster)
+
+        mosaic = self.get_mosaic(hds, input_raster, left, top, right, bottom,
+                                 output_raster=self._get_mosaic_file_name(output_raster))
+        return hds.subset_raster(left=left, top=top, right=right, bottom=bottom, input_raster=mosaic['output_raster'],
+                                 output_raster=output_raster)
+
+    def get_tiles_to_keep(self, hds):
+        """
+        Gets the names of the tile files in the workspace of a user to keep when the workspace is cleaned up - the
+        max_stored_tiles most recently used tiles that were used within max_tile_age. A tile this process has not
+        used yet (e.g. subset before a restart) counts as used when it is first seen here
+
+        :param hds: HydroDS object of the user
+        :return: a list of the tile file names (for the keep parameter of HydroDS.delete_my_files)
+        """
+        now = time.time()
+        tile_file_names = [file_url.split('/')[-1] for file_url in hds.list_my_files()
+                           if fnmatch.fnmatch(file_url.split('/')[-1], self.tile_pattern)]
+        with self._lock:
+            use_times = []
+            for tile_file_name in tile_file_names:
+                key = (hds.hydro_ds_base_url, hds.username, tile_file_name)
+                use_times.append((self._tile_use_times.setdefault(key, now), tile_file_name))
+
+            use_times.sort(reverse=True)
+            keep_file_names = [tile_file_name for use_time, tile_file_name in use_times[:self._max_stored_tiles]
+                               if now - use_time <= self._max_tile_age]
+
+            # forget the tiles of this user that are going to be deleted
+            keep_keys = set((hds.hydro_ds_base_url, hds.username, tile_file_name)
+                            for tile_file_name in keep_file_names)
+            for tiles in (self._tile_use_times, self._recent_tiles):
+                for key in list(tiles):
+                    if key[:2] == (hds.hydro_ds_base_url, hds.username) and key not in keep_keys:
+                        del tiles[key]
+        return keep_file_names
+
+    def get_stats(self):
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses}
+
+    def _subset_tile(self, hds, input_raster, tile, tile_file_name):
+        with self._lock:
+            self._misses += 1
+        tile_left, tile_top, tile_right, tile_bottom = self.get_tile_bounds(*tile)
+        return hds.subset_raster(left=tile_left, top=tile_top, right=tile_right, bottom=tile_bottom,
+                                 input_raster=input_raster, output_raster=tile_file_name)['output_raster']
+
+    @staticmethod
+    def _get_mosaic_file_name(output_raster):
+        return 'mosaic_' + output_raster
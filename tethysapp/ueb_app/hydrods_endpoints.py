@@ -0,0 +1,298 @@
+"""
+Circuit breakers and health checked endpoint pools for the HydroDS hosts
+"""
+
+import time
+import threading
+
+import requests
+
+# (connect, read) timeouts in seconds for calls that don't set their own
+default_timeout = (10, 900)
+
+# services that submit a job - calling them again after the request may have reached the server would submit the
+# job again
+default_non_idempotent_paths = frozenset(['/api/dataservice/createuebinput', '/api/dataservice/runuebmodel'])
+
+
+class EndpointUnavailableException(Exception):
+    pass
+
+
+class CircuitBreaker(object):
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        """
+        Create a circuit breaker for a host. After failure_threshold consecutive failures (connection errors,
+        timeouts, gateway errors) the circuit opens and calls to the host fail fast. After reset_timeout seconds one
+        trial call is let through (half open) - the circuit closes again if it succeeds, otherwise it stays open for
+        another reset_timeout seconds
+
+        :param failure_threshold: (optional) number of consecutive failures that open the circuit (default is 5)
+        :param reset_timeout: (optional) seconds the circuit stays open before a trial call (default is 30)
+        :return: CircuitBreaker object
+        """
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._failures = 0
+        self._opened_time = None
+        self._trial_in_progress = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == 'open' and time.time() - self._opened_time >= self._reset_timeout:
+                return 'half-open'
+            return self._state
+
+    def allow_request(self):
+        with self._lock:
+            if self._state == 'closed':
+                return True
+            if time.time() - self._opened_time < self._reset_timeout or self._trial_in_progress:
+                return False
+            self._trial_in_progress = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = 'closed'
+            self._failures = 0
+            self._trial_in_progress = False
+
+    def record_no_outcome(self):
+        # a call that failed for a reason other than the host - lets the next call be the trial call
+        with self._lock:
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_progress or self._failures >= self._failure_threshold:
+                self._state = 'open'
+                self._opened_time = time.time()
+            self._trial_in_progress = False
+
+
+# circuit breakers of all the hosts this process talks to
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(base_url):
+    with _circuit_breakers_lock:
+        circuit_breaker = _circuit_breakers.get(base_url)
+        if circuit_breaker is None:
+            circuit_breaker = CircuitBreaker()
+            _circuit_breakers[base_url] = circuit_breaker
+        return circuit_breaker
+
+
+def is_host_failure(response=None, exception=None):
+    # failures that tell about the health of the host rather than the request
+    if exception is not None:
+        return isinstance(exception, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+    return response.status_code in (502, 503, 504)
+
+
+def is_connect_error(exception):
+    # the request did not reach the server (connection refused or timed out while connecting)
+    if isinstance(exception, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(exception, requests.exceptions.ConnectionError) and exception.args:
+        reason = getattr(exception.args[0], 'reason', None)
+        return type(reason).__name__ in ('NewConnectionError', 'ConnectTimeoutError')
+    return False
+
+
+class EndpointPool(object):
+    def __init__(self, base_urls, health_check_path='/', health_check_interval=30, timeout=default_timeout,
+                 non_idempotent_paths=None):
+        """
+        Create a pool of replica hosts of a service. Calls are routed to the host with the lowest recent latency
+        among the hosts whose circuit breaker is closed, and the hosts are health checked from a background thread
+        (only if there is more than one host) so that a slow or failed host is avoided and a recovered host is used
+        again
+
+        :param base_urls: base urls of the hosts (e.g. ['http://129.123.41.218:20199'])
+        :type base_urls: list
+        :param health_check_path: (optional) path on each host to check (default is '/') - any response with http
+                                  status below 500 counts as healthy
+        :param health_check_interval: (optional) seconds between two health checks of a host (default is 30)
+        :param timeout: (optional) default (connect, read) timeout in seconds for calls
+        :param non_idempotent_paths: (optional) paths of the services that must not be called again on another host
+                                     once the request may have reached the server (default is
+                                     default_non_idempotent_paths)
+        :return: EndpointPool object
+
+        Example usage:
+            pool = EndpointPool(['http://host-1:20199', 'http://host-2:20199'])
+            response = pool.get('/api/dataservice/job/check_job_status', params=payload, auth=auth)
+        """
+        if not base_urls:
+            raise ValueError("At least one base url is needed for an endpoint pool.")
+
+        self._base_urls = [base_url.rstrip('/') for base_url in base_urls]
+        self._health_check_path = health_check_path
+        self._health_check_interval = health_check_interval
+        self._timeout = timeout
+        if non_idempotent_paths is None:
+            non_idempotent_paths = default_non_idempotent_paths
+        self._non_idempotent_paths = frozenset(non_idempotent_paths)
+        self._lock = threading.Lock()
+        # exponentially weighted moving average of the latency (seconds) of each host
+        self._latencies = dict((base_url, None) for base_url in self._base_urls)
+        self._request_counts = dict((base_url, 0) for base_url in self._base_urls)
+        self._stop_event = threading.Event()
+        self._health_check_thread = None
+
+    @property
+    def base_urls(self):
+        return list(self._base_urls)
+
+    def choose(self, allow_unavailable=False):
+        """
+        Chooses the host for the next call
+
+        :param allow_unavailable: (optional) if a host is to be returned even when all the hosts are unavailable
+        :return: base url of the chosen host
+        :raises: EndpointUnavailableException if the circuit breakers of all the hosts are open
+        """
+        self._start_health_checks()
+        with self._lock:
+            latencies = dict(self._latencies)
+        available_base_urls = [base_url for base_url in self._base_urls
+                               if get_circuit_breaker(base_url).state != 'open']
+        if not available_base_urls:
+            if allow_unavailable:
+                return self._base_urls[0]
+            raise EndpointUnavailableException("None of the hosts {0} is available.".format(
+                ', '.join(self._base_urls)))
+
+        # hosts without a latency measurement yet are tried first
+        return min(available_base_urls, key=lambda base_url: (latencies[base_url] is not None,
+                                                              latencies[base_url]))
+
+    def request(self, http_method, path, idempotent=None, **kwargs):
+        """
+        Makes a call to the chosen host. An idempotent call that fails because of the host (connection error,
+        timeout, gateway error) is made again on the next available host. A non idempotent call is made again only
+        if the request did not reach the host (connection refused or timed out while connecting)
+
+        :param idempotent: (optional) if the call can be made again (default is True for GET calls to paths that
+                           are not in non_idempotent_paths)
+        :return: the response
+        """
+        if idempotent is None:
+            idempotent = http_method == 'GET' and path.split('?')[0] not in self._non_idempotent_paths
+        kwargs.setdefault('timeout', self._timeout)
+        tried_base_urls = set()
+        while True:
+            base_url = self._choose_untried(tried_base_urls)
+            tried_base_urls.add(base_url)
+            circuit_breaker = get_circuit_breaker(base_url)
+            if not circuit_breaker.allow_request():
+                continue
+
+            start_time = time.time()
+            try:
+                response = requests.request(http_method, base_url + path, **kwargs)
+            except Exception as ex:
+                if is_host_failure(exception=ex):
+                    circuit_breaker.record_failure()
+                    if (idempotent or is_connect_error(ex)) and len(tried_base_urls) < len(self._base_urls):
+                        continue
+                else:
+                    # the failure (e.g. too many redirects, invalid url) tells nothing about the host
+                    circuit_breaker.record_no_outcome()
+                raise
+
+            self._record_latency(base_url, time.time() - start_time)
+            if is_host_failure(response=response):
+                circuit_breaker.record_failure()
+                if idempotent and len(tried_base_urls) < len(self._base_urls):
+                    continue
+            else:
+                circuit_breaker.record_success()
+            return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def check_health(self):
+        """
+        Checks all the hosts now
+
+        :return: a dict of base url to True/False (healthy or not)
+        """
+        health = {}
+        for base_url in self._base_urls:
+            start_time = time.time()
+            try:
+                response = requests.get(base_url + self._health_check_path, timeout=(5, 10))
+                health[base_url] = response.status_code < 500
+            except requests.exceptions.RequestException:
+                health[base_url] = False
+
+            circuit_breaker = get_circuit_breaker(base_url)
+            if health[base_url]:
+                self._record_latency(base_url, time.time() - start_time)
+                circuit_breaker.record_success()
+            else:
+                circuit_breaker.record_failure()
+        return health
+
+    def stop_health_checks(self):
+        self._stop_event.set()
+
+    def get_stats(self):
+        """
+        :return: a dict of base url to a dict with keys 'state' (circuit breaker state), 'latency' (recent latency
+                 in seconds) and 'requests' (number of calls routed to the host)
+        """
+        with self._lock:
+            return dict((base_url, {'state': get_circuit_breaker(base_url).state,
+                                    'latency': self._latencies[base_url],
+                                    'requests': self._request_counts[base_url]})
+                        for base_url in self._base_urls)
+
+    def _choose_untried(self, tried_base_urls):
+        self._start_health_checks()
+        untried_base_urls = [base_url for base_url in self._base_urls if base_url not in tried_base_urls and
+                             get_circuit_breaker(base_url).state != 'open']
+        if not untried_base_urls:
+            raise EndpointUnavailableException("None of the hosts {0} is available.".format(
+                ', '.join(self._base_urls)))
+        with self._lock:
+            base_url = min(untried_base_urls, key=lambda url: (self._latencies[url] is not None,
+                                                               self._latencies[url]))
+            self._request_counts[base_url] += 1
+        return base_url
+
+    def _record_latency(self, base_url, latency):
+        with self._lock:
+            previous_latency = self._latencies[base_url]
+            if previous_latency is None:
+                self._latencies[base_url] = latency
+            else:
+                self._latencies[base_url] = 0.8 * previous_latency + 0.2 * latency
+
+    def _start_health_checks(self):
+        # a single host is used whatever its health, so it is not checked
+        if len(self._base_urls) < 2 or self._health_check_thread is not None:
+            return
+        with self._lock:
+            if self._health_check_thread is not None:
+                return
+            self._health_check_thread = threading.Thread(target=self._run_health_checks,
+                                                         name='hydrods-endpoint-health-check')
+            self._health_check_thread.daemon = True
+            self._health_check_thread.start()
+
+    def _run_health_checks(self):
+        while not self._stop_event.wait(self._health_check_interval):
+            self.check_health()
@@ -0,0 +1,206 @@
+"""
+In-process metrics of the HydroDS service calls
+"""
+
+import json
+import threading
+
+# bucket upper bounds for the time (seconds) and size (bytes) histograms
+time_buckets = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+size_buckets = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2, 1024 ** 3)
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        """
+        Create a histogram with fixed buckets. Each bucket counts the observed values that are less than or equal to
+        its upper bound (and greater than the upper bound of the previous bucket), the last bucket counts the values
+        greater than the largest bound
+
+        :param buckets: upper bounds of the buckets in increasing order
+        :return: Histogram object
+        """
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._min = None
+        self._max = None
+
+    def observe(self, value):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        self._counts[index] += 1
+        self._count += 1
+        self._sum += value
+        self._min = value if self._min is None else min(self._min, value)
+        self._max = value if self._max is None else max(self._max, value)
+
+    def get_quantile(self, quantile):
+        """
+        Estimates a quantile (e.g. 0.95) of the observed values by linear interpolation within the bucket it falls in
+
+        :return: the estimated value (None if no values were observed)
+        """
+        if self._count == 0:
+            return None
+
+        rank = quantile * self._count
+        cumulative_count = 0
+        for index, count in enumerate(self._counts):
+            if count and cumulative_count + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else self._min
+                upper = self.buckets[index] if index < len(self.buckets) else self._max
+                lower = max(lower, self._min)
+                upper = min(upper, self._max)
+                return lower + (upper - lower) * (rank - cumulative_count) / float(count)
+            cumulative_count += count
+        return self._max
+
+    def to_dict(self):
+        return {'count': self._count, 'sum': self._sum, 'min': self._min, 'max': self._max,
+                'p50': self.get_quantile(0.5), 'p95': self.get_quantile(0.95), 'p99': self.get_quantile(0.99),
+                'buckets': list(zip([str(bound) for bound in self.buckets] + ['+Inf'], self._counts))}
+
+
+class ServiceMetrics(object):
+    # histograms kept for each service
+    _histograms = (('wall_time_seconds', time_buckets), ('time_to_first_byte_seconds', time_buckets),
+                   ('processing_time_seconds', time_buckets), ('request_bytes', size_buckets),
+                   ('response_bytes', size_buckets))
+
+    def __init__(self):
+        """
+        Create a registry of HydroDS service call metrics: histograms of the wall time, time to first byte, response
+        processing time (including download of output files) and request/response sizes, and counters of the
+        response status codes and retries for each service
+
+        Example usage:
+            hds = HydroDS(username=your_username, password=your_password)
+            # run a job with hds ...
+            for service_name, metrics in service_metrics.get_summary().items():
+                print(service_name, metrics['calls'], metrics['wall_time_seconds']['sum'])
+            print(service_metrics.to_prometheus())
+        """
+        self._lock = threading.Lock()
+        self._services = {}
+
+    def record_request(self, service_name, wall_time, time_to_first_byte, request_bytes, response_bytes, status):
+        """
+        Records one http call to a service
+
+        :param status: http status code of the response, or the name of the exception if there was no response
+        """
+        with self._lock:
+            service = self._get_service(service_name)
+            service['calls'] += 1
+            service['status'][str(status)] = service['status'].get(str(status), 0) + 1
+            service['wall_time_seconds'].observe(wall_time)
+            if time_to_first_byte is not None:
+                service['time_to_first_byte_seconds'].observe(time_to_first_byte)
+            service['request_bytes'].observe(request_bytes)
+            if response_bytes is not None:
+                service['response_bytes'].observe(response_bytes)
+
+    def record_processing(self, service_name, processing_time, outcome):
+        """
+        Records the handling of a service response
+
+        :param outcome: 'success' or the name of the exception raised for the response
+        """
+        with self._lock:
+            service = self._get_service(service_name)
+            service['processing_time_seconds'].observe(processing_time)
+            service['outcomes'][outcome] = service['outcomes'].get(outcome, 0) + 1
+
+    def record_retry(self, service_name):
+        with self._lock:
+            self._get_service(service_name)['retries'] += 1
+
+    def get_summary(self):
+        """
+        :return: a dict with service name as key and a dict of the metrics of that service as value
+        """
+        with self._lock:
+            summary = {}
+            for service_name, service in self._services.items():
+                summary[service_name] = {'calls': service['calls'], 'retries': service['retries'],
+                                         'status': dict(service['status']), 'outcomes': dict(service['outcomes'])}
+                for histogram_name, _ in self._histograms:
+                    summary[service_name][histogram_name] = service[histogram_name].to_dict()
+            return summary
+
+    def get_top_services(self, count=10):
+        """
+        :return: a list of (service name, total wall time) for the services that took the most time in total
+        """
+        summary = self.get_summary()
+        service_times = [(service_name, metrics['wall_time_seconds']['sum'] + metrics['processing_time_seconds']['sum'])
+                         for service_name, metrics in summary.items()]
+        return sorted(service_times, key=lambda item: item[1], reverse=True)[:count]
+
+    def dump(self, file_name=None):
+        """
+        Dumps the metrics as json
+
+        :param file_name: (optional) file to write the json to
+        :return: the json string
+        """
+        metrics_json = json.dumps(self.get_summary(), indent=2, sort_keys=True)
+        if file_name:
+            with open(file_name, 'w') as f:
+                f.write(metrics_json)
+        return metrics_json
+
+    def to_prometheus(self, prefix='hydrods'):
+        """
+        :return: the metrics in the Prometheus text exposition format
+        """
+        lines = []
+        summary = self.get_summary()
+        for counter_name in ('calls', 'retries'):
+            metric_name = '{0}_service_{1}_total'.format(prefix, counter_name)
+            lines.append('# TYPE {0} counter'.format(metric_name))
+            for service_name in sorted(summary):
+                lines.append('{0}{{service="{1}"}} {2}'.format(metric_name, service_name,
+                                                               summary[service_name][counter_name]))
+
+        for counter_name, label_name in (('status', 'status'), ('outcomes', 'outcome')):
+            metric_name = '{0}_service_{1}_total'.format(prefix, label_name)
+            lines.append('# TYPE {0} counter'.format(metric_name))
+            for service_name in sorted(summary):
+                for label_value, count in sorted(summary[service_name][counter_name].items()):
+                    lines.append('{0}{{service="{1}",{2}="{3}"}} {4}'.format(metric_name, service_name, label_name,
+                                                                            label_value, count))
+
+        for histogram_name, _ in self._histograms:
+            metric_name = '{0}_service_{1}'.format(prefix, histogram_name)
+            lines.append('# TYPE {0} histogram'.format(metric_name))
+            for service_name in sorted(summary):
+                histogram = summary[service_name][histogram_name]
+                cumulative_count = 0
+                for bound, count in histogram['buckets']:
+                    cumulative_count += count
+                    lines.append('{0}_bucket{{service="{1}",le="{2}"}} {3}'.format(metric_name, service_name, bound,
+                                                                                  cumulative_count))
+                lines.append('{0}_sum{{service="{1}"}} {2}'.format(metric_name, service_name, histogram['sum']))
+                lines.append('{0}_count{{service="{1}"}} {2}'.format(metric_name, service_name, histogram['count']))
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._services = {}
+
+    def _get_service(self, service_name):
+        service = self._services.get(service_name)
+        if service is None:
+            service = {'calls': 0, 'retries': 0, 'status': {}, 'outcomes': {}}
+            for histogram_name, buckets in self._histograms:
+                service[histogram_name] = Histogram(buckets)
+            self._services[service_name] = service
+        return service
+
+
+# metrics of all the HydroDS clients in this process
+service_metrics = ServiceMetrics()
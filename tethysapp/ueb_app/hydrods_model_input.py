@@ -1,12 +1,18 @@
 import shutil
-from datetime import datetime
+import functools
+from concurrent import futures
+import calendar
+from datetime import datetime, date
 import tempfile
 import os
 import requests,json
 from user_settings import *
 
-from hydrogate import HydroDS
-from model_parameters_list import file_contents_dict
+from hydrogate import hydrods_client_pool, hydrods_client_wait_timeout, hydrods_service_endpoints, \
+    HydroDSClientUnavailableException
+from hydrods_pipeline import Pipeline, PipelineError
+from hydrods_cache import TileCache
+from model_parameters_list import render_parameter_files, model_parameter_files
 
 
 def hydrods_model_input_service_single_call(hs_client_id, hs_client_secret, token, hydrods_name, hydrods_password,
@@ -24,7 +30,7 @@ def hydrods_model_input_service_single_call(hs_client_id, hs_client_secret, toke
     }
 
     try:
-        url = 'http://129.123.41.218:20199/api/dataservice/createuebinput'  # TODO: change to production server link
+        url_path = '/api/dataservice/createuebinput'  # TODO: change to production server link
         auth = (hydrods_name, hydrods_password)  # TODO: change to production account info
         payload = {
             'hs_username': hs_name,
@@ -62,7 +68,7 @@ def hydrods_model_input_service_single_call(hs_client_id, hs_client_secret, toke
             payload['lat_outlet'] = lat_outlet
             payload['lon_outlet'] = lon_outlet
 
-        response = requests.get(url, params=payload, auth=auth)
+        response = hydrods_service_endpoints.get(url_path, params=payload, auth=auth, idempotent=False)
         response_dict = json.loads(response.text)
 
         if response.status_code == 200:
@@ -87,290 +93,435 @@ def hydrods_model_input_service(hs_name, hs_password, hydrods_name, hydrods_pass
                                 res_title, res_keywords,
                                  **kwargs):
 
+    # each job gets a HydroDS client of its own from the pool for the whole run - a job of the same HydroDS account
+    # that is already running has the workspace till it is done
+    try:
+        HDS = hydrods_client_pool.acquire(username=hydrods_name, password=hydrods_password,
+                                          timeout=hydrods_client_wait_timeout)
+    except HydroDSClientUnavailableException:
+        return {
+            'status': 'Error',
+            'result': 'The HydroDS account is busy with another job. Please try again in a few minutes.'
+        }
+
+    try:
+        return _hydrods_model_input_service(HDS, hs_name, hs_password, topY, bottomY, leftX, rightX,
+                                            lat_outlet, lon_outlet, streamThreshold, watershedName,
+                                            epsgCode, startDateTime, endDateTime, dx, dy, dxRes, dyRes,
+                                            usic, wsic, tic, wcic, ts_last,
+                                            res_title, res_keywords)
+    finally:
+        hydrods_client_pool.release(HDS)
+
+
+# tiles of the static DEM and NLCD rasters shared by the jobs of this process
+tile_cache = TileCache()
+
+
+# error message reported for a failed step of the model input pipeline
+_step_error_messages = {
+    'cleanup': 'Please provide the correct user name and password to use HydroDS web services.',
+    'watershed': 'Failed to prepare the watershed DEM data.',
+    'aspect': 'Failed to prepare the terrain variables.',
+    'slope': 'Failed to prepare the terrain variables.',
+    'canopy': 'Failed to prepare the terrain variables.',
+    'cc': 'Failed to prepare the terrain variables.',
+    'hcan': 'Failed to prepare the terrain variables.',
+    'lai': 'Failed to prepare the terrain variables.',
+    'terrain': 'Failed to prepare the terrain variables.',
+    'climate': 'Failed to prepare the climate variables.',
+    'parameter_files': 'Failed to prepare the model parameter files.',
+    'share': 'Failed to share the results to HydroShare.',
+}
+
+
+# Daymet climate variables and land cover (canopy) variables of the model input
+climate_Vars = ['vp', 'tmin', 'tmax', 'srad', 'prcp']
+canopy_Vars = ['cc', 'hcan', 'lai']
+
+
+def _get_pipeline_error_message(failures):
+    step_name, step_exception = failures[0]
+    if not step_name.startswith('climate_'):
+        return _step_error_messages[step_name] + str(step_exception)
+
+    # the climate variables run at the same time, so all the variables that failed are reported
+    climate_errors = ['{0}: {1}'.format(name[len('climate_'):], exception) for name, exception in failures
+                      if name.startswith('climate_')]
+    return _step_error_messages['climate'] + ' ' + '; '.join(climate_errors)
+
+
+def _hydrods_model_input_service(HDS, hs_name, hs_password, topY, bottomY, leftX, rightX,
+                                 lat_outlet, lon_outlet, streamThreshold, watershedName,
+                                 epsgCode, startDateTime, endDateTime, dx, dy, dxRes, dyRes,
+                                 usic, wsic, tic, wcic, ts_last,
+                                 res_title, res_keywords):
+
     # TODO: pass the HydroShare user token, client id, client secret not the user name and password
     service_response = {
         'status': 'Success',
         'result': 'The model input has been shared in HydroShare'
     }
 
-    # Authentication
-    try:
-        HDS = HydroDS(username=hydrods_name, password=hydrods_password)
-        for item in HDS.list_my_files():
-            try:
-                HDS.delete_my_file(item.split('/')[-1])
+    # the Daymet files have no data for a model run that falls only on December 31 of a leap year (or ends before it
+    # starts), so there would be no climate data to subset
+    climate_time_windows = _get_climate_time_windows(startDateTime, endDateTime)
+    if not climate_time_windows:
+        service_response['status'] = 'Error'
+        service_response['result'] = 'Failed to prepare the climate variables. There is no Daymet climate data for ' \
+                                     'the model run from {0} to {1}.'.format(startDateTime, endDateTime)
+        return service_response
 
-            except Exception as e:
-                continue
+    # the terrain and climate variables only depend on the watershed, and the parameter files only on the cleaned up
+    # workspace, so these run at the same time
+    pipeline = Pipeline(max_workers=10)
+    pipeline.add_step('cleanup', _clean_workspace, inputs=['HDS'], outputs=['workspace'])
+    pipeline.add_step('watershed', _prepare_watershed,
+                      inputs=['HDS', 'workspace', 'topY', 'bottomY', 'leftX', 'rightX', 'lat_outlet', 'lon_outlet',
+                              'streamThreshold', 'watershedName', 'epsgCode', 'dx', 'dy', 'dxRes', 'dyRes'],
+                      outputs=['WatershedDEM', 'Watershed', 'Watershed_NC'])
+    # aspect, slope and the canopy variables are prepared by steps of their own
+    pipeline.add_step('aspect', _prepare_aspect,
+                      inputs=['HDS', 'WatershedDEM', 'watershedName', 'dx', 'dy', 'dxRes', 'dyRes'],
+                      outputs=['aspect_nc'])
+    pipeline.add_step('slope', _prepare_slope,
+                      inputs=['HDS', 'WatershedDEM', 'watershedName', 'dx', 'dy', 'dxRes', 'dyRes'],
+                      outputs=['slope_nc'])
+    pipeline.add_step('canopy', _prepare_canopy,
+                      inputs=['HDS', 'Watershed', 'watershedName', 'dxRes'],
+                      outputs=['canopy_' + var for var in canopy_Vars])
+    for var in canopy_Vars:
+        pipeline.add_step(var, functools.partial(_rename_canopy_variable, var=var),
+                          inputs=['HDS', 'canopy_' + var], outputs=[var + '_nc'])
+    pipeline.add_step('terrain', _collect_terrain_files,
+                      inputs=['aspect_nc', 'slope_nc'] + [var + '_nc' for var in canopy_Vars],
+                      outputs=['terrain_files'])
+    # each climate variable is prepared by a step of its own
+    for var in climate_Vars:
+        pipeline.add_step('climate_' + var, functools.partial(_prepare_climate_variable, var=var),
+                          inputs=['HDS', 'Watershed', 'Watershed_NC', 'watershedName', 'climate_time_windows'],
+                          outputs=['climate_' + var])
+    pipeline.add_step('climate', _collect_climate_files, inputs=['climate_' + var for var in climate_Vars],
+                      outputs=['climate_files'])
+    pipeline.add_step('parameter_files', _prepare_parameter_files,
+                      inputs=['HDS', 'workspace', 'topY', 'bottomY', 'leftX', 'rightX', 'startDateTime', 'endDateTime',
+                              'usic', 'wsic', 'tic', 'wcic', 'ts_last'],
+                      outputs=['parameter_file_names'])
+    pipeline.add_step('share', _share_model_input,
+                      inputs=['HDS', 'terrain_files', 'climate_files', 'parameter_file_names', 'hs_name',
+                              'hs_password', 'topY', 'bottomY', 'leftX', 'rightX', 'watershedName', 'startDateTime',
+                              'endDateTime', 'res_title', 'res_keywords'],
+                      outputs=['res_info'])
 
-    except Exception as e:
+    try:
+        pipeline_run = pipeline.run(HDS=HDS, hs_name=hs_name, hs_password=hs_password, topY=topY, bottomY=bottomY,
+                                    leftX=leftX, rightX=rightX, lat_outlet=lat_outlet, lon_outlet=lon_outlet,
+                                    streamThreshold=streamThreshold, watershedName=watershedName, epsgCode=epsgCode,
+                                    startDateTime=startDateTime, endDateTime=endDateTime, dx=dx, dy=dy, dxRes=dxRes,
+                                    dyRes=dyRes, usic=usic, wsic=wsic, tic=tic, wcic=wcic, ts_last=ts_last,
+                                    res_title=res_title, res_keywords=res_keywords,
+                                    climate_time_windows=climate_time_windows)
+    except PipelineError as e:
         service_response['status'] = 'Error'
-        service_response['result'] = 'Please provide the correct user name and password to use HydroDS web services.' + e.message
+        service_response['result'] = _get_pipeline_error_message(e.failures)
+        # TODO clean up the space
         return service_response
-    # TODO: create new folder for new job
 
+    service_response['result'] = "A model instance resource with name '{}' has been created with link https://www.hydroshare.org/resoruce/{}".format(
+                                    res_title, pipeline_run.values['res_info']['resource_id'])
+    service_response['critical_path'] = pipeline_run.get_critical_path()
 
-    # prepare watershed DEM data
-    try:
-        input_static_DEM  = 'nedWesternUS.tif'
-        subsetDEM_request = HDS.subset_raster(input_raster=input_static_DEM, left=leftX, top=topY, right=rightX,
-                                          bottom=bottomY, output_raster=watershedName + 'DEM84.tif')
-
-        #Options for projection with epsg full list at: http://spatialreference.org/ref/epsg/
-        myWatershedDEM = watershedName + 'Proj' + str(dx) + '.tif'
-        WatershedDEM = HDS.project_resample_raster(input_raster_url_path=subsetDEM_request['output_raster'],
-                                                          cell_size_dx=dx, cell_size_dy=dy, epsg_code=epsgCode,
-                                                          output_raster=myWatershedDEM, resample='bilinear')
-
-        outlet_shapefile_result = HDS.create_outlet_shapefile(point_x=lon_outlet, point_y=lat_outlet,
-                                                          output_shape_file_name=watershedName+'Outlet.shp')
-        project_shapefile_result = HDS.project_shapefile(outlet_shapefile_result['output_shape_file_name'], watershedName + 'OutletProj.shp',
-                                                     epsg_code=epsgCode)
-
-        Watershed_hires = HDS.delineate_watershed(WatershedDEM['output_raster'],
-                        input_outlet_shapefile_url_path=project_shapefile_result['output_shape_file'],
-                        threshold=streamThreshold, epsg_code=epsgCode,
-                        output_raster=watershedName + str(dx) + 'WS.tif',
-                        output_outlet_shapefile=watershedName + 'movOutlet.shp')
-
-        #HDS.download_file(file_url_path=Watershed_hires['output_raster'], save_as=workingDir+watershedName+str(dx)+'.tif')
-
-        ####Resample watershed grid to coarser grid
-        if dxRes == dx and dyRes == dy:
-            Watershed = Watershed_hires
-        else:
-            Watershed = HDS.resample_raster(input_raster_url_path = Watershed_hires['output_raster'],
-                    cell_size_dx=dxRes, cell_size_dy=dyRes, resample='near', output_raster=watershedName + str(dxRes) + 'WS.tif')
+    return service_response
 
-        #HDS.download_file(file_url_path=Watershed['output_raster'], save_as=workingDir+watershedName+str(dxRes)+'.tif')
 
-        ##  Convert to netCDF for UEB input
-        Watershed_temp = HDS.raster_to_netcdf(Watershed['output_raster'], output_netcdf='watershed'+str(dxRes)+'.nc')
+def _clean_workspace(HDS):
+    # Authentication (files that fail to delete are left in place, the recently used static data tiles are kept for
+    # later jobs)
+    HDS.delete_my_files(keep=tile_cache.get_tiles_to_keep(HDS))
+    # TODO: create new folder for new job
 
-        # In the netCDF file rename the generic variable "Band1" to "watershed"
-        Watershed_NC = HDS.netcdf_rename_variable(input_netcdf_url_path=Watershed_temp['output_netcdf'],
-                                    output_netcdf='watershed.nc', input_variable_name='Band1', output_variable_name='watershed')
-    except Exception as e:
-        service_response['status'] = 'Error'
-        service_response['result'] = 'Failed to prepare the watershed DEM data.'+ e.message
-        # TODO clean up the space
-        return service_response
+    return {'workspace': True}
 
 
+def _prepare_watershed(HDS, workspace, topY, bottomY, leftX, rightX, lat_outlet, lon_outlet, streamThreshold,
+                       watershedName, epsgCode, dx, dy, dxRes, dyRes):
+    # prepare watershed DEM data
+    input_static_DEM  = 'nedWesternUS.tif'
+    subsetDEM_request = tile_cache.subset_raster(HDS, input_raster=input_static_DEM, left=leftX, top=topY,
+                                      right=rightX, bottom=bottomY, output_raster=watershedName + 'DEM84.tif')
 
-    # prepare the terrain variables
-    try:
-        # aspect
-        aspect_hires = HDS.create_raster_aspect(input_raster_url_path=WatershedDEM['output_raster'],
-                                    output_raster=watershedName + 'Aspect' + str(dx)+ '.tif')
+    #Options for projection with epsg full list at: http://spatialreference.org/ref/epsg/
+    myWatershedDEM = watershedName + 'Proj' + str(dx) + '.tif'
+    WatershedDEM = HDS.project_resample_raster(input_raster_url_path=subsetDEM_request['output_raster'],
+                                                      cell_size_dx=dx, cell_size_dy=dy, epsg_code=epsgCode,
+                                                      output_raster=myWatershedDEM, resample='bilinear')
 
-        if dx == dxRes and dy == dyRes:
-            aspect = aspect_hires
-        else:
-            aspect = HDS.resample_raster(input_raster_url_path= aspect_hires['output_raster'], cell_size_dx=dxRes,
-                                    cell_size_dy=dyRes, resample='near', output_raster=watershedName + 'Aspect' + str(dxRes) + '.tif')
-        aspect_temp = HDS.raster_to_netcdf(input_raster_url_path=aspect['output_raster'],output_netcdf='aspect'+str(dxRes)+'.nc')
-        aspect_nc = HDS.netcdf_rename_variable(input_netcdf_url_path=aspect_temp['output_netcdf'],
-                                    output_netcdf='aspect.nc', input_variable_name='Band1', output_variable_name='aspect')
-        # slope
-        slope_hires = HDS.create_raster_slope(input_raster_url_path=WatershedDEM['output_raster'],
-                                    output_raster=watershedName + 'Slope' + str(dx) + '.tif')
-
-        if dx == dxRes and dy == dyRes:
-            slope = slope_hires
-        else:
-            slope = HDS.resample_raster(input_raster_url_path= slope_hires['output_raster'], cell_size_dx=dxRes,
-                                    cell_size_dy=dyRes, resample='near', output_raster=watershedName + 'Slope' + str(dxRes) + '.tif')
-        slope_temp = HDS.raster_to_netcdf(input_raster_url_path=slope['output_raster'], output_netcdf='slope'+str(dxRes)+'.nc')
-        slope_nc = HDS.netcdf_rename_variable(input_netcdf_url_path=slope_temp['output_netcdf'],
-                                    output_netcdf='slope.nc', input_variable_name='Band1', output_variable_name='slope')
-
-        #Land cover variables
-        nlcd_raster_resource = 'nlcd2011CONUS.tif'
-        subset_NLCD_result = HDS.project_clip_raster(input_raster=nlcd_raster_resource,
-                                    ref_raster_url_path=Watershed['output_raster'],
-                                    output_raster=watershedName + 'nlcdProj' + str(dxRes) + '.tif')
-        #cc
-        nlcd_variable_result = HDS.get_canopy_variable(input_NLCD_raster_url_path=subset_NLCD_result['output_raster'],
-                                    variable_name='cc', output_netcdf=watershedName+str(dxRes)+'cc.nc')
-        cc_nc = HDS.netcdf_rename_variable(input_netcdf_url_path=nlcd_variable_result['output_netcdf'],
-                                    output_netcdf='cc.nc', input_variable_name='Band1', output_variable_name='cc')
-        #hcan
-        nlcd_variable_result = HDS.get_canopy_variable(input_NLCD_raster_url_path=subset_NLCD_result['output_raster'],
-                                    variable_name='hcan', output_netcdf=watershedName+str(dxRes)+'hcan.nc')
-        hcan_nc = HDS.netcdf_rename_variable(input_netcdf_url_path=nlcd_variable_result['output_netcdf'],
-                                    output_netcdf='hcan.nc', input_variable_name='Band1',output_variable_name='hcan')
-        #lai
-        nlcd_variable_result = HDS.get_canopy_variable(input_NLCD_raster_url_path=subset_NLCD_result['output_raster'],
-                                    variable_name='lai', output_netcdf=watershedName+str(dxRes)+'lai.nc')
-        lai_nc = HDS.netcdf_rename_variable(input_netcdf_url_path=nlcd_variable_result['output_netcdf'],
-                                    output_netcdf='lai.nc', input_variable_name='Band1',output_variable_name='lai')
+    outlet_shapefile_result = HDS.create_outlet_shapefile(point_x=lon_outlet, point_y=lat_outlet,
+                                                      output_shape_file_name=watershedName+'Outlet.shp')
+    project_shapefile_result = HDS.project_shapefile(outlet_shapefile_result['output_shape_file_name'], watershedName + 'OutletProj.shp',
+                                                 epsg_code=epsgCode)
 
-    except Exception as e:
-        service_response['status'] = 'Error'
-        service_response['result'] = 'Failed to prepare the terrain variables.' + e.message
-        # TODO clean up the space
-        return service_response
+    Watershed_hires = HDS.delineate_watershed(WatershedDEM['output_raster'],
+                    input_outlet_shapefile_url_path=project_shapefile_result['output_shape_file'],
+                    threshold=streamThreshold, epsg_code=epsgCode,
+                    output_raster=watershedName + str(dx) + 'WS.tif',
+                    output_outlet_shapefile=watershedName + 'movOutlet.shp')
+
+    #HDS.download_file(file_url_path=Watershed_hires['output_raster'], save_as=workingDir+watershedName+str(dx)+'.tif')
+
+    ####Resample watershed grid to coarser grid
+    if dxRes == dx and dyRes == dy:
+        Watershed = Watershed_hires
+    else:
+        Watershed = HDS.resample_raster(input_raster_url_path = Watershed_hires['output_raster'],
+                cell_size_dx=dxRes, cell_size_dy=dyRes, resample='near', output_raster=watershedName + str(dxRes) + 'WS.tif')
+
+    #HDS.download_file(file_url_path=Watershed['output_raster'], save_as=workingDir+watershedName+str(dxRes)+'.tif')
+
+    ##  Convert to netCDF for UEB input with the variable named "watershed"
+    Watershed_NC = _raster_to_model_netcdf(HDS, Watershed['output_raster'], 'watershed', dxRes)
+
+    return {'WatershedDEM': WatershedDEM, 'Watershed': Watershed, 'Watershed_NC': Watershed_NC}
+
+
+def _prepare_aspect(HDS, WatershedDEM, watershedName, dx, dy, dxRes, dyRes):
+    # aspect
+    aspect_hires = HDS.create_raster_aspect(input_raster_url_path=WatershedDEM['output_raster'],
+                                output_raster=watershedName + 'Aspect' + str(dx)+ '.tif')
+
+    if dx == dxRes and dy == dyRes:
+        aspect = aspect_hires
+    else:
+        aspect = HDS.resample_raster(input_raster_url_path= aspect_hires['output_raster'], cell_size_dx=dxRes,
+                                cell_size_dy=dyRes, resample='near', output_raster=watershedName + 'Aspect' + str(dxRes) + '.tif')
+    aspect_nc = _raster_to_model_netcdf(HDS, aspect['output_raster'], 'aspect', dxRes)
+
+    return {'aspect_nc': aspect_nc}
+
+
+def _prepare_slope(HDS, WatershedDEM, watershedName, dx, dy, dxRes, dyRes):
+    # slope
+    slope_hires = HDS.create_raster_slope(input_raster_url_path=WatershedDEM['output_raster'],
+                                output_raster=watershedName + 'Slope' + str(dx) + '.tif')
+
+    if dx == dxRes and dy == dyRes:
+        slope = slope_hires
+    else:
+        slope = HDS.resample_raster(input_raster_url_path= slope_hires['output_raster'], cell_size_dx=dxRes,
+                                cell_size_dy=dyRes, resample='near', output_raster=watershedName + 'Slope' + str(dxRes) + '.tif')
+    slope_nc = _raster_to_model_netcdf(HDS, slope['output_raster'], 'slope', dxRes)
+
+    return {'slope_nc': slope_nc}
+
+
+def _raster_to_model_netcdf(HDS, input_raster_url_path, var, dxRes, fused=True):
+    # convert a raster to the model input netcdf file (var.nc) with its variable named var - by default in one
+    # service call, otherwise through an intermediate netcdf file (var<dxRes>.nc) with the generic variable "Band1"
+    if fused:
+        return HDS.raster_to_netcdf_and_rename_variable(input_raster_url_path=input_raster_url_path,
+                                                        output_netcdf=var + '.nc', output_varname=var)
+
+    var_temp = HDS.raster_to_netcdf(input_raster_url_path=input_raster_url_path,
+                                    output_netcdf=var + str(dxRes) + '.nc')
+    return HDS.netcdf_rename_variable(input_netcdf_url_path=var_temp['output_netcdf'], output_netcdf=var + '.nc',
+                                      input_variable_name='Band1', output_variable_name=var)
+
+
+def _prepare_canopy(HDS, Watershed, watershedName, dxRes):
+    #Land cover variables
+    nlcd_raster_resource = 'nlcd2011CONUS.tif'
+    subset_NLCD_result = HDS.project_clip_raster(input_raster=nlcd_raster_resource,
+                                ref_raster_url_path=Watershed['output_raster'],
+                                output_raster=watershedName + 'nlcdProj' + str(dxRes) + '.tif')
+    # cc, hcan and lai in one pass over the clipped land cover
+    nlcd_variables_result = HDS.get_canopy_variables(input_NLCD_raster_url_path=subset_NLCD_result['output_raster'],
+                                output_ccNetCDF=watershedName+str(dxRes)+'cc.nc',
+                                output_hcanNetCDF=watershedName+str(dxRes)+'hcan.nc',
+                                output_laiNetCDF=watershedName+str(dxRes)+'lai.nc')
+
+    return dict(('canopy_' + var, nlcd_variables_result['out_' + var + 'NetCDF']) for var in canopy_Vars)
+
+
+def _rename_canopy_variable(HDS, var, **canopy_files):
+    # In the netCDF file rename the generic variable "Band1" to the canopy variable
+    var_nc = HDS.netcdf_rename_variable(input_netcdf_url_path=canopy_files['canopy_' + var],
+                                output_netcdf=var + '.nc', input_variable_name='Band1', output_variable_name=var)
+
+    return {var + '_nc': var_nc}
 
 
-    # prepare the climate variables
-    try:
-        startYear = datetime.strptime(startDateTime,"%Y/%m/%d").year
-        endYear = datetime.strptime(endDateTime,"%Y/%m/%d").year
-        #### we are using data from Daymet; so data are daily
-        startDate = datetime.strptime(startDateTime, "%Y/%m/%d").date().strftime('%m/%d/%Y')
-        endDate = datetime.strptime(endDateTime, "%Y/%m/%d").date().strftime('%m/%d/%Y')
-
-        climate_Vars = ['vp', 'tmin', 'tmax', 'srad', 'prcp']
-        ####iterate through climate variables
-        for var in climate_Vars:
-            for year in range(startYear, endYear + 1):
-                climatestaticFile1 = var + "_" + str(year) + ".nc4"
-                climateFile1 = watershedName + '_' + var + "_" + str(year) + ".nc"
-                Year1sub_request = HDS.subset_netcdf(input_netcdf=climatestaticFile1,
-                                                     ref_raster_url_path=Watershed['output_raster'],
-                                                     output_netcdf=climateFile1)
-                concatFile = "conc_" + climateFile1
-                if year == startYear:
-                    concatFile1_url = Year1sub_request['output_netcdf']
-                else:
-                    concatFile2_url = Year1sub_request['output_netcdf']
-                    concateNC_request = HDS.concatenate_netcdf(input_netcdf1_url_path=concatFile1_url,
-                                                               input_netcdf2_url_path=concatFile2_url,
-                                                               output_netcdf=concatFile)
-                    concatFile1_url = concateNC_request['output_netcdf']
-
-            timesubFile = "tSub_" + climateFile1
-            subset_NC_by_time_result = HDS.subset_netcdf_by_time(input_netcdf_url_path=concatFile1_url,
-                                                                 time_dimension_name='time', start_date=startDate,
-                                                                 end_date=endDate, output_netcdf=timesubFile)
-            subset_NC_by_time_file_url = subset_NC_by_time_result['output_netcdf']
-            if var == 'prcp':
-                proj_resample_file = var + "_0.nc"
-            else:
-                proj_resample_file = var + "0.nc"
-            ncProj_resample_result = HDS.project_subset_resample_netcdf(
-                input_netcdf_url_path=subset_NC_by_time_file_url,
-                ref_netcdf_url_path=Watershed_NC['output_netcdf'],
-                variable_name=var, output_netcdf=proj_resample_file)
-            ncProj_resample_file_url = ncProj_resample_result['output_netcdf']
-
-            #### Do unit conversion for precipitation (mm/day --> m/hr)
-            if var == 'prcp':
-                proj_resample_file = var + "0.nc"
-                ncProj_resample_result = HDS.convert_netcdf_units(input_netcdf_url_path=ncProj_resample_file_url,
-                                                                output_netcdf=proj_resample_file,
-                                                                variable_name=var, variable_new_units='m/hr',
-                                                                multiplier_factor=0.00004167, offset=0.0)
-                # ncProj_resample_file_url = ncProj_resample_result['output_netcdf']
+def _collect_terrain_files(aspect_nc, slope_nc, cc_nc, hcan_nc, lai_nc):
+    return {'terrain_files': [aspect_nc, slope_nc, cc_nc, hcan_nc, lai_nc]}
+
 
-    except Exception as e:
-        service_response['status'] = 'Error'
-        service_response['result'] = 'Failed to prepare the climate variables.' + e.message
-        # TODO clean up the space
-        return service_response
+def _prepare_climate_variable(HDS, Watershed, Watershed_NC, watershedName, climate_time_windows, var):
+    # prepare one climate variable
+    # the yearly subsets are made and trimmed to the time window of the year at the same time and then joined as a
+    # balanced tree
+    def subset_year(time_window):
+        year, start_date, end_date, is_full_year = time_window
+        climatestaticFile1 = var + "_" + str(year) + ".nc4"
+        climateFile1 = watershedName + '_' + var + "_" + str(year) + ".nc"
+        Year1sub_request = HDS.subset_netcdf(input_netcdf=climatestaticFile1,
+                                             ref_raster_url_path=Watershed['output_raster'],
+                                             output_netcdf=climateFile1)
+        if is_full_year:
+            return Year1sub_request['output_netcdf']
 
+        timesubFile = "tSub_" + climateFile1
+        subset_NC_by_time_result = HDS.subset_netcdf_by_time(input_netcdf_url_path=Year1sub_request['output_netcdf'],
+                                                             time_dimension_name='time', start_date=start_date,
+                                                             end_date=end_date, output_netcdf=timesubFile,
+                                                             time_origin='01/01/' + str(year))
+        return subset_NC_by_time_result['output_netcdf']
 
+    executor = futures.ThreadPoolExecutor(max_workers=min(4, len(climate_time_windows)))
+    try:
+        yearly_files = list(executor.map(subset_year, climate_time_windows))
+    finally:
+        executor.shutdown(wait=True)
+
+    endYear = climate_time_windows[-1][0]
+    climateFile1 = watershedName + '_' + var + "_" + str(endYear) + ".nc"
+    concateNC_request = HDS.concatenate_netcdf_files(input_netcdf_url_paths=yearly_files,
+                                                     output_netcdf="conc_" + climateFile1)
+    subset_NC_by_time_file_url = concateNC_request['output_netcdf']
+
+    if var == 'prcp':
+        proj_resample_file = var + "_0.nc"
+    else:
+        proj_resample_file = var + "0.nc"
+    ncProj_resample_result = HDS.project_subset_resample_netcdf(
+        input_netcdf_url_path=subset_NC_by_time_file_url,
+        ref_netcdf_url_path=Watershed_NC['output_netcdf'],
+        variable_name=var, output_netcdf=proj_resample_file)
+    ncProj_resample_file_url = ncProj_resample_result['output_netcdf']
+
+    #### Do unit conversion for precipitation (mm/day --> m/hr)
+    if var == 'prcp':
+        proj_resample_file = var + "0.nc"
+        ncProj_resample_result = HDS.convert_netcdf_units(input_netcdf_url_path=ncProj_resample_file_url,
+                                                        output_netcdf=proj_resample_file,
+                                                        variable_name=var, variable_new_units='m/hr',
+                                                        multiplier_factor=0.00004167, offset=0.0)
+        # ncProj_resample_file_url = ncProj_resample_result['output_netcdf']
+
+    return {'climate_' + var: ncProj_resample_result}
+
+
+def _get_climate_time_windows(startDateTime, endDateTime):
+    # the part of each year of the model run as (year, start date, end date, if it is the whole year) with the dates
+    # in the format of subset_netcdf_by_time - the yearly Daymet files have 365 days, December 31 is left out of
+    # leap years
+    start_date = datetime.strptime(startDateTime, "%Y/%m/%d").date()
+    end_date = datetime.strptime(endDateTime, "%Y/%m/%d").date()
+
+    time_windows = []
+    for year in range(start_date.year, end_date.year + 1):
+        year_start_date = date(year, 1, 1)
+        year_end_date = date(year, 12, 30) if calendar.isleap(year) else date(year, 12, 31)
+        window_start_date = max(start_date, year_start_date)
+        window_end_date = min(end_date, year_end_date)
+        if window_start_date > window_end_date:
+            continue
+        time_windows.append((year, window_start_date.strftime('%m/%d/%Y'), window_end_date.strftime('%m/%d/%Y'),
+                             window_start_date == year_start_date and window_end_date == year_end_date))
+    return time_windows
+
+
+def _collect_climate_files(**climate_results):
+    # the climate files in the order of the climate variables
+    return {'climate_files': [climate_results['climate_' + var] for var in climate_Vars]}
+
+
+def _prepare_parameter_files(HDS, workspace, topY, bottomY, leftX, rightX, startDateTime, endDateTime,
+                             usic, wsic, tic, wcic, ts_last):
     # prepare the parameter files
     try:
         # create temp parameter files
         temp_dir = tempfile.mkdtemp()
 
-        # update the control.dat content
-        start_obj = datetime.strptime(startDateTime, '%Y/%M/%d')
-        end_obj = datetime.strptime(endDateTime, '%Y/%M/%d')
-        start_str = datetime.strftime(start_obj, '%Y %M %d') + ' 0.0'
-        end_str = datetime.strftime(end_obj, '%Y %M %d') + ' 0.0'
-        file_contents_dict['control.dat'][8] = start_str
-        file_contents_dict['control.dat'][9] = end_str
-
-        # update the siteinitial.dat content
+        # render the parameter files of this job from the shared templates
+        start_date = datetime.strptime(startDateTime, '%Y/%m/%d').date()
+        end_date = datetime.strptime(endDateTime, '%Y/%m/%d').date()
         lat = 0.5 * (topY+bottomY)
         lon = 0.5 * (rightX+leftX)
-        file_contents_dict['siteinitial.dat'][45] = str(lat)
-        file_contents_dict['siteinitial.dat'][96] = str(lon)
+        parameter_files = render_parameter_files(start_date=start_date, end_date=end_date, latitude=lat, longitude=lon,
+                                                 usic=usic, wsic=wsic, tic=tic, wcic=wcic, ts_last=ts_last)
 
-        file_contents_dict['siteinitial.dat'][3] = str(usic)
-        file_contents_dict['siteinitial.dat'][6] = str(wsic)
-        file_contents_dict['siteinitial.dat'][9] = str(tic)
-        file_contents_dict['siteinitial.dat'][12] = str(wcic)
-        file_contents_dict['siteinitial.dat'][93] = str(ts_last)
-
-        # write list in parameter files
-        for file_name, file_content in file_contents_dict.items():
+        # write the parameter files
+        for file_name, file_content in parameter_files:
             file_path = os.path.join(temp_dir, file_name)
             with open(file_path, 'w') as para_file:
-                para_file.write('\r\n'.join(file_content))  # the line separator is \r\n
+                para_file.write(file_content)  # the line separator is \r\n
 
         # upload files to Hydro-DS
-        for file_name in file_contents_dict.keys():
-            HDS.upload_file(file_to_upload=os.path.join(temp_dir, file_name))
+        upload_results = HDS.upload_files(files_to_upload=[os.path.join(temp_dir, file_name)
+                                                           for file_name, _ in parameter_files])
+        for upload_result in upload_results:
+            if upload_result['error']:
+                raise upload_result['error']
 
         # clean up tempdir
-        parameter_file_names = file_contents_dict.keys()
+        parameter_file_names = list(model_parameter_files)
         shutil.rmtree(temp_dir)
 
     except Exception as e:
         parameter_file_names = []
         shutil.rmtree(temp_dir)
 
+    return {'parameter_file_names': parameter_file_names}
 
-    # share result to HydroShare
-    try:
-        #upload ueb input package to hydroshare
-        ueb_inputPackage_dict = ['watershed.nc', 'aspect.nc', 'slope.nc', 'cc.nc', 'hcan.nc', 'lai.nc',
-                                 'vp0.nc', 'srad0.nc', 'tmin0.nc', 'tmax0.nc', 'prcp0.nc']
-        HDS.zip_files(files_to_zip=ueb_inputPackage_dict+parameter_file_names, zip_file_name=watershedName+'_input.zip')
-
-        # create resource metadata list
-        # TODO create the metadata for ueb model instance: box, time, resolution, watershed name, streamthreshold,epsg code, outlet poi
-        hs_title = res_title
-
-        if parameter_file_names:
-            hs_abstract = 'It was created using HydroShare UEB model inputs preparation application which utilized the HydroDS modeling web services. ' \
-                          'The model inputs data files include: {}. The model parameter files include: {}. This model instance resource is complete for model simulation. ' \
-                          .format(', '.join(ueb_inputPackage_dict), ', '.join(file_contents_dict.keys()))
-        else:
-            hs_abstract = 'It was created using HydroShare UEB model inputs preparation application which utilized the HydroDS modeling web services. ' \
-                          'The prepared files include: {}. This model instance resource still needs model parameter files {}'\
-                           .format(', '.join(ueb_inputPackage_dict), ', '.join(file_contents_dict.keys()))
-
-        hs_keywords = res_keywords.split(',')
-
-        metadata = []
-        metadata.append({"coverage": {"type": "box",
-                                      "value": {"northlimit": str(topY),
-                                                "southlimit": str(bottomY),
-                                                "eastlimit": str(rightX),
-                                                "westlimit": str(leftX),
-                                                "units": "Decimal degrees",
-                                                "projection": "WGS 84 EPSG:4326"
-                                                }
-                                      }
-                         })
-
-        start_obj = datetime.strptime(startDateTime, '%Y/%M/%d')
-        end_obj = datetime.strptime(endDateTime, '%Y/%M/%d')
-        metadata.append({"coverage": {"type": "period",
-                                      "value": {"start": datetime.strftime(start_obj, '%M/%d/%Y'),
-                                                "end": datetime.strftime(end_obj, '%M/%d/%Y'),
-                                                }
-                                      }
-                         })
-        # metadata.append({'contributor': {'name': 'John Smith', 'email': 'jsmith@gmail.com'}})
-        # metadata.append({'relation': {'type': 'cites', 'value': 'http'}})
-
-        # create resource
-        HDS.set_hydroshare_account(hs_name, hs_password)
-        res_info = HDS.create_hydroshare_resource(file_name=watershedName+'_input.zip', resource_type='ModelInstanceResource', title=hs_title,
-                                   abstract=hs_abstract, keywords=hs_keywords, metadata=metadata)
-    except Exception as e:
-        service_response['status'] = 'Error'
-        service_response['result'] = 'Failed to share the results to HydroShare.' + e.message
-        # TODO clean up the space
-        return service_response
-
-    service_response['result'] = "A model instance resource with name '{}' has been created with link https://www.hydroshare.org/resoruce/{}".format(
-                                    res_title, res_info['resource_id'])
 
-    return service_response
+def _share_model_input(HDS, terrain_files, climate_files, parameter_file_names, hs_name, hs_password,
+                       topY, bottomY, leftX, rightX, watershedName, startDateTime, endDateTime, res_title, res_keywords):
+    # share result to HydroShare
+    #upload ueb input package to hydroshare
+    ueb_inputPackage_dict = ['watershed.nc', 'aspect.nc', 'slope.nc', 'cc.nc', 'hcan.nc', 'lai.nc',
+                             'vp0.nc', 'srad0.nc', 'tmin0.nc', 'tmax0.nc', 'prcp0.nc']
+    HDS.zip_files(files_to_zip=ueb_inputPackage_dict+parameter_file_names, zip_file_name=watershedName+'_input.zip')
+
+    # create resource metadata list
+    # TODO create the metadata for ueb model instance: box, time, resolution, watershed name, streamthreshold,epsg code, outlet poi
+    hs_title = res_title
+
+    if parameter_file_names:
+        hs_abstract = 'It was created using HydroShare UEB model inputs preparation application which utilized the HydroDS modeling web services. ' \
+                      'The model inputs data files include: {}. The model parameter files include: {}. This model instance resource is complete for model simulation. ' \
+                      .format(', '.join(ueb_inputPackage_dict), ', '.join(model_parameter_files))
+    else:
+        hs_abstract = 'It was created using HydroShare UEB model inputs preparation application which utilized the HydroDS modeling web services. ' \
+                      'The prepared files include: {}. This model instance resource still needs model parameter files {}'\
+                       .format(', '.join(ueb_inputPackage_dict), ', '.join(model_parameter_files))
+
+    hs_keywords = res_keywords.split(',')
+
+    metadata = []
+    metadata.append({"coverage": {"type": "box",
+                                  "value": {"northlimit": str(topY),
+                                            "southlimit": str(bottomY),
+                                            "eastlimit": str(rightX),
+                                            "westlimit": str(leftX),
+                                            "units": "Decimal degrees",
+                                            "projection": "WGS 84 EPSG:4326"
+                                            }
+                                  }
+                     })
+
+    start_obj = datetime.strptime(startDateTime, '%Y/%M/%d')
+    end_obj = datetime.strptime(endDateTime, '%Y/%M/%d')
+    metadata.append({"coverage": {"type": "period",
+                                  "value": {"start": datetime.strftime(start_obj, '%M/%d/%Y'),
+                                            "end": datetime.strftime(end_obj, '%M/%d/%Y'),
+                                            }
+                                  }
+                     })
+    # metadata.append({'contributor': {'name': 'John Smith', 'email': 'jsmith@gmail.com'}})
+    # metadata.append({'relation': {'type': 'cites', 'value': 'http'}})
+
+    # create resource
+    HDS.set_hydroshare_account(hs_name, hs_password)
+    res_info = HDS.create_hydroshare_resource(file_name=watershedName+'_input.zip', resource_type='ModelInstanceResource', title=hs_title,
+                               abstract=hs_abstract, keywords=hs_keywords, metadata=metadata)
+
+    return {'res_info': res_info}
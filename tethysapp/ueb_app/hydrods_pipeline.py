@@ -0,0 +1,231 @@
+"""
+Dependency graph executor for HydroDS processing pipelines
+"""
+
+import time
+import threading
+from concurrent import futures
+
+
+class PipelineError(Exception):
+    def __init__(self, failures):
+        # failures: list of (step name, exception) in the order the steps were added to the pipeline
+        self.failures = failures
+        step_name, exception = failures[0]
+        super(PipelineError, self).__init__("Pipeline step '{0}' failed: {1}".format(step_name, exception))
+
+
+class Pipeline(object):
+    def __init__(self, max_workers=4):
+        """
+        Create a pipeline of steps. Each step declares the names of the values it takes as input and the names of
+        the values it produces. A step runs as soon as all its inputs are available, with steps that don't depend on
+        each other running concurrently on a pool of max_workers threads
+
+        :param max_workers: (optional) max number of steps to run at the same time (default is 4)
+        :type max_workers: int
+        :return: Pipeline object
+
+        Example usage:
+            pipeline = Pipeline(max_workers=4)
+            pipeline.add_step('dem', get_dem, inputs=['bbox'], outputs=['dem'])
+            pipeline.add_step('slope', get_slope, inputs=['dem'], outputs=['slope'])
+            pipeline.add_step('aspect', get_aspect, inputs=['dem'], outputs=['aspect'])
+            pipeline_run = pipeline.run(bbox=(-111.8, 41.7, -111.6, 41.5))
+            print(pipeline_run.values['slope'], pipeline_run.get_critical_path())
+        """
+        self._max_workers = max_workers
+        self._steps = []
+        self._steps_by_name = {}
+
+    def add_step(self, name, func, inputs=(), outputs=()):
+        """
+        Adds a step to the pipeline
+
+        :param name: unique name of the step
+        :type name: string
+        :param func: function to run for the step - it is called with the step inputs as keyword arguments and must
+                     return a dict with a value for each of the step outputs
+        :param inputs: (optional) names of the values the step needs
+        :type inputs: list
+        :param outputs: (optional) names of the values the step produces
+        :type outputs: list
+        :return: None
+        :raises: ValueError if a step with the same name or producing one of the same outputs already exists
+        """
+        if name in self._steps_by_name:
+            raise ValueError("Pipeline already has a step named '{0}'.".format(name))
+        for output in outputs:
+            for step in self._steps:
+                if output in step.outputs:
+                    raise ValueError("Output '{0}' of step '{1}' is already an output of step '{2}'."
+                                     .format(output, name, step.name))
+
+        step = _Step(name, func, tuple(inputs), tuple(outputs))
+        self._steps.append(step)
+        self._steps_by_name[name] = step
+
+    def get_dependencies(self, initial_values=()):
+        """
+        Gets the steps each step depends on
+
+        :param initial_values: (optional) names of the values that are provided when the pipeline is run
+        :return: a dict with the step name as key and the list of names of the steps it depends on as value
+        :raises: ValueError if an input is neither produced by a step nor provided, or if the steps form a cycle
+        """
+        producers = {}
+        for step in self._steps:
+            for output in step.outputs:
+                producers[output] = step.name
+
+        dependencies = {}
+        for step in self._steps:
+            dependencies[step.name] = []
+            for input_name in step.inputs:
+                if input_name in producers:
+                    if producers[input_name] not in dependencies[step.name]:
+                        dependencies[step.name].append(producers[input_name])
+                elif input_name not in initial_values:
+                    raise ValueError("Input '{0}' of step '{1}' is not produced by any step."
+                                     .format(input_name, step.name))
+
+        self._check_cycles(dependencies)
+        return dependencies
+
+    def run(self, **initial_values):
+        """
+        Runs all the steps of the pipeline. Once a step fails no new steps are started and the steps that are
+        already running are allowed to finish
+
+        :param initial_values: values that the steps can take as inputs
+        :return: PipelineRun object with the values produced by the steps and the time taken by each step
+        :raises: PipelineError if any of the steps failed
+        """
+        dependencies = self.get_dependencies(initial_values=initial_values)
+        pipeline_run = PipelineRun(dependencies)
+        pipeline_run.values.update(initial_values)
+
+        remaining_dependencies = dict((name, set(step_dependencies))
+                                      for name, step_dependencies in dependencies.items())
+        dependents = dict((step.name, []) for step in self._steps)
+        for name, step_dependencies in dependencies.items():
+            for dependency in step_dependencies:
+                dependents[dependency].append(name)
+
+        failures = {}
+        running = {}
+        executor = futures.ThreadPoolExecutor(max_workers=self._max_workers)
+        try:
+            ready = [step.name for step in self._steps if not remaining_dependencies[step.name]]
+            while ready or running:
+                if not failures:
+                    for name in ready:
+                        step = self._steps_by_name[name]
+                        step_inputs = dict((input_name, pipeline_run.values[input_name])
+                                           for input_name in step.inputs)
+                        running[executor.submit(pipeline_run._run_step, step, step_inputs)] = name
+                ready = []
+                if not running:
+                    break
+
+                done, _ = futures.wait(list(running.keys()), return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        step_values = future.result()
+                    except Exception as ex:
+                        failures[name] = ex
+                        continue
+
+                    for output in self._steps_by_name[name].outputs:
+                        if output not in step_values:
+                            failures[name] = ValueError("Step '{0}' did not produce output '{1}'."
+                                                        .format(name, output))
+                            break
+                        pipeline_run.values[output] = step_values[output]
+                    else:
+                        for dependent in dependents[name]:
+                            remaining_dependencies[dependent].discard(name)
+                            if not remaining_dependencies[dependent]:
+                                ready.append(dependent)
+        finally:
+            executor.shutdown(wait=True)
+
+        if failures:
+            raise PipelineError([(step.name, failures[step.name]) for step in self._steps if step.name in failures])
+        return pipeline_run
+
+    @staticmethod
+    def _check_cycles(dependencies):
+        visiting = set()
+        visited = set()
+
+        def visit(name):
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError("Pipeline steps form a cycle at step '{0}'.".format(name))
+            visiting.add(name)
+            for dependency in dependencies[name]:
+                visit(dependency)
+            visiting.remove(name)
+            visited.add(name)
+
+        for name in dependencies:
+            visit(name)
+
+
+class PipelineRun(object):
+    def __init__(self, dependencies):
+        # values produced by the steps (and the initial values) and the start/end time of each step that has run
+        self.values = {}
+        self.timings = {}
+        self._dependencies = dependencies
+        self._lock = threading.Lock()
+
+    def get_critical_path(self):
+        """
+        Gets the chain of dependent steps that took the longest time to run - the time the pipeline would take
+        even with an unlimited number of workers
+
+        :return: a tuple of the list of step names on the critical path and the total time (seconds) of these steps
+        """
+        longest_paths = {}
+
+        def longest_path(name):
+            if name not in longest_paths:
+                start_time, end_time = self.timings[name]
+                paths = [longest_path(dependency) for dependency in self._dependencies[name]
+                         if dependency in self.timings]
+                path, duration = max(paths, key=lambda item: item[1]) if paths else ([], 0)
+                longest_paths[name] = (path + [name], duration + end_time - start_time)
+            return longest_paths[name]
+
+        paths = [longest_path(name) for name in self.timings]
+        if not paths:
+            return [], 0
+        return max(paths, key=lambda item: item[1])
+
+    def get_step_durations(self):
+        """
+        :return: a dict with the step name as key and the time (seconds) the step took as value
+        """
+        return dict((name, end_time - start_time) for name, (start_time, end_time) in self.timings.items())
+
+    def _run_step(self, step, step_inputs):
+        start_time = time.time()
+        try:
+            return step.func(**step_inputs) or {}
+        finally:
+            with self._lock:
+                self.timings[step.name] = (start_time, time.time())
+
+
+class _Step(object):
+    __slots__ = ('name', 'func', 'inputs', 'outputs')
+
+    def __init__(self, name, func, inputs, outputs):
+        self.name = name
+        self.func = func
+        self.inputs = inputs
+        self.outputs = outputs
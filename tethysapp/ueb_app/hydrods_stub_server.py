@@ -0,0 +1,455 @@
+"""
+Local stand-in for the HydroDS data services and the HydroGate api, for benchmarking and testing the HydroDS client
+without the remote hosts
+
+Run from the command line:
+    python hydrods_stub_server.py --port 20199 --latency 0.2 --failure-rate 0.01
+
+and point the client at it:
+    HYDRODS_BASE_URL=http://127.0.0.1:20199 HYDRODS_SERVICE_BASE_URL=http://127.0.0.1:20199
+    HYDROGATE_BASE_URL=http://127.0.0.1:20199/hydrogate HYDROGATE_FILE_BASE_URL=http://127.0.0.1:20199/files
+"""
+
+import re
+import socket
+import json
+import base64
+import time
+import uuid
+import random
+import hashlib
+import argparse
+import datetime
+import threading
+import email.utils
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+
+
+# sizes (bytes) of the files the stand-in services produce - in the range of the files produced for a small watershed
+default_file_sizes = {
+    '.tif': 4 * 1024 * 1024,
+    '.nc': 8 * 1024 * 1024,
+    '.shp': 64 * 1024,
+    '.zip': 32 * 1024 * 1024,
+    '.dat': 4 * 1024,
+}
+
+# static data files the services take as input by name
+static_files = ['nedWesternUS.tif', 'nlcd2011CONUS.tif'] + \
+               ['{0}_{1}.nc4'.format(var, year) for var in ('vp', 'tmin', 'tmax', 'srad', 'prcp')
+                for year in range(1980, 2017)]
+
+
+class HydroDSStubServer(object):
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, latency_jitter=0.0, service_latencies=None,
+                 failure_rate=0.0, file_sizes=None, job_duration=1.0, seed=None):
+        """
+        Create a stand-in HydroDS/HydroGate server. Each data service call creates the output files named in the
+        request in the user's workspace (files are generated on download, not kept in memory) and returns their
+        urls, so that a whole model input or model run job can be run against it
+
+        :param host: (optional) host to listen on (default is 127.0.0.1)
+        :param port: (optional) port to listen on (default is 0 - any free port)
+        :param latency: (optional) seconds each service call takes (default is 0)
+        :param latency_jitter: (optional) max random seconds added to the latency of each call (default is 0)
+        :param service_latencies: (optional) a dict of service name (e.g. 'subsetnetcdftoreference') to latency in
+                                  seconds for the services that should take longer/shorter than latency
+        :param failure_rate: (optional) fraction (0 to 1) of the service calls that fail with http status 500
+        :param file_sizes: (optional) a dict of file extension to size in bytes of the files the services produce
+        :param job_duration: (optional) seconds a HydroGate package upload or job takes to finish (default is 1)
+        :param seed: (optional) seed for the random latencies/failures to make runs repeatable
+        :return: HydroDSStubServer object
+
+        Example usage:
+            with HydroDSStubServer(latency=0.1) as server:
+                hds = HydroDS(username='user', password='pass', hydro_ds_base_url=server.base_url)
+                hds.subset_raster(left=-111.8, top=41.7, right=-111.6, bottom=41.5, input_raster='nedWesternUS.tif',
+                                  output_raster='dem.tif')
+                print(server.get_request_counts())
+        """
+        self._latency = latency
+        self._latency_jitter = latency_jitter
+        self._service_latencies = service_latencies or {}
+        self._failure_rate = failure_rate
+        self._file_sizes = dict(default_file_sizes)
+        self._file_sizes.update(file_sizes or {})
+        self._job_duration = job_duration
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # user name -> {file name -> file size or uploaded file content}
+        self._workspaces = {}
+        # (user name, file name) -> time the file was created
+        self._file_times = {}
+        self._request_counts = {}
+        self._jobs = {}
+        self._thread = None
+        self._http_server = _ThreadingHTTPServer((host, port), _StubRequestHandler)
+        self._http_server.stub = self
+
+    @property
+    def base_url(self):
+        host, port = self._http_server.server_address[:2]
+        return 'http://{0}:{1}'.format(host, port)
+
+    def start(self):
+        """
+        Starts serving requests from a background thread
+
+        :return: base url of the server
+        """
+        self._thread = threading.Thread(target=self._http_server.serve_forever, name='hydrods-stub-server')
+        self._thread.daemon = True
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self._http_server.shutdown()
+        self._http_server.close_connections()
+        self._http_server.server_close()
+
+    def get_request_counts(self):
+        """
+        :return: a dict of service name to the number of calls made to it
+        """
+        with self._lock:
+            return dict(self._request_counts)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _count_request(self, service_name):
+        with self._lock:
+            self._request_counts[service_name] = self._request_counts.get(service_name, 0) + 1
+
+    def _wait_service_latency(self, service_name):
+        latency = self._service_latencies.get(service_name, self._latency)
+        with self._lock:
+            latency += self._random.uniform(0, self._latency_jitter)
+            failed = self._random.random() < self._failure_rate
+        if latency > 0:
+            time.sleep(latency)
+        return not failed
+
+    def _get_workspace(self, username):
+        with self._lock:
+            return self._workspaces.setdefault(username, {})
+
+    def _add_file(self, username, file_name, content=None):
+        if content is None:
+            extension = file_name[file_name.rfind('.'):] if '.' in file_name else ''
+            content = self._file_sizes.get(extension, 1024 * 1024)
+        self._get_workspace(username)[file_name] = content
+        with self._lock:
+            self._file_times[(username, file_name)] = time.time()
+        return self._get_file_url(username, file_name)
+
+    def _get_file_url(self, username, file_name):
+        return '{0}/files/data/user_{1}/{2}'.format(self.base_url, username, file_name)
+
+    def _get_file_name(self, file_url):
+        # name of a workspace file given its url (None if it is not a url of a file on this server)
+        match = re.match(r'.*/files/data/user_[^/]+/(?P<file_name>[^/?]+)$', file_url or '')
+        return match.group('file_name') if match else None
+
+    def _get_job_state(self, job_id, done_state, running_state):
+        with self._lock:
+            started = self._jobs.get(job_id)
+        if started is None:
+            return None
+        return done_state if time.time() - started >= self._job_duration else running_state
+
+    def _start_job(self):
+        with self._lock:
+            job_id = len(self._jobs) + 1
+            self._jobs[job_id] = time.time()
+        return job_id
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, server_address, request_handler_class):
+        HTTPServer.__init__(self, server_address, request_handler_class)
+        # open (keep-alive) client connections - closed on stop so that their handler threads exit
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+        self._closing = False
+
+    def process_request_thread(self, request, client_address):
+        with self._connections_lock:
+            self._connections.add(request)
+        try:
+            ThreadingMixIn.process_request_thread(self, request, client_address)
+        finally:
+            with self._connections_lock:
+                self._connections.discard(request)
+
+    def handle_error(self, request, client_address):
+        # errors of the connections shut down by close_connections are expected
+        if not self._closing:
+            HTTPServer.handle_error(self, request, client_address)
+
+    def close_connections(self, timeout=5):
+        self._closing = True
+        with self._connections_lock:
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+        # wait for the handler threads to finish so that none is left running at interpreter shutdown
+        end_time = time.time() + timeout
+        while time.time() < end_time:
+            with self._connections_lock:
+                if not self._connections:
+                    return
+            time.sleep(0.01)
+
+
+class _StubRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    _chunk_size = 64 * 1024
+
+    def log_message(self, format, *args):
+        # no access log on stderr
+        pass
+
+    def do_GET(self):
+        self._handle_request('GET')
+
+    def do_POST(self):
+        self._handle_request('POST')
+
+    def do_DELETE(self):
+        self._handle_request('DELETE')
+
+    def do_HEAD(self):
+        self._handle_request('HEAD')
+
+    @property
+    def stub(self):
+        return self.server.stub
+
+    def _handle_request(self, http_method):
+        parsed_url = urlparse(self.path)
+        params = dict((name, values[-1]) for name, values in parse_qs(parsed_url.query).items())
+        body = self._read_body()
+        if self.headers.get('content-type', '').startswith('application/x-www-form-urlencoded'):
+            params.update((name, values[-1]) for name, values in parse_qs(body.decode('utf-8')).items())
+
+        path = parsed_url.path
+        if path.startswith('/files/'):
+            return self._send_file(path, send_content=http_method != 'HEAD')
+        if path.startswith('/api/dataservice/'):
+            return self._handle_dataservice(path[len('/api/dataservice/'):].strip('/'), http_method, params, body)
+        if path.startswith('/hydrogate/'):
+            return self._handle_hydrogate(path[len('/hydrogate/'):].strip('/'), params)
+        self._send_json(404, {'success': False, 'error': 'Not found'})
+
+    def _read_body(self):
+        content_length = int(self.headers.get('content-length') or 0)
+        if content_length:
+            return self.rfile.read(content_length)
+        return b''
+
+    def _get_username(self):
+        # basic auth user name (the password is not checked)
+        authorization = self.headers.get('authorization', '')
+        if not authorization.startswith('Basic '):
+            return None
+        credentials = base64.b64decode(authorization[len('Basic '):].encode('ascii')).decode('utf-8')
+        return re.sub(r'[^A-Za-z0-9_.-]', '_', credentials.split(':', 1)[0])
+
+    def _handle_dataservice(self, service_name, http_method, params, body):
+        stub = self.stub
+        if service_name.startswith('myfiles/delete/'):
+            stub._count_request('myfiles/delete')
+        else:
+            stub._count_request(service_name)
+
+        username = self._get_username()
+        if username is None:
+            return self._send_json(401, {'success': False, 'error': 'Authentication credentials were not provided.'})
+        if not stub._wait_service_latency(service_name):
+            return self._send_json(500, {'success': False, 'error': 'Internal server error.'})
+
+        workspace = stub._get_workspace(username)
+        if service_name == 'myfiles/list':
+            data = [stub._get_file_url(username, file_name) for file_name in sorted(workspace)]
+        elif service_name.startswith('myfiles/delete/'):
+            file_name = service_name[len('myfiles/delete/'):]
+            if workspace.pop(file_name, None) is None:
+                return self._send_json(404, {'success': False, 'error': 'File not found.'})
+            data = {'file_deleted': file_name}
+        elif service_name == 'myfiles/upload':
+            file_name, content = self._get_uploaded_file(body)
+            if http_method != 'POST' or file_name is None:
+                return self._send_json(400, {'success': False, 'error': 'No file to upload.'})
+            data = stub._add_file(username, file_name, content=content)
+        elif service_name == 'showstaticdata/info':
+            data = [{'file_name': file_name, 'description': 'stand-in static data file'} for file_name in static_files]
+        elif service_name == 'hydroshare/createresource':
+            data = {'resource_id': uuid.uuid4().hex}
+        elif service_name in ('createuebinput', 'runuebmodel'):
+            return self._send_json(200, {'success': True, 'error': None,
+                                         'data': {'info': 'The {0} job has been submitted.'.format(service_name)}})
+        elif service_name == 'job/check_job_status':
+            data = [{'id': job_id, 'start_time': datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                     'status': stub._get_job_state(job_id, 'Done', 'Running')} for job_id in list(stub._jobs)]
+        else:
+            # any other service: inputs on this server must exist, outputs named in the request are created
+            for name, value in params.items():
+                input_file_name = stub._get_file_name(value)
+                if input_file_name and not name.startswith('out') and input_file_name not in workspace:
+                    return self._send_json(400, {'success': False,
+                                                 'error': 'Input file {0} not found.'.format(input_file_name)})
+
+            data = {}
+            for name, value in params.items():
+                if name.startswith('out') or name == 'zip_file_name':
+                    data[name] = stub._add_file(username, value)
+            if not data:
+                data['output_file'] = stub._add_file(username, service_name.replace('/', '_') + '.dat')
+
+        self._send_json(200, {'success': True, 'error': None, 'data': data})
+
+    def _get_uploaded_file(self, body):
+        # name and content of the file part of a multipart/form-data request body
+        boundary_match = re.search(r'boundary=(\S+)', self.headers.get('content-type', ''))
+        file_match = re.search(b'filename="([^"]+)"[^\r]*\r\n(?:[^\r]+\r\n)*\r\n', body)
+        if not boundary_match or not file_match:
+            return None, None
+        content_end = body.find(b'\r\n--' + boundary_match.group(1).encode('ascii'), file_match.end())
+        file_name = file_match.group(1).decode('utf-8').split('/')[-1]
+        return file_name, body[file_match.end():content_end if content_end >= 0 else len(body)]
+
+    def _handle_hydrogate(self, api_name, params):
+        stub = self.stub
+        stub._count_request('hydrogate/' + api_name)
+        if not stub._wait_service_latency('hydrogate/' + api_name):
+            return self._send_json(500, {'status': 'error', 'description': 'Internal server error.'})
+
+        response = {'status': 'success'}
+        if api_name == 'request_token':
+            response['token'] = uuid.uuid4().hex
+        elif api_name == 'retrieve_token_expire_time':
+            response['remainingexpiretime'] = 3600
+        elif api_name == 'upload_package':
+            response['packageid'] = stub._start_job()
+        elif api_name == 'retrieve_package_status':
+            response['state'] = stub._get_job_state(int(params.get('packageid', 0)), 'PackageTransferDone',
+                                                    'PackageTransferring')
+        elif api_name == 'submit_job':
+            job_id = stub._start_job()
+            response['jobid'] = job_id
+            response['outputpath'] = '{0}/files/job_{1}.zip'.format(stub.base_url, job_id)
+        elif api_name == 'retrieve_job_status':
+            response['state'] = stub._get_job_state(int(params.get('jobid', 0)), 'JobOutputFileTransferDone',
+                                                    'JobRunning')
+        else:
+            response = {'status': 'error', 'description': 'Unknown api {0}'.format(api_name)}
+        self._send_json(200, response)
+
+    def _send_json(self, status_code, response_dict):
+        content = json.dumps(response_dict).encode('utf-8')
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _send_file(self, path, send_content=True):
+        stub = self.stub
+        stub._count_request('files')
+        match = re.match(r'/files/data/user_(?P<username>[^/]+)/(?P<file_name>[^/]+)$', path)
+        last_modified = None
+        if match:
+            content = stub._get_workspace(match.group('username')).get(match.group('file_name'))
+            last_modified = stub._file_times.get((match.group('username'), match.group('file_name')))
+        else:
+            # HydroGate job output files
+            content = stub._file_sizes['.zip'] if path.endswith('.zip') else None
+        if content is None:
+            return self._send_json(404, {'success': False, 'error': 'File not found.'})
+
+        file_size = content if isinstance(content, int) else len(content)
+        start, end = 0, file_size - 1
+        range_match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('range', ''))
+        if range_match:
+            start = int(range_match.group(1))
+            if range_match.group(2):
+                end = min(int(range_match.group(2)), file_size - 1)
+            if start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{0}'.format(file_size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+
+        self.send_response(206 if range_match else 200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        # a file that is written again gets a new ETag even if it has the same size
+        etag_data = '{0}:{1}:{2!r}'.format(path, file_size, last_modified)
+        self.send_header('ETag', '"{0}"'.format(hashlib.md5(etag_data.encode('utf-8')).hexdigest()))
+        if last_modified is not None:
+            self.send_header('Last-Modified', email.utils.formatdate(last_modified, usegmt=True))
+        if range_match:
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, end, file_size))
+        self.end_headers()
+        if not send_content:
+            return
+
+        if not isinstance(content, int):
+            self.wfile.write(content[start:end + 1])
+            return
+
+        # generated content - the same bytes for the same file on every download
+        block = hashlib.sha256(path.encode('utf-8')).digest() * (self._chunk_size // 32)
+        position = start
+        while position <= end:
+            offset = position % len(block)
+            chunk = block[offset:offset + min(end - position + 1, len(block) - offset)]
+            self.wfile.write(chunk)
+            position += len(chunk)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in HydroDS/HydroGate server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=20199)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds each service call takes')
+    parser.add_argument('--latency-jitter', type=float, default=0.0, help='max random seconds added to the latency')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of service calls that fail')
+    parser.add_argument('--job-duration', type=float, default=1.0, help='seconds a HydroGate upload/job takes')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = HydroDSStubServer(host=args.host, port=args.port, latency=args.latency,
+                               latency_jitter=args.latency_jitter, failure_rate=args.failure_rate,
+                               job_duration=args.job_duration, seed=args.seed)
+    print('HydroDS stand-in server running at {0}'.format(server.base_url))
+    try:
+        server._http_server.serve_forever()
+    except KeyboardInterrupt:
+        server._http_server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -6,13 +6,52 @@ HydroGate Python Client for accessing CI-WATER HydroDS Data and Computational We
 import requests
 import os
 import json
-import pickle
+import collections
 import datetime
 import time
+import threading
+import contextlib
+import hashlib
+import base64
+import binascii
+import uuid
+import random
+import heapq
+import errno
+import itertools
+import fnmatch
+import email.utils
+import tempfile
+import atexit
+from concurrent import futures
+
+from hydrods_cache import DownloadCache, OperationMemo
+from hydrods_metrics import service_metrics
+from hydrods_endpoints import EndpointPool, EndpointUnavailableException, get_circuit_breaker, is_host_failure, \
+    is_connect_error, default_timeout
+
+# base urls of the HydroDS and HydroGate hosts - these can be set from the environment, e.g. to run against a local
+# stand-in server (see hydrods_stub_server.py). HYDRODS_BASE_URL and HYDRODS_SERVICE_BASE_URL can each be a comma
+# separated list of replica hosts.
+HYDRODS_BASE_URLS = os.environ.get('HYDRODS_BASE_URL', 'http://hydro-ds.uwrl.usu.edu').split(',')
+HYDRODS_SERVICE_BASE_URLS = os.environ.get('HYDRODS_SERVICE_BASE_URL', 'http://129.123.41.218:20199').split(',')
+HYDROGATE_BASE_URL = os.environ.get('HYDROGATE_BASE_URL', 'https://129.123.41.158/hydrogate')
+HYDROGATE_FILE_BASE_URL = os.environ.get('HYDROGATE_FILE_BASE_URL', 'http://129.123.41.158:20198')
+IRODS_REST_BASE_URL = os.environ.get('IRODS_REST_BASE_URL',
+                                     'http://hydro-ds.uwrl.usu.edu:8080/irods-rest-4.0.2.1-SNAPSHOT/rest')
+
+# replica hosts of the HydroDS data services and of the HydroDS model input/run services (health checked, routed
+# by latency)
+hydrods_endpoints = EndpointPool(HYDRODS_BASE_URLS)
+hydrods_service_endpoints = EndpointPool(HYDRODS_SERVICE_BASE_URLS)
 
 class HydroDSException(Exception):
     pass
 
+class HydroDSClientUnavailableException(HydroDSException):
+    pass
+
+
 class HydroDSArgumentException(Exception):
     pass
 
@@ -31,31 +70,42 @@ class HydroDSNotAuthenticatedException(Exception):
 class HydroDSNotFoundException(Exception):
     pass
 
-# TODO: Add HydroGate specific exceptions
-
-def singleton(cls):
-    instances = {}
-
-    def getinstance(username=None, password=None):
-        if cls not in instances:
-            instances[cls] = cls(username, password)
-        return instances[cls]
-    return getinstance
+class HydroDSServiceUnavailableException(Exception):
+    pass
 
+# TODO: Add HydroGate specific exceptions
 
-@singleton
 class HydroDS(object):
-    def __init__(self, username=None, password=None):
+    def __init__(self, username=None, password=None, pool_size=10, keep_alive=True, token_refresh_margin=60,
+                 token_auto_refresh=False, hydro_ds_base_url=None, hydrogate_base_url=None, irods_rest_base_url=None,
+                 retry_policy=None, timeout=default_timeout, max_concurrent_requests=None):
         """
         Create HydroDS object to access client api functions
         :param username: username for HydroDS
         :param password: password for HydroDS
+        :param pool_size: (optional) max number of pooled connections kept open per host (default is 10)
+        :param keep_alive: (optional) if connections are to be kept alive and reused between calls (default is True)
+        :param token_refresh_margin: (optional) number of seconds before the HydroGate token expires at which a new
+                                     token is requested (default is 60)
+        :param token_auto_refresh: (optional) if the HydroGate token is to be refreshed from a background timer
+                                   instead of on the next call after it gets near expiry (default is False)
+        :param hydro_ds_base_url: (optional) base url of the HydroDS host (default is the available host with the
+                                  lowest latency in hydrods_endpoints - the client stays with that host as the
+                                  files it creates are kept there)
+        :param hydrogate_base_url: (optional) base url of the HydroGate api (default is HYDROGATE_BASE_URL)
+        :param irods_rest_base_url: (optional) base url of the iRODS rest api (default is IRODS_REST_BASE_URL)
+        :param retry_policy: (optional) policy for retrying failed data service calls (default is RetryPolicy())
+        :param timeout: (optional) (connect, read) timeout in seconds for the http calls (default is (10, 900))
+        :param max_concurrent_requests: (optional) max number of data service calls of this client that are in flight
+                                        at the same time - other calls wait for a free slot (default is pool_size)
         :return: HydroDS object
         """
 
-        self._hydrogate_base_url = 'https://129.123.41.158/hydrogate'
+        self._hydro_ds_base_url = (hydro_ds_base_url or hydrods_endpoints.choose(allow_unavailable=True)).rstrip('/')
+        self._hydrogate_base_url = (hydrogate_base_url or HYDROGATE_BASE_URL).rstrip('/')
+        self._hydrogate_file_base_url = HYDROGATE_FILE_BASE_URL.rstrip('/')
         self._dataservice_base_url = self.hydro_ds_base_url + '/api/dataservice'
-        self._irods_rest_base_url = 'http://hydro-ds.uwrl.usu.edu:8080/irods-rest-4.0.2.1-SNAPSHOT/rest'
+        self._irods_rest_base_url = (irods_rest_base_url or IRODS_REST_BASE_URL).rstrip('/')
         self._hg_token_url = self._hydrogate_base_url + '/request_token/'
         self._hg_upload_pkg_url = self._hydrogate_base_url + '/upload_package/'
         self._hg_upload_pkg_status_url = self._hydrogate_base_url + '/retrieve_package_status'
@@ -64,13 +114,24 @@ class HydroDS(object):
         self._hg_token_expire_time_url = self._hydrogate_base_url + '/retrieve_token_expire_time'
         self._hg_hpc_program_names_url = self._hydrogate_base_url + '/return_hpc_program_names/'
         self._hg_program_info_url = self._hydrogate_base_url + '/retrieve_program_info'
-        self._requests = requests
+        self._requests = _SessionPool(pool_size=pool_size, keep_alive=keep_alive, timeout=timeout)
+        # the pipeline steps of a job and the thread pools within them share this limit, so the calls in flight
+        # never need more connections than the session pool keeps open
+        self._data_service_slots = threading.BoundedSemaphore(max_concurrent_requests or pool_size)
+        self._downloader = _FileDownloader(self._requests)
+        self._download_cache = None
+        self._operation_memo = None
+        self._retry_policy = retry_policy or RetryPolicy()
         self._hg_auth = (username, password)
         self._hydroshare_auth = None
         self._hg_username = None
         self._hg_password = None
         self._default_hpc = 'USU'
         self._hg_token = None
+        self._hg_token_manager = _TokenManager(request_token=self._request_token,
+                                               request_expire_time=self._request_token_expire_time,
+                                               refresh_margin=token_refresh_margin,
+                                               auto_refresh=token_auto_refresh)
         self._user_hg_authenticated = False
         self._irods_username = None
         self._irods_password = None
@@ -78,9 +139,24 @@ class HydroDS(object):
 
         _ServiceLog.load()
 
+    # data services that always produce the same output for the same inputs
+    _memoizable_services = frozenset([
+        'subsetrastertobbox', 'subsetrastertoreference', 'rastertonetcdfrenamevariable', 'rastertonetcdf',
+        'computerasterslope', 'computerasteraspect', 'projectandcliprastertoreference', 'getcanopyvariable',
+        'getcanopyvariables', 'combinerasters', 'reversenetcdfyaxis', 'reversenetcdfyaxisandrenamevariable',
+        'netcdfrenamevariable', 'subsetnetcdftoreference', 'subsetnetcdfbytime', 'projectnetcdf',
+        'projectsubsetresamplenetcdftoreferencenetcdf', 'concatenatenetcdf', 'projectraster', 'projectshapefileutm',
+        'projectshapefileepsg', 'createoutletshapefile', 'delineatewatershedatshape', 'delineatewatershedatxy',
+        'resampleraster', 'projectresamplerasterutm', 'projectresamplerasterepsg', 'subsetprojectresamplerasterepsg',
+        'subsetprojectresamplerasterutm', 'resamplenetcdftoreferencenetcdf', 'convertnetcdfunits'])
+
     @property
     def hydro_ds_base_url(self):
-        return 'http://hydro-ds.uwrl.usu.edu'
+        return self._hydro_ds_base_url
+
+    @property
+    def username(self):
+        return self._hg_auth[0]
 
     def check_irods_server_status(self):
         url = '/server'
@@ -125,6 +201,7 @@ class HydroDS(object):
 
         if hg_username and hg_password:
             self._hg_token = None
+            self._hg_token_manager.invalidate()
             self._user_hg_authenticated = False
             self._hg_username = hg_username
             self._hg_password = hg_password
@@ -137,11 +214,12 @@ class HydroDS(object):
     def hydrogate_authenticate(self, username, password, hpc='USU'):
         if hpc in self.get_available_hpc():
             self._hg_token = None
+            self._hg_token_manager.invalidate()
             self._user_hg_authenticated = False
             self._hg_username = username
             self._hg_password = password
             try:
-                self._requests.auth.HTTPBasicAuth(self._hg_username, self._hg_password)
+                requests.auth.HTTPBasicAuth(self._hg_username, self._hg_password)
                 self._get_token()
                 self._user_hg_authenticated = True
                 self._default_hpc = hpc
@@ -156,11 +234,12 @@ class HydroDS(object):
         if hpc:
             if hpc in self.get_available_hpc():
                 self._hg_token = None
+                self._hg_token_manager.invalidate()
                 self._user_hg_authenticated = False
                 self._hg_username = username
                 self._hg_password = password
                 try:
-                    self._requests.auth.HTTPBasicAuth(self._hg_username, self._hg_password)
+                    requests.auth.HTTPBasicAuth(self._hg_username, self._hg_password)
                     self._get_token()
                     self._user_hg_authenticated = True
                     self._default_hpc = hpc
@@ -189,11 +268,7 @@ class HydroDS(object):
     def get_available_programs(self, hpc=None):
         # returns a list of installed program names that are installed on a specified hpc resource
         self._check_user_hpc_authentication()
-        if not self._hg_token:
-            self._get_token()
-        else:
-            if self._get_token_expire_time() == 0:
-                self._get_token()
+        self._get_token()
 
         if not hpc:
             hpc = self._default_hpc
@@ -214,11 +289,7 @@ class HydroDS(object):
     def get_program_info(self, program_name):
         # returns information about specific program/application
         self._check_user_hpc_authentication()
-        if not self._hg_token:
-            self._get_token()
-        else:
-            if self._get_token_expire_time() == 0:
-                self._get_token()
+        self._get_token()
 
         request_data = {'token': self._hg_token, 'program': program_name}
         response = self._requests.get(self._hg_program_info_url, params=request_data, verify=False)
@@ -233,9 +304,11 @@ class HydroDS(object):
             raise Exception('Hydrogate error %s' % response_dict['description'])
 
     def _get_token(self):
-        if self._hg_token:
-            return self._hg_token
+        # returns the cached token - a new token is requested only when the cached one is about to expire
+        self._hg_token = self._hg_token_manager.get_token()
+        return self._hg_token
 
+    def _request_token(self):
         user_data = {'username': self._hg_username, 'password': self._hg_password}
         response = self._requests.post(self._hg_token_url, data=user_data, verify=False)
         if response.status_code != requests.codes.ok:
@@ -243,8 +316,7 @@ class HydroDS(object):
 
         response_dict = json.loads(response.content)
         if response_dict['status'] == 'success':
-            self._hg_token = response_dict['token']
-            return self._hg_token
+            return response_dict['token']
         else:
             raise Exception('Hydrogate error:%s' % response_dict['description'])
 
@@ -254,7 +326,10 @@ class HydroDS(object):
         if not self._hg_token:
             return 0
 
-        request_data = {'token': self._hg_token}
+        return self._request_token_expire_time(self._hg_token)
+
+    def _request_token_expire_time(self, token):
+        request_data = {'token': token}
         response = self._requests.get(self._hg_token_expire_time_url, params=request_data, verify=False)
 
         if response.status_code != requests.codes.ok:
@@ -266,20 +341,38 @@ class HydroDS(object):
         else:
             raise Exception('Hydrogate error: %s' % response_dict['description'])
 
+    def close(self):
+        """
+        Closes all the pooled http connections of this client and stops any background token refresh
+        """
+        self._hg_token_manager.invalidate()
+        self._requests.close()
+
+    def get_connection_stats(self):
+        """
+        Gets the http connection reuse statistics for each host this client has talked to
+
+        :return: a dictionary keyed by host base url (e.g. 'http://hydro-ds.uwrl.usu.edu') where each value is a
+                 dictionary with keys 'requests', 'connections_opened' and 'connections_reused'
+
+        Example usage:
+            hds = HydroDS(username=your_username, password=your_password)
+            hds.list_my_files()
+            for base_url, stats in hds.get_connection_stats().items():
+                print(base_url, stats['connections_reused'])
+        """
+        return self._requests.get_stats()
+
     def show_service_request_history(self, order='first', count=None):
         _ServiceLog.print_log(order=order, count=count)
 
     def get_most_recent_request(self, service_name=None, service_id_name=None, service_id_value=None):
         return _ServiceLog.get_most_recent_request(service_name, service_id_name, service_id_value)
 
-    def upload_package(self, package_file_url_path, wait_until_done=False):
+    def upload_package(self, package_file_url_path, wait_until_done=False, estimated_duration=None):
         self._check_user_hpc_authentication()
 
-        if not self._hg_token:
-            self._get_token()
-        else:
-            if self._get_token_expire_time() == 0:
-                self._get_token()
+        self._get_token()
 
         # location of the file to be uploaded (must be a url file path).
         request_data = {'token': self._hg_token, 'package': package_file_url_path, 'hpc': self._default_hpc}
@@ -298,12 +391,9 @@ class HydroDS(object):
             self.save_service_call_history()
             if wait_until_done:
                 # now check upload status
-                upload_status_request = self.get_upload_status()
-                while upload_status_request.service_status != "PackageTransferDone":
-                    if upload_status_request.service_status == "UploadError":
-                        return service_req, 'Upload error'
-                    time.sleep(10)
-                    upload_status_request = self.get_upload_status()
+                upload_status = self.wait_for_uploads([package_id], estimated_duration=estimated_duration)[package_id]
+                if upload_status == "UploadError":
+                    return service_req, 'Upload error'
 
                 return service_req, 'success'
             return service_req, None
@@ -319,11 +409,7 @@ class HydroDS(object):
             else:
                 package_id = last_request.service_id_value
 
-        if not self._hg_token:
-            self._get_token()
-        else:
-            if self._get_token_expire_time() == 0:
-                self._get_token()
+        self._get_token()
 
         request_data = {'token': self._hg_token, 'packageid': int(package_id)}
         response = self._requests.get(self._hg_upload_pkg_status_url, params=request_data, verify=False)
@@ -341,12 +427,12 @@ class HydroDS(object):
         else:
             raise Exception('Hydrogate error:' + response_dict['description'])
 
-    def submit_job(self, package_id, program_name, input_raster_file_name=None, wait_until_done=False, **kwargs):
+    def submit_job(self, package_id, program_name, input_raster_file_name=None, wait_until_done=False,
+                   estimated_duration=None, **kwargs):
        # TODO: check that the user provided program_name is one of the supported programs using the get_available_programs()
         self._check_user_hpc_authentication()
 
-        if self._get_token_expire_time() == 0:
-            self._get_token()
+        self._get_token()
 
         job_def = {}
         if len(kwargs) > 0:
@@ -381,12 +467,9 @@ class HydroDS(object):
             _ServiceLog.add(service_req)
             self.save_service_call_history()
             if wait_until_done:
-                job_status = self.get_job_status(job_id=job_id)
-                while job_status != 'JobOutputFileTransferDone':
-                    if job_status == 'JobError':
-                        return service_req, 'Run job error'
-                    time.sleep(20)
-                    job_status = self.get_job_status(job_id=job_id)
+                job_status = self.wait_for_jobs([job_id], estimated_duration=estimated_duration)[job_id]
+                if job_status == 'JobError':
+                    return service_req, 'Run job error'
 
                 return service_req, 'success'
             return service_req, None
@@ -397,8 +480,7 @@ class HydroDS(object):
         # TODO: add docstring for this method
         self._check_user_hpc_authentication()
 
-        if self._get_token_expire_time() == 0:
-            self._get_token()
+        self._get_token()
 
         request_data = {'token': self._hg_token, 'jobid': job_id}
         response = self._requests.get(self._hg_job_status_url, params=request_data, verify=False)
@@ -416,6 +498,52 @@ class HydroDS(object):
         else:
             raise Exception('Hydrogate error:%s' % response_dict['description'])
 
+    def wait_for_uploads(self, package_ids, estimated_duration=None, timeout=None):
+        """
+        Waits for a batch of HydroGate package uploads to finish. Upload status of all the packages is checked from
+        a single polling loop with exponential backoff between the checks for each package
+
+        :param package_ids: a list of package ids (as returned by upload_package())
+        :type package_ids: list
+        :param estimated_duration: (optional) expected upload time in seconds - status is not checked before most of
+                                   this time has passed
+        :type estimated_duration: float
+        :param timeout: (optional) max number of seconds to wait
+        :type timeout: float
+        :return: a dictionary with package id as key and final upload status ('PackageTransferDone' or
+                 'UploadError') as value (the value is None for a package that did not finish before timeout)
+        """
+        self._check_user_hpc_authentication()
+        poller = StatusPoller(check_status=lambda package_id: self.get_upload_status(package_id).service_status,
+                              done_states=('PackageTransferDone',), error_states=('UploadError',),
+                              initial_delay=5, max_delay=60)
+        for package_id in package_ids:
+            poller.watch(package_id, estimated_duration=estimated_duration)
+        return poller.wait(timeout=timeout)
+
+    def wait_for_jobs(self, job_ids, estimated_duration=None, timeout=None):
+        """
+        Waits for a batch of HydroGate jobs to finish. Status of all the jobs is checked from a single polling loop
+        with exponential backoff between the checks for each job
+
+        :param job_ids: a list of job ids (as returned by submit_job())
+        :type job_ids: list
+        :param estimated_duration: (optional) expected job run time in seconds - status is not checked before most of
+                                   this time has passed
+        :type estimated_duration: float
+        :param timeout: (optional) max number of seconds to wait
+        :type timeout: float
+        :return: a dictionary with job id as key and final job status ('JobOutputFileTransferDone' or 'JobError') as
+                 value (the value is None for a job that did not finish before timeout)
+        """
+        self._check_user_hpc_authentication()
+        poller = StatusPoller(check_status=lambda job_id: self.get_job_status(job_id=job_id),
+                              done_states=('JobOutputFileTransferDone',), error_states=('JobError',),
+                              initial_delay=10, max_delay=300)
+        for job_id in job_ids:
+            poller.watch(job_id, estimated_duration=estimated_duration)
+        return poller.wait(timeout=timeout)
+
     def list_my_files(self):
         """
         Lists url file paths for all the files the user owns on HydroDS api server
@@ -433,8 +561,7 @@ class HydroDS(object):
         """
 
         url = self._get_dataservice_specific_url('myfiles/list')
-        response = self._make_data_service_request(url=url)
-        return self._process_dataservice_response(response, save_as=None)
+        return self._call_data_service(url=url)
 
     def delete_my_file(self, file_name):
         """
@@ -461,8 +588,79 @@ class HydroDS(object):
             raise HydroDSArgumentException("{file_name} is not a valid file name".format(file_name=file_name))
 
         url = self._get_dataservice_specific_url('myfiles/delete/{file_name}'.format(file_name=file_name))
-        response = self._make_data_service_request(url=url, http_method='DELETE')
-        return self._process_dataservice_response(response, save_as=None)
+        return self._call_data_service(url=url, http_method='DELETE')
+
+    def delete_my_files(self, pattern=None, older_than=None, keep=None, max_workers=8):
+        """
+        Deletes the user files that match a file name pattern and/or are older than a given age. Files are deleted
+        concurrently - a file that fails to delete doesn't stop the deletion of the other files
+
+        :param pattern: (optional) shell style file name pattern (e.g. '*.nc') of the files to delete (default is to
+                        delete all the files)
+        :type pattern: string
+        :param older_than: (optional) min age in seconds of the files to delete, going by the last modified time
+                           reported by the server (files of unknown age are not deleted)
+        :type older_than: float
+        :param keep: (optional) names or shell style file name patterns of the files not to delete
+        :type keep: list
+        :param max_workers: (optional) max number of files to delete at the same time (default is 8)
+        :type max_workers: int
+        :return: a dictionary with keys 'deleted' (list of names of the deleted files) and 'failed' (dictionary of
+                 file name to exception raised for the files that failed to delete)
+
+        :raises: HydroDSArgumentException: one or more argument failed validation at client side
+        :raises: HydroDSNotAuthenticatedException: provided user account failed validation
+
+        Example usage:
+            hds = HydroDS(username=your_username, password=your_password)
+            # delete all the netcdf files more than a day old
+            delete_result = hds.delete_my_files(pattern='*.nc', older_than=24 * 3600)
+            print(len(delete_result['deleted']), delete_result['failed'])
+        """
+        if int(max_workers) < 1:
+            raise HydroDSArgumentException("max_workers must be a positive integer value")
+
+        keep = list(keep or [])
+        file_urls = dict((file_url.split('/')[-1], file_url) for file_url in self.list_my_files())
+        file_names = [file_name for file_name in sorted(file_urls)
+                      if not any(fnmatch.fnmatch(file_name, keep_pattern) for keep_pattern in keep) and
+                      (pattern is None or fnmatch.fnmatch(file_name, pattern))]
+
+        delete_result = {'deleted': [], 'failed': {}}
+        if not file_names:
+            return delete_result
+
+        executor = futures.ThreadPoolExecutor(max_workers=min(int(max_workers), len(file_names)))
+        try:
+            if older_than is not None:
+                file_ages = executor.map(lambda file_name: self._get_file_age(file_urls[file_name]), file_names)
+                file_names = [file_name for file_name, file_age in zip(file_names, list(file_ages))
+                              if file_age is not None and file_age > older_than]
+
+            delete_futures = dict((executor.submit(self.delete_my_file, file_name), file_name)
+                                  for file_name in file_names)
+            for delete_future in futures.as_completed(delete_futures):
+                file_name = delete_futures[delete_future]
+                try:
+                    delete_future.result()
+                    delete_result['deleted'].append(file_name)
+                except Exception as ex:
+                    delete_result['failed'][file_name] = ex
+        finally:
+            executor.shutdown(wait=True)
+
+        delete_result['deleted'].sort()
+        return delete_result
+
+    def _get_file_age(self, file_url_path):
+        # seconds since the file was last modified on the server - None if not known
+        file_validator = self._get_file_validator(file_url_path)
+        if file_validator is None or not file_validator[2]:
+            return None
+        last_modified = email.utils.parsedate_tz(file_validator[2])
+        if last_modified is None:
+            return None
+        return time.time() - email.utils.mktime_tz(last_modified)
 
     def get_static_files_info(self):
         """
@@ -503,8 +701,7 @@ class HydroDS(object):
         ]
         """
         url = self._get_dataservice_specific_url('showstaticdata/info')
-        response = self._make_data_service_request(url=url)
-        return self._process_dataservice_response(response, save_as=None)
+        return self._call_data_service(url=url)
 
     def subset_raster(self, left, top, right, bottom, input_raster, output_raster, save_as=None):
         """
@@ -557,8 +754,7 @@ class HydroDS(object):
         payload = {'xmin': left, 'ymin': bottom, 'xmax': right, 'ymax': top, 'input_raster': input_raster,
                    'output_raster': output_raster}
 
-        response = self._make_data_service_request(url=url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     # TODO: this one not working as the HydroDS service api is not working
     def subset_usgs_ned_dem(self, left, top, right, bottom, output_raster, save_as=None):
@@ -583,8 +779,7 @@ class HydroDS(object):
             raise HydroDSArgumentException("{file_name} is not a valid raster file name".format(file_name=output_raster))
 
         payload = {'xmin': left, 'ymin': bottom, 'xmax': right, 'ymax': top, 'output_raster': output_raster}
-        response = self._make_data_service_request(url=url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def subset_raster_to_reference(self, input_raster_url_path, ref_raster_url_path, output_raster, save_as=None):
         """
@@ -629,8 +824,7 @@ class HydroDS(object):
         payload = {"input_raster": input_raster_url_path, 'reference_raster': ref_raster_url_path,
                    'output_raster': output_raster}
 
-        response = self._make_data_service_request(url=url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def raster_to_netcdf_and_rename_variable(self, input_raster_url_path, output_netcdf, increasing_x=False,
                                              increasing_y=False, output_varname='Band1', save_as=None):
@@ -692,8 +886,7 @@ class HydroDS(object):
         payload = {"input_raster": input_raster_url_path, 'output_netcdf': output_netcdf, 'increasing_x': increasing_x,
                    'increasing_y': increasing_y, 'output_varname': output_varname}
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def raster_to_netcdf(self, input_raster_url_path, output_netcdf, save_as=None):
         """
@@ -736,8 +929,7 @@ class HydroDS(object):
         url = self._get_dataservice_specific_url('rastertonetcdf')
         payload = {"input_raster": input_raster_url_path, 'output_netcdf': output_netcdf}
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def create_raster_slope(self, input_raster_url_path, output_raster, save_as=None):
         """
@@ -816,8 +1008,7 @@ class HydroDS(object):
 
         payload['output_raster'] = output_raster
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def project_clip_raster(self, input_raster, ref_raster_url_path, output_raster, save_as=None):
         """
@@ -862,8 +1053,7 @@ class HydroDS(object):
         self._is_file_name_valid(output_raster, ext='.tif')
         payload['output_raster'] = output_raster
 
-        response = self._make_data_service_request(url=url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def get_canopy_variable(self, input_NLCD_raster_url_path, variable_name, output_netcdf, save_as=None):
         """
@@ -907,8 +1097,7 @@ class HydroDS(object):
         payload = {"in_NLCDraster": input_NLCD_raster_url_path, 'variable_name': variable_name,
                    'output_netcdf': output_netcdf}
 
-        response = self._make_data_service_request(url=url, params=payload)
-        return self._process_dataservice_response(response, save_as=save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     # TODO: We should not support the following method. The functionality of this mkethod can be achieved by calling
     # 3 time the get_canopy_variable() method
@@ -935,8 +1124,7 @@ class HydroDS(object):
                     file_name=output_laiNetCDF))
             payload['out_laiNetCDF'] = output_laiNetCDF
 
-        response = self._make_data_service_request(url=url, params=payload)
-        return self._process_dataservice_response(response, save_as=None)
+        return self._request_data_service(url, params=payload)
 
     def combine_rasters(self, input_one_raster_url_path, input_two_raster_url_path, output_raster, save_as=None):
         """
@@ -981,8 +1169,55 @@ class HydroDS(object):
         payload = {"input_raster1": input_one_raster_url_path, "input_raster2": input_two_raster_url_path,
                    'output_raster': output_raster}
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
+
+    def combine_raster_files(self, input_raster_url_paths, output_raster, max_workers=4, save_as=None):
+        """
+        Combines multiple rasters (e.g. adjacent tiles) to create a new raster. The rasters are combined pairwise as a
+        balanced tree - the pairs of each round are combined at the same time - so n rasters are combined in about
+        log2(n) rounds
+
+        :param input_raster_url_paths: url file paths of the raster files (user owned) on HydroDS api server
+        :type input_raster_url_paths: list
+        :param output_raster: name of the output (combined) raster file (if there is file already with the same name it
+                              will be overwritten) - the intermediate files are named after it
+        :type output_raster: string
+        :param max_workers: (optional) max number of pairs to combine at the same time (default is 4)
+        :type max_workers: int
+        :param save_as: (optional) file name and file path to save the combined raster file locally
+        :type save_as: string
+        :return: a dictionary with key 'output_raster' and value of url path for the combined raster file (the url path
+                 of the input file if there is only one input file)
+
+        :raises: HydroDSArgumentException: one or more argument failed validation at client side
+        :raises: HydroDSBadRequestException: one or more argument failed validation on the server side
+        :raises: HydroDSNotAuthenticatedException: provided user account failed validation
+        :raises: HydroDSNotAuthorizedException: user making this request is not authorized to do so
+        :raises: HydroDSNotFoundException: specified raster input file(s) does not exist on the server
+
+        Example usage:
+            hds = HydroDS(username=your_username, password=your_password)
+            hds_response_data = hds.combine_raster_files(input_raster_url_paths=[provide_url_path_for_1st_tile,
+                                                                                 provide_url_path_for_2nd_tile,
+                                                                                 provide_url_path_for_3rd_tile],
+                                                         output_raster='combined_tiles.tif')
+
+            # print the url path for the combined raster file
+            output_combined_raster_url = hds_response_data['output_raster']
+            print(output_combined_raster_url)
+        """
+        if type(input_raster_url_paths) is not list or not input_raster_url_paths:
+            raise HydroDSArgumentException("The value for the parameter input_raster_url_paths must be a non-empty "
+                                           "list")
+
+        if not self._is_file_name_valid(output_raster, ext='.tif'):
+            raise HydroDSArgumentException("{file_name} is not a valid raster file".format(file_name=output_raster))
+
+        if int(max_workers) < 1:
+            raise HydroDSArgumentException("max_workers must be a positive integer value")
+
+        return self._join_files_pairwise(self.combine_rasters, input_raster_url_paths, output_raster, 'output_raster',
+                                         max_workers, save_as)
 
     # TODO: Not working - no HydroDS web service
     def get_daymet_mosaic(self, start_year, end_year, save_as=None):
@@ -1089,8 +1324,7 @@ class HydroDS(object):
         url = self._get_dataservice_specific_url('reversenetcdfyaxis')
         payload = {"input_netcdf": input_netcdf_url_path, 'output_netcdf': output_netcdf}
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def reverse_netcdf_yaxis_rename_variable(self, input_netcdf_url_path, output_netcdf, input_variable_name=None,
                                              output_variable_name=None, save_as=None):
@@ -1144,8 +1378,7 @@ class HydroDS(object):
 
         payload['output_netcdf'] = output_netcdf
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def netcdf_rename_variable(self, input_netcdf_url_path, output_netcdf, input_variable_name=None,
                                output_variable_name=None, save_as=None):
@@ -1199,8 +1432,7 @@ class HydroDS(object):
 
         payload['output_netcdf'] = output_netcdf
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def subset_netcdf(self, input_netcdf, ref_raster_url_path, output_netcdf, save_as=None):
         """
@@ -1246,11 +1478,10 @@ class HydroDS(object):
         payload = {"input_netcdf": input_netcdf, 'reference_raster': ref_raster_url_path,
                    'output_netcdf': output_netcdf}
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def subset_netcdf_by_time(self, input_netcdf_url_path, time_dimension_name, start_date, end_date,
-                              output_netcdf, save_as=None):
+                              output_netcdf, save_as=None, time_origin=None):
         """
         Subset a netcdf file by time dimension
 
@@ -1267,6 +1498,10 @@ class HydroDS(object):
         :type output_netcdf: string
         :param save_as: (optional) netcdf file name and file path to save the subsetted netcdf file locally
         :type save_as: string
+        :param time_origin: (optional) date of the first daily time step in the input netcdf file - the start and end
+                            dates are then converted to the time indexes of the file (e.g. '01/01/2010' for a
+                            yearly Daymet file)
+        :type time_origin: string (must be of format: 'mm/dd/yyyy')
         :return: a dictionary with key 'output_netcdf' and value of url path for the generated netcdf file
 
         :raises: HydroDSArgumentException: one or more argument failed validation at client side
@@ -1304,8 +1539,19 @@ class HydroDS(object):
         if start_date_value > end_date_value:
             raise HydroDSArgumentException("start_date must be a date before the end_date")
 
-        start_time_index = start_date_value.day
-        end_time_index = start_date_value.day + (end_date_value - start_date_value).days
+        if time_origin:
+            try:
+                time_origin_value = datetime.datetime.strptime(time_origin, DATE_FORMAT)
+            except ValueError:
+                raise HydroDSArgumentException("time_origin must be a string in the format of 'mm/dd/yyyy'")
+
+            if time_origin_value > start_date_value:
+                raise HydroDSArgumentException("time_origin must not be a date after the start_date")
+
+            start_time_index = (start_date_value - time_origin_value).days
+        else:
+            start_time_index = start_date_value.day
+        end_time_index = start_time_index + (end_date_value - start_date_value).days
 
         if not self._is_file_name_valid(output_netcdf, ext='.nc'):
             raise HydroDSArgumentException('{file_name} is not a valid NetCDF file '
@@ -1316,8 +1562,7 @@ class HydroDS(object):
                    'start_time_index': start_time_index, 'end_time_index': end_time_index,
                    'output_netcdf': output_netcdf}
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def project_netcdf(self, input_netcdf_url_path, utm_zone, variable_name, output_netcdf, save_as=None):
         """
@@ -1368,8 +1613,7 @@ class HydroDS(object):
         payload = {"input_netcdf": input_netcdf_url_path, 'variable_name': variable_name, 'utm_zone': utm_zone,
                    'output_netcdf': output_netcdf}
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def project_subset_resample_netcdf(self, input_netcdf_url_path, ref_netcdf_url_path, variable_name,
                                        output_netcdf, save_as=None):
@@ -1420,8 +1664,7 @@ class HydroDS(object):
         payload = {"input_netcdf": input_netcdf_url_path, 'reference_netcdf': ref_netcdf_url_path,
                    'variable_name': variable_name, 'output_netcdf': output_netcdf}
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def concatenate_netcdf(self, input_netcdf1_url_path, input_netcdf2_url_path, output_netcdf, save_as=None):
         """
@@ -1466,8 +1709,56 @@ class HydroDS(object):
         payload = {"input_netcdf1": input_netcdf1_url_path, "input_netcdf2": input_netcdf2_url_path,
                    'output_netcdf': output_netcdf}
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
+
+    def concatenate_netcdf_files(self, input_netcdf_url_paths, output_netcdf, max_workers=4, save_as=None):
+        """
+        Joins multiple netcdf files (in the given order) to create a new netcdf file. The files are joined pairwise
+        as a balanced tree - the pairs of each round are joined at the same time - so n files are joined in about
+        log2(n) rounds and each file is copied about log2(n) times instead of joining the files one by one
+
+        :param input_netcdf_url_paths: url file paths of the netcdf files (user owned) on HydroDS api server in the
+                                       order to join them (e.g. yearly files in time order)
+        :type input_netcdf_url_paths: list
+        :param output_netcdf: name of the output (concatenated) netcdf file (if there is file already with the same name
+                              it will be overwritten) - the intermediate files are named after it
+        :type output_netcdf: string
+        :param max_workers: (optional) max number of pairs to join at the same time (default is 4)
+        :type max_workers: int
+        :param save_as: (optional) file name and file path to save the generated concatenated netcdf file locally
+        :type save_as: string
+        :return: a dictionary with key 'output_netcdf' and value of url path for the joined netcdf file (the url path
+                 of the input file if there is only one input file)
+
+        :raises: HydroDSArgumentException: one or more argument failed validation at client side
+        :raises: HydroDSBadRequestException: one or more argument failed validation on the server side
+        :raises: HydroDSNotAuthenticatedException: provided user account failed validation
+        :raises: HydroDSNotAuthorizedException: user making this request is not authorized to do so
+        :raises: HydroDSNotFoundException: specified netcdf input file(s) does not exist on the server
+
+        Example usage:
+            hds = HydroDS(username=your_username, password=your_password)
+            hds_response_data = hds.concatenate_netcdf_files(input_netcdf_url_paths=[provide_url_path_for_2014_file,
+                                                                                     provide_url_path_for_2015_file,
+                                                                                     provide_url_path_for_2016_file],
+                                                             output_netcdf='prcp_2014_2016.nc')
+
+            # print the url path for the concatenated netcdf file
+            output_concatenated_netcdf_url = hds_response_data['output_netcdf']
+            print(output_concatenated_netcdf_url)
+        """
+        if type(input_netcdf_url_paths) is not list or not input_netcdf_url_paths:
+            raise HydroDSArgumentException("The value for the parameter input_netcdf_url_paths must be a non-empty "
+                                           "list")
+
+        if not self._is_file_name_valid(output_netcdf, ext='.nc'):
+            raise HydroDSArgumentException("{file_name} is not a valid netcdf file".format(file_name=output_netcdf))
+
+        if int(max_workers) < 1:
+            raise HydroDSArgumentException("max_workers must be a positive integer value")
+
+        return self._join_files_pairwise(self.concatenate_netcdf, input_netcdf_url_paths, output_netcdf,
+                                         'output_netcdf', max_workers, save_as)
 
     def project_raster_to_UTM_NAD83(self, input_raster_url_path, utm_zone, output_raster, save_as=None):
         """
@@ -1514,8 +1805,7 @@ class HydroDS(object):
         url = self._get_dataservice_specific_url('projectraster')
         payload = {"input_raster": input_raster_url_path, 'utmZone': utm_zone, 'output_raster': output_raster}
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def project_shapefile(self, input_shapefile_url_path, output_shape_file, utm_zone=None, epsg_code=None,
                           save_as=None):
@@ -1592,8 +1882,7 @@ class HydroDS(object):
             payload['epsg_code'] = epsg_code
             url = self._get_dataservice_specific_url('projectshapefileepsg')
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def create_outlet_shapefile(self, point_x, point_y, output_shape_file_name, save_as=None):
         """
@@ -1636,8 +1925,7 @@ class HydroDS(object):
 
         payload['output_shape_file_name'] = output_shape_file_name
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def delineate_watershed(self, input_raster_url_path, threshold, output_raster, output_outlet_shapefile,
                             epsg_code=None, outlet_point_x=None, outlet_point_y=None,
@@ -1762,8 +2050,7 @@ class HydroDS(object):
                        'outlet_point_y': outlet_point_y, "input_DEM_raster": input_raster_url_path,
                        "output_raster": output_raster, 'output_outlet_shapefile': output_outlet_shapefile}
 
-        response = self._make_data_service_request(url=url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def resample_raster(self, input_raster_url_path, cell_size_dx, cell_size_dy, output_raster, resample='bilinear',
                         save_as=None):
@@ -1822,8 +2109,7 @@ class HydroDS(object):
         payload = {"input_raster": input_raster_url_path, 'dx': cell_size_dx, 'dy': cell_size_dy, 'resample': resample,
                    'output_raster': output_raster}
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def project_resample_raster(self, input_raster_url_path, cell_size_dx, cell_size_dy, output_raster, utm_zone=None,
                                 epsg_code=None, resample='near',  save_as=None):
@@ -1917,8 +2203,7 @@ class HydroDS(object):
             payload['epsg_code'] = epsg_code
             url = self._get_dataservice_specific_url('projectresamplerasterepsg')
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def subset_project_resample_raster(self, input_raster, left, top, right, bottom, cell_size_dx,
                                        cell_size_dy, output_raster, resample='near', epsg_code=None, save_as=None):
@@ -2014,8 +2299,7 @@ class HydroDS(object):
         else:
             url = self._get_dataservice_specific_url('subsetprojectresamplerasterutm')
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def resample_netcdf(self, input_netcdf_url_path, ref_netcdf_url_path, variable_name, output_netcdf,
                         save_as=None):
@@ -2065,8 +2349,7 @@ class HydroDS(object):
         payload = {"input_netcdf": input_netcdf_url_path, 'reference_netcdf': ref_netcdf_url_path,
                    'variable_name': variable_name, 'output_netcdf': output_netcdf}
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def convert_netcdf_units(self, input_netcdf_url_path, output_netcdf, variable_name, variable_new_units=' ',
                              multiplier_factor=1, offset=0, save_as=None):
@@ -2122,8 +2405,7 @@ class HydroDS(object):
                    'variable_name': variable_name, 'variable_new_units': variable_new_units,
                    'multiplier_factor': multiplier_factor, 'offset': offset}
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def upload_file_irods(self, file_to_upload):
         if not os.path.isfile(file_to_upload):
@@ -2131,11 +2413,10 @@ class HydroDS(object):
 
         file_name = os.path.basename(file_to_upload)
         file_url_path = self._irods_rest_base_url + '/fileContents/usu/home/rods/' + file_name
-        headers = {'accept': 'application/json'}
-        with open(file_to_upload, 'rb') as upload_file_obj:
-            response = self._requests.post(file_url_path, data={'uploadFile': file_name},
-                                          files={'file': upload_file_obj}, auth=(self._irods_username, self._irods_password),
-                                          headers=headers)
+        with _MultipartFileStream(file_to_upload, fields={'uploadFile': file_name}) as upload_stream:
+            headers = {'accept': 'application/json', 'content-type': upload_stream.content_type}
+            response = self._requests.post(file_url_path, data=upload_stream,
+                                           auth=(self._irods_username, self._irods_password), headers=headers)
 
         if response.status_code != requests.codes.ok:
             raise Exception("Failed to upload to iRODS." + response.reason + " " + response.content)
@@ -2176,12 +2457,68 @@ class HydroDS(object):
             raise HydroDSArgumentException("You don't have read access to the file (%s) to be uploaded."
                                            % file_to_upload)
         url = self._get_dataservice_specific_url('myfiles/upload')
-        with open(file_to_upload, 'rb') as upload_file_obj:
-            response = self._make_data_service_request(url=url, http_method='POST', files={'file': upload_file_obj})
 
-        return self._process_dataservice_response(response, save_as=None)
+        def upload():
+            # file content is streamed from the disk - not read into memory (a new stream for each attempt)
+            with _MultipartFileStream(file_to_upload) as upload_stream:
+                response = self._make_data_service_request(url=url, http_method='POST', data=upload_stream,
+                                                           headers={'content-type': upload_stream.content_type})
+            return self._process_dataservice_response(response, save_as=None)
+
+        return self._call_with_retries(url, upload)
+
+    def upload_files(self, files_to_upload, max_workers=4):
+        """
+        Upload multiple files to HydroDS api server. Files are uploaded concurrently and each file is streamed from
+        the disk without reading the whole file into memory
+
+        :param files_to_upload: a list of file names with path for the files to upload from
+        :type files_to_upload: list
+        :param max_workers: (optional) max number of files to upload at the same time (default is 4)
+        :type max_workers: int
+        :return: a list of dictionaries (one for each file in the same order as the files_to_upload) with keys:
+                 'file' (file to upload), 'url' (url of the uploaded file - None if the upload failed), 'bytes' (file
+                 size), 'seconds' (upload time), 'throughput' (bytes per second), 'error' (exception raised if the
+                 upload failed - otherwise None)
+
+        :raises: HydroDSArgumentException: one or more argument failed validation at client side
+
+        Example usage:
+            hds = HydroDS(username=your_username, password=your_password)
+            upload_results = hds.upload_files(files_to_upload=[r'E:\Scratch\param.dat', r'E:\Scratch\control.dat'])
+
+            # print the url path and the upload speed for each uploaded file
+            for upload_result in upload_results:
+                print(upload_result['url'], upload_result['throughput'])
+        """
+        if type(files_to_upload) is not list:
+            raise HydroDSArgumentException("The value for the parameter files_to_upload must be a list")
+
+        if int(max_workers) < 1:
+            raise HydroDSArgumentException("max_workers must be a positive integer value")
+
+        def upload(file_to_upload):
+            upload_result = {'file': file_to_upload, 'url': None, 'bytes': 0, 'seconds': 0, 'throughput': 0,
+                             'error': None}
+            start_time = time.time()
+            try:
+                upload_result['url'] = self.upload_file(file_to_upload)
+                upload_result['bytes'] = os.path.getsize(file_to_upload)
+            except Exception as ex:
+                upload_result['error'] = ex
+
+            upload_result['seconds'] = time.time() - start_time
+            if upload_result['seconds'] > 0:
+                upload_result['throughput'] = upload_result['bytes'] / upload_result['seconds']
+            return upload_result
 
-    def download_file(self, file_url_path, save_as):
+        executor = futures.ThreadPoolExecutor(max_workers=min(int(max_workers), max(len(files_to_upload), 1)))
+        try:
+            return list(executor.map(upload, files_to_upload))
+        finally:
+            executor.shutdown(wait=True)
+
+    def download_file(self, file_url_path, save_as, checksum=None):
         """
         Download a file from the HydroDS api server
 
@@ -2189,6 +2526,8 @@ class HydroDS(object):
         :type file_url_path: string
         :param save_as: file name and file path to save the downloaded file
         :type save_as: string
+        :param checksum: (optional) expected md5 hex digest of the file for verifying the downloaded file
+        :type checksum: string
         :return: None
 
         :raises: HydroDSArgumentException: one or more argument failed validation at client side
@@ -2205,17 +2544,25 @@ class HydroDS(object):
         """
         self._validate_file_save_as(save_as)
 
-        with open(save_as, 'wb') as file_obj:
-            response = requests.get(file_url_path, stream=True, auth=self._hg_auth)
+        # on failure raise appropriate HydroDS exception
+        self._downloader.download(file_url_path, save_as, on_error=self._process_dataservice_response,
+                                  checksum=checksum, cache=self._download_cache, auth=self._hg_auth)
 
-            if not response.ok:
-                # raise appropriate HydroDS exception
-                self._process_dataservice_response(response)
+    def set_download_cache(self, download_cache):
+        """
+        Sets a local cache for the files downloaded by this client so that a file that has not changed on the server
+        since it was last downloaded is not downloaded again
+
+        :param download_cache: the cache to use (None to stop using a cache)
+        :type download_cache: DownloadCache
 
-            for block in response.iter_content(1024):
-                if not block:
-                    break
-                file_obj.write(block)
+        Example usage:
+            hds = HydroDS(username=your_username, password=your_password)
+            hds.set_download_cache(DownloadCache(max_size=500 * 1024 * 1024))
+        """
+        if download_cache is not None and not isinstance(download_cache, DownloadCache):
+            raise HydroDSArgumentException("download_cache must be an object of type DownloadCache")
+        self._download_cache = download_cache
 
     def zip_files(self, files_to_zip, zip_file_name, save_as=None):
         """
@@ -2257,25 +2604,14 @@ class HydroDS(object):
         file_names = ','.join(files_to_zip)
         url = self._get_dataservice_specific_url('myfiles/zip')
         payload = {"file_names": file_names, 'zip_file_name': zip_file_name}
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
 
     def hydrogate_download_file_from_irods(self, file_url_path, save_as):
         self._check_user_irods_authentication()
-        if not self._validate_file_save_as(save_as):
-            return
+        self._validate_file_save_as(save_as)
         file_url_path = self._irods_rest_base_url + '/fileContents' + file_url_path
-        with open(save_as, 'wb') as file_obj:
-            response = requests.get(file_url_path, stream=True, auth=(self._irods_username, self._irods_password))
-
-            if not response.ok:
-                # Something went wrong
-                raise Exception("HydroGate error: Error in downloading the file." + response.reason + " " + response.content)
-
-            for block in response.iter_content(1024):
-                if not block:
-                    break
-                file_obj.write(block)
+        self._downloader.download(file_url_path, save_as, on_error=self._raise_hydrogate_download_error,
+                                  auth=(self._irods_username, self._irods_password))
 
         service_req = ServiceRequest(service_name='download_file', service_id_name='',
                                      service_id_value='', service_status='success', file_path=save_as)
@@ -2288,17 +2624,12 @@ class HydroDS(object):
         self._validate_file_save_as(save_as)
 
         download_file_name = hg_file_url_path.split('/')[-1]
-        hg_download_file_url_path = 'http://129.123.41.158:20198/{file_name}'.format(file_name=download_file_name)
-        with open(save_as, 'wb') as file_obj:
-            response = requests.get(hg_download_file_url_path, stream=True)
-            if not response.ok:
-                # Something went wrong
-                raise Exception("HydroGate error: Error in downloading the file." + response.reason + " " + response.content)
+        hg_download_file_url_path = '{base_url}/{file_name}'.format(base_url=self._hydrogate_file_base_url,
+                                                                    file_name=download_file_name)
+        self._downloader.download(hg_download_file_url_path, save_as, on_error=self._raise_hydrogate_download_error)
 
-            for block in response.iter_content(1024):
-                if not block:
-                    break
-                file_obj.write(block)
+    def _raise_hydrogate_download_error(self, response):
+        raise Exception("HydroGate error: Error in downloading the file." + response.reason + " " + response.content)
 
     def get_hydrogate_result_file(self, hg_file_url_path, save_as):
         result_file_name = hg_file_url_path.split('/')[-1]
@@ -2310,8 +2641,7 @@ class HydroDS(object):
 
         url = self._get_dataservice_specific_url('hydrogate/resultfile')
         payload = {"result_file_name": result_file_name, 'save_as_file_name': save_as}
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as=None)
+        return self._request_data_service(url, params=payload)
 
     def set_hydroshare_account(self, username, password):
         self._hydroshare_auth = (username, password)
@@ -2390,8 +2720,7 @@ class HydroDS(object):
                 payload['metadata'] = metadata
             except Exception as ex:
                 raise HydroDSArgumentException(ex.message)
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as=None)
+        return self._request_data_service(url, params=payload)
 
     ## TOPNET example service
     def download_streamflow(self, usgs_gage, start_year, end_year, output_streamflow=None, save_as=None):
@@ -2414,8 +2743,41 @@ class HydroDS(object):
         url = self._get_dataservice_specific_url('downloadstreamflow')
         payload = {"USGS_gage": usgs_gage, 'Start_Year': start_year, "End_Year": end_year}
 
-        response = self._make_data_service_request(url, params=payload)
-        return self._process_dataservice_response(response, save_as)
+        return self._request_data_service(url, params=payload, save_as=save_as)
+
+    def _join_files_pairwise(self, join, input_url_paths, output_file_name, output_key, max_workers, save_as):
+        # joins the files with join(input_1_url_path, input_2_url_path, output_file_name, save_as=None) as a
+        # balanced tree - adjacent files are joined so that the order of the files is kept
+        if len(input_url_paths) == 1:
+            if save_as:
+                self._validate_file_save_as(save_as)
+                self.download_file(input_url_paths[0], save_as)
+            return {output_key: input_url_paths[0]}
+
+        name_part, ext_part = os.path.splitext(output_file_name)
+
+        def join_pair(pair):
+            round_number, index, (input_1_url_path, input_2_url_path), is_last_round = pair
+            if is_last_round:
+                return join(input_1_url_path, input_2_url_path, output_file_name, save_as=save_as)[output_key]
+            round_output_file_name = '{0}_{1}_{2}{3}'.format(name_part, round_number, index, ext_part)
+            return join(input_1_url_path, input_2_url_path, round_output_file_name)[output_key]
+
+        url_paths = list(input_url_paths)
+        round_number = 0
+        executor = futures.ThreadPoolExecutor(max_workers=min(int(max_workers), len(url_paths) // 2))
+        try:
+            while len(url_paths) > 1:
+                round_number += 1
+                # an odd file out is joined in a later round
+                pairs = [(round_number, index // 2, (url_paths[index], url_paths[index + 1]), len(url_paths) == 2)
+                         for index in range(0, len(url_paths) - 1, 2)]
+                odd_url_paths = url_paths[-1:] if len(url_paths) % 2 else []
+                url_paths = list(executor.map(join_pair, pairs)) + odd_url_paths
+        finally:
+            executor.shutdown(wait=True)
+
+        return {output_key: url_paths[0]}
 
     def _validate_resample_input(self, resample):
         allowed_options = ('near', 'bilinear', 'cubic', 'cubicspline', 'lanczos', 'average', 'mode', 'max', 'min',
@@ -2433,22 +2795,199 @@ class HydroDS(object):
         if not isinstance(bottom, float):
             raise HydroDSArgumentException("bottom value must be a decimal number")
 
-    def _make_data_service_request(self, url, http_method='GET', params=None, data=None, files=None):
-        if http_method == 'GET':
-            return self._requests.get(url, params=params, data=data, auth=self._hg_auth)
-        elif http_method == 'DELETE':
-            return self._requests.delete(url, params=params, data=data, auth=self._hg_auth)
-        elif http_method == 'POST':
-            return self._requests.post(url, params=params, data=data, files=files, auth=self._hg_auth)
-        else:
+    def _make_data_service_request(self, url, http_method='GET', params=None, data=None, files=None, headers=None):
+        if http_method not in ('GET', 'DELETE', 'POST'):
             raise Exception("%s http method is not supported for the HydroDS API." % http_method)
 
+        service_name = self._get_metric_service_name(url)
+        with self._data_service_slots:
+            start_time = time.time()
+            try:
+                if http_method == 'GET':
+                    response = self._requests.get(url, params=params, data=data, headers=headers, auth=self._hg_auth)
+                elif http_method == 'DELETE':
+                    response = self._requests.delete(url, params=params, data=data, headers=headers,
+                                                     auth=self._hg_auth)
+                else:
+                    response = self._requests.post(url, params=params, data=data, files=files, headers=headers,
+                                                   auth=self._hg_auth)
+            except Exception as ex:
+                service_metrics.record_request(service_name, time.time() - start_time, None, len(url), None,
+                                               type(ex).__name__)
+                raise
+
+        service_metrics.record_request(service_name, time.time() - start_time, response.elapsed.total_seconds(),
+                                       self._get_request_size(response.request), self._get_response_size(response),
+                                       response.status_code)
+        return response
+
+    def _call_data_service(self, url, http_method='GET', params=None):
+        # makes a data service request and processes the response - retried as per the retry policy
+        def call():
+            response = self._make_data_service_request(url=url, http_method=http_method, params=params)
+            return self._process_dataservice_response(response, save_as=None)
+
+        return self._call_with_retries(url, call)
+
+    def _call_with_retries(self, url, call):
+        # retries call (that makes a data service request and processes the response) after a failure that the retry
+        # policy classifies as transient (e.g. http status 500, connection reset) - with exponential backoff
+        service_name = self._get_metric_service_name(url)
+        retry_number = 0
+        while True:
+            try:
+                return call()
+            except Exception as ex:
+                retry_number += 1
+                idempotent = self._retry_policy.is_idempotent(service_name)
+                if not self._retry_policy.should_retry(ex, retry_number, idempotent):
+                    if retry_number > 1:
+                        self._retry_policy.record_give_up(service_name)
+                    raise
+
+                self._retry_policy.record_retry(service_name)
+                service_metrics.record_retry(service_name)
+                time.sleep(self._retry_policy.get_delay(retry_number))
+
+    def set_retry_policy(self, retry_policy):
+        """
+        Sets the policy for retrying failed HydroDS data service calls
+
+        :param retry_policy: the retry policy to use (RetryPolicy(max_retries=0) to not retry)
+        :type retry_policy: RetryPolicy
+
+        Example usage:
+            hds = HydroDS(username=your_username, password=your_password)
+            hds.set_retry_policy(RetryPolicy(max_retries=5, backoff_factor=2))
+        """
+        if not isinstance(retry_policy, RetryPolicy):
+            raise HydroDSArgumentException("retry_policy must be an object of type RetryPolicy")
+        self._retry_policy = retry_policy
+
+    def get_retry_stats(self):
+        """
+        :return: a dictionary with keys 'retries' and 'gave_up' (number of calls that failed after being retried),
+                 each a dictionary with service name as key and count as value
+        """
+        return self._retry_policy.get_stats()
+
+    @staticmethod
+    def _get_request_size(prepared_request):
+        # size of the request line url and the body (headers are not counted)
+        body = prepared_request.body
+        if body is None:
+            body_size = 0
+        elif hasattr(body, '__len__'):
+            body_size = len(body)
+        else:
+            body_size = int(prepared_request.headers.get('Content-Length', 0))
+        return len(prepared_request.url) + body_size
+
+    @staticmethod
+    def _get_response_size(response):
+        content_length = response.headers.get('Content-Length')
+        if content_length is not None:
+            return int(content_length)
+        return len(response.content)
+
+    def _get_metric_service_name(self, url):
+        # the service name the metrics of a call are recorded under
+        if '/api/dataservice/' not in url:
+            return 'file_download'
+        service_name = self._get_service_name_from_url(url.split('?')[0])
+        if service_name.startswith('myfiles/delete/'):
+            return 'myfiles/delete'
+        return service_name
+
+    def get_service_metrics(self):
+        """
+        Gets the metrics of the HydroDS service calls made from this process: for each service the number of calls
+        and retries, the response status codes and histograms of the wall time, time to first byte, response
+        processing time and request/response sizes
+
+        :return: a dictionary with service name as key and a dictionary of the metrics of that service as value
+
+        Example usage:
+            hds = HydroDS(username=your_username, password=your_password)
+            hds.subset_raster(left=-111.97, top=42.11, right=-111.35, bottom=41.66, input_raster='nedWesternUS.tif',
+                              output_raster='subset_dem.tif')
+            metrics = hds.get_service_metrics()
+            print(metrics['subsetrastertobbox']['wall_time_seconds']['p95'])
+        """
+        return service_metrics.get_summary()
+
+    def _request_data_service(self, url, params=None, save_as=None):
+        # makes a GET request for a data service - result of a deterministic service is reused from the operation
+        # memo (if set) as long as the output file(s) of the earlier call have not changed on the server
+        service_name = self._get_service_name_from_url(url)
+        memo_key = None
+        if self._operation_memo is not None and service_name in self._memoizable_services:
+            memo_key = self._operation_memo.make_key(service_name, params, self._get_file_validator,
+                                                     owner=[self.username, self.hydro_ds_base_url])
+            response_data = self._operation_memo.get(memo_key, self._get_file_validator)
+            if response_data is not None:
+                if save_as:
+                    self._download_output_file(response_data, save_as)
+                return response_data
+
+        response_data = self._call_data_service(url=url, params=params)
+        if save_as:
+            self._download_output_file(response_data, save_as)
+        if memo_key is not None:
+            self._operation_memo.put(memo_key, response_data, self._get_file_validator)
+        return response_data
+
+    def set_operation_memo(self, operation_memo):
+        """
+        Sets a memo for reusing the output of deterministic HydroDS operations (e.g. subset_raster(),
+        create_raster_slope()). An operation called again with the same parameters and the same input files returns
+        the output of the earlier call without calling the HydroDS service, as long as that output still exists
+        unchanged on the server
+
+        :param operation_memo: the memo to use (None to stop using a memo)
+        :type operation_memo: OperationMemo
+
+        Example usage:
+            hds = HydroDS(username=your_username, password=your_password)
+            hds.set_operation_memo(OperationMemo(ttl=12 * 3600))
+        """
+        if operation_memo is not None and not isinstance(operation_memo, OperationMemo):
+            raise HydroDSArgumentException("operation_memo must be an object of type OperationMemo")
+        self._operation_memo = operation_memo
+
+    def _get_file_validator(self, file_url_path):
+        # returns (ETag, size, last modified time) of a file on the server - None if the file does not exist
+        try:
+            response = self._requests.head(file_url_path, allow_redirects=True, auth=self._hg_auth)
+        except requests.exceptions.RequestException:
+            return None
+
+        if not response.ok:
+            return None
+        return [response.headers.get('ETag'), response.headers.get('Content-Length'),
+                response.headers.get('Last-Modified')]
+
+    def _get_service_name_from_url(self, url):
+        return url.split('/api/dataservice/')[-1]
+
     def _get_dataservice_specific_url(self, service_name):
         return "{base_url}/{service_name}".format(base_url=self._dataservice_base_url, service_name=service_name)
 
     def _process_dataservice_response(self, response, save_as=None):
+        service_name = self._get_metric_service_name(response.url)
+        start_time = time.time()
+        outcome = 'success'
+        try:
+            return self._handle_dataservice_response(response, save_as)
+        except Exception as ex:
+            outcome = type(ex).__name__
+            raise
+        finally:
+            service_metrics.record_processing(service_name, time.time() - start_time, outcome)
+
+    def _handle_dataservice_response(self, response, save_as=None):
         if response.status_code != requests.codes.ok:
-            err_message = response.reason + " " + response.content
+            err_message = response.reason + " " + response.text
             if response.status_code == 400:
                 raise HydroDSBadRequestException("HydroDS Service Error. {response_err}".format(response_err=err_message))
             elif response.status_code == 401:
@@ -2459,20 +2998,26 @@ class HydroDS(object):
                 raise HydroDSNotFoundException("HydroDS Service Error. {response_err}".format(response_err=err_message))
             elif response.status_code == 500:
                 raise HydroDSServerException("HydroDS Service Error. {response_err}".format(response_err=err_message))
+            elif response.status_code in (502, 503, 504):
+                raise HydroDSServiceUnavailableException("HydroDS Service Error. {response_err}".format(
+                    response_err=err_message))
             else:
                 raise HydroDSException("HydroDS Service Error. {response_err}".format(response_err=err_message))
 
         response_dict = response.json()
         if response_dict['success']:
             if save_as:
-                if len(response_dict['data']) != 1:
-                    raise ValueError("Multiple output files found. Can't download multiple files.")
-                file_url = list(response_dict['data'].values())[0]
-                self.download_file(file_url, save_as)
+                self._download_output_file(response_dict['data'], save_as)
             return response_dict['data']
         else:
             self._raise_service_error(response_dict['error'])
 
+    def _download_output_file(self, response_data, save_as):
+        if len(response_data) != 1:
+            raise ValueError("Multiple output files found. Can't download multiple files.")
+        file_url = list(response_data.values())[0]
+        self.download_file(file_url, save_as)
+
     def _process_service_response(self, response, service_name, save_as=None, strip_zip=True):
         if response.status_code != requests.codes.ok:
             raise Exception("Error: HydroGate connection error.")
@@ -2504,6 +3049,9 @@ class HydroDS(object):
     def clear_service_log(self):
         _ServiceLog.delete_all()
 
+    def compact_service_log(self):
+        _ServiceLog.compact()
+
     def _is_file_name_valid(self, file_name, ext=None):
         try:
             name_part, ext_part = os.path.splitext(file_name)
@@ -2561,14 +3109,1096 @@ class HydroDS(object):
         return file_name
 
 
+class AsyncHydroDS(object):
+    def __init__(self, username=None, password=None, max_workers=8, hydrods=None):
+        """
+        Create a non-blocking HydroDS client. It has the same api functions as HydroDS, but each function call
+        returns immediately with a future (concurrent.futures.Future) for the result of the call, so that independent
+        HydroDS calls can run at the same time
+
+        :param username: username for HydroDS
+        :param password: password for HydroDS
+        :param max_workers: (optional) max number of HydroDS calls that can run at the same time (default is 8)
+        :param hydrods: (optional) HydroDS object to use for making the calls. If not provided, a HydroDS object is
+                        created with the username and password
+        :return: AsyncHydroDS object
+
+        Example usage:
+            async_hds = AsyncHydroDS(username=your_username, password=your_password)
+            slope_future = async_hds.create_raster_slope(input_raster_url_path=your_dem_url_here,
+                                                         output_raster='slope_logan.tif')
+            aspect_future = async_hds.create_raster_aspect(input_raster_url_path=your_dem_url_here,
+                                                           output_raster='aspect_logan.tif')
+            slope_response_data, aspect_response_data = gather(slope_future, aspect_future)
+        """
+        if int(max_workers) < 1:
+            raise HydroDSArgumentException("max_workers must be a positive integer value")
+
+        if hydrods is None:
+            # size the connection pool so that every worker can hold a connection to the same host
+            hydrods = HydroDS(username=username, password=password, pool_size=max_workers)
+
+        self._hydrods = hydrods
+        self._executor = futures.ThreadPoolExecutor(max_workers=int(max_workers))
+
+    @property
+    def hydrods(self):
+        return self._hydrods
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Run any callable on the worker pool of this client
+
+        :return: a future for the return value of the callable
+        """
+        return self._executor.submit(func, *args, **kwargs)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def __getattr__(self, name):
+        # only the public api functions of the HydroDS object are made available as non-blocking calls
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        hydrods_attr = getattr(self._hydrods, name)
+        if not callable(hydrods_attr):
+            return hydrods_attr
+
+        def async_call(*args, **kwargs):
+            return self._executor.submit(hydrods_attr, *args, **kwargs)
+
+        async_call.__name__ = name
+        async_call.__doc__ = hydrods_attr.__doc__
+        return async_call
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+
+class HydroDSClientPool(object):
+    def __init__(self, max_size=20, idle_timeout=600, max_clients_per_key=None, **client_kwargs):
+        """
+        Create a thread-safe pool of HydroDS objects keyed by user credentials. Each HydroDS object is used by only
+        one caller at a time and has its own http connection pool and HydroGate token. Objects not used for
+        idle_timeout seconds are closed and removed from the pool
+
+        :param max_size: (optional) max number of HydroDS objects in the pool (default is 20)
+        :type max_size: int
+        :param idle_timeout: (optional) number of seconds after which an unused HydroDS object is removed from the
+                             pool (default is 600)
+        :type idle_timeout: float
+        :param max_clients_per_key: (optional) max number of HydroDS objects in use at the same time for the same
+                                    credentials (default is no limit) - the HydroDS objects of the same user share
+                                    one workspace on the HydroDS server, so callers that clean up or use fixed file
+                                    names in the workspace need this to be 1
+        :type max_clients_per_key: int
+        :param client_kwargs: (optional) other parameters for creating HydroDS objects (e.g. pool_size)
+        :return: HydroDSClientPool object
+
+        Example usage:
+            client_pool = HydroDSClientPool(max_size=10)
+            with client_pool.client(username=your_username, password=your_password) as hds:
+                print(hds.list_my_files())
+        """
+        if int(max_size) < 1:
+            raise HydroDSArgumentException("max_size must be a positive integer value")
+
+        if max_clients_per_key is not None and int(max_clients_per_key) < 1:
+            raise HydroDSArgumentException("max_clients_per_key must be a positive integer value")
+
+        self._max_size = int(max_size)
+        self._max_clients_per_key = max_clients_per_key
+        self._idle_timeout = idle_timeout
+        self._client_kwargs = client_kwargs
+        self._idle_clients = {}
+        self._active_clients = {}
+        self._last_used = {}
+        self._condition = threading.Condition()
+
+    @contextlib.contextmanager
+    def client(self, username, password, timeout=None):
+        hydrods = self.acquire(username, password, timeout=timeout)
+        try:
+            yield hydrods
+        finally:
+            self.release(hydrods)
+
+    def acquire(self, username, password, timeout=None):
+        """
+        Gets a HydroDS object for the given credentials for exclusive use till it is released
+
+        :param username: username for HydroDS
+        :param password: password for HydroDS
+        :param timeout: (optional) max number of seconds to wait for a HydroDS object if the pool is full or the
+                        credentials already have max_clients_per_key HydroDS objects in use
+        :return: HydroDS object
+
+        :raises: HydroDSClientUnavailableException: no HydroDS object became available before the timeout
+        """
+        key = self._get_key(username, password)
+        end_time = time.time() + timeout if timeout is not None else None
+        with self._condition:
+            while True:
+                self._evict_idle()
+                idle_clients = self._idle_clients.get(key)
+                if self._is_key_available(key):
+                    if idle_clients:
+                        hydrods = idle_clients.pop()
+                        break
+
+                    if self._get_size() >= self._max_size:
+                        self._evict_least_recently_used()
+
+                    if self._get_size() < self._max_size:
+                        hydrods = HydroDS(username=username, password=password, **self._client_kwargs)
+                        break
+
+                wait_time = None
+                if end_time is not None:
+                    wait_time = end_time - time.time()
+                    if wait_time <= 0:
+                        raise HydroDSClientUnavailableException("No HydroDS client became available in the pool "
+                                                                "within {timeout} seconds.".format(timeout=timeout))
+                self._condition.wait(wait_time)
+
+            self._active_clients[id(hydrods)] = key
+            return hydrods
+
+    def release(self, hydrods):
+        with self._condition:
+            key = self._active_clients.pop(id(hydrods), None)
+            if key is None:
+                return
+            self._idle_clients.setdefault(key, []).append(hydrods)
+            self._last_used[id(hydrods)] = time.time()
+            # the waiting callers may be waiting for different credentials
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            idle_clients = [hydrods for clients in self._idle_clients.values() for hydrods in clients]
+            self._idle_clients = {}
+            self._last_used = {}
+        for hydrods in idle_clients:
+            hydrods.close()
+
+    def get_stats(self):
+        with self._condition:
+            return {'active': len(self._active_clients),
+                    'idle': sum(len(clients) for clients in self._idle_clients.values())}
+
+    def _is_key_available(self, key):
+        if self._max_clients_per_key is None:
+            return True
+        return list(self._active_clients.values()).count(key) < self._max_clients_per_key
+
+    def _get_size(self):
+        return len(self._active_clients) + sum(len(clients) for clients in self._idle_clients.values())
+
+    def _evict_idle(self):
+        if self._idle_timeout is None:
+            return
+        now = time.time()
+        for key, clients in list(self._idle_clients.items()):
+            for hydrods in list(clients):
+                if now - self._last_used.get(id(hydrods), now) > self._idle_timeout:
+                    self._remove_idle_client(key, hydrods)
+
+    def _evict_least_recently_used(self):
+        idle_clients = [(self._last_used.get(id(hydrods), 0), key, hydrods)
+                        for key, clients in self._idle_clients.items() for hydrods in clients]
+        if idle_clients:
+            _, key, hydrods = min(idle_clients, key=lambda item: item[0])
+            self._remove_idle_client(key, hydrods)
+
+    def _remove_idle_client(self, key, hydrods):
+        self._idle_clients[key].remove(hydrods)
+        if not self._idle_clients[key]:
+            del self._idle_clients[key]
+        self._last_used.pop(id(hydrods), None)
+        hydrods.close()
+
+    @staticmethod
+    def _get_key(username, password):
+        # don't keep the password as part of the key
+        password_hash = hashlib.sha256((password or '').encode('utf-8')).hexdigest()
+        return username, password_hash
+
+
+# HydroDS objects shared by all the app requests - the jobs clean up the workspace and use fixed file names in it
+# (e.g. watershed.nc, control.dat), so the jobs of the same HydroDS account run one at a time
+hydrods_client_pool = HydroDSClientPool(max_clients_per_key=1)
+
+# max number of seconds an app request waits for the HydroDS account to be free of another job - the request is
+# then answered with a busy error instead of holding the web server thread for the whole length of the other job
+hydrods_client_wait_timeout = 30
+
+
+def gather(*service_futures):
+    """
+    Waits for all the given futures (as returned by AsyncHydroDS function calls) to complete
+
+    :return: a list of the results in the same order as the futures were passed in
+
+    :raises: the first exception raised by any of the calls (all the calls are completed before raising)
+    """
+    futures.wait(service_futures)
+    return [service_future.result() for service_future in service_futures]
+
+
+class StatusPoller(object):
+    def __init__(self, check_status, done_states, error_states=(), initial_delay=5, max_delay=300, backoff_factor=2,
+                 jitter=0.2, max_errors=5):
+        """
+        Create a poller that watches the status of any number of items (e.g. HydroGate packages or jobs) from a
+        single polling loop. The wait time between two status checks of an item grows exponentially (with random
+        jitter) from initial_delay up to max_delay. A status check that fails (e.g. a transient HydroGate error) is
+        made again with the same backoff - the item is given up only after max_errors checks in a row have failed
+
+        :param check_status: a function that takes an item id and returns the current status of that item
+        :param done_states: statuses that mean the item has finished successfully
+        :param error_states: (optional) statuses that mean the item has failed
+        :param initial_delay: (optional) seconds to wait before the first status check of an item (default is 5)
+        :param max_delay: (optional) max seconds between two status checks of an item (default is 300)
+        :param backoff_factor: (optional) factor by which the wait time grows after each check (default is 2)
+        :param jitter: (optional) random +/- fraction applied to each wait time (default is 0.2)
+        :param max_errors: (optional) max number of status checks of an item in a row that can fail (default is 5)
+        :return: StatusPoller object
+
+        Example usage:
+            poller = StatusPoller(check_status=lambda job_id: hds.get_job_status(job_id=job_id),
+                                  done_states=('JobOutputFileTransferDone',), error_states=('JobError',))
+            for job_id in job_ids:
+                poller.watch(job_id, estimated_duration=600)
+
+            # dictionary of job id and final job status
+            job_statuses = poller.wait()
+        """
+        if initial_delay <= 0 or max_delay < initial_delay:
+            raise HydroDSArgumentException("initial_delay must be positive and not larger than max_delay")
+        if backoff_factor < 1:
+            raise HydroDSArgumentException("backoff_factor must not be less than 1")
+        if not 0 <= jitter < 1:
+            raise HydroDSArgumentException("jitter must be a value between 0 and 1")
+        if int(max_errors) < 0:
+            raise HydroDSArgumentException("max_errors must not be a negative value")
+
+        self._check_status = check_status
+        self._final_states = tuple(done_states) + tuple(error_states)
+        self._initial_delay = initial_delay
+        self._max_delay = max_delay
+        self._backoff_factor = backoff_factor
+        self._jitter = jitter
+        self._max_errors = int(max_errors)
+        self._schedule = []
+        self._schedule_counter = itertools.count()
+        self._delays = {}
+        self._error_counts = {}
+        self._callbacks = {}
+        self._results = {}
+        self._errors = {}
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def watch(self, item_id, estimated_duration=None, callback=None):
+        """
+        Starts watching the status of an item
+
+        :param item_id: id of the item to watch
+        :param estimated_duration: (optional) expected number of seconds the item will take to finish - the first
+                                   status check is made once most of this time has passed
+        :param callback: (optional) function called as callback(item_id, final_status) when the item finishes (with
+                         final_status None if the item was given up as its status checks kept failing)
+        """
+        first_delay = self._initial_delay
+        if estimated_duration:
+            first_delay = max(first_delay, 0.8 * estimated_duration)
+
+        with self._condition:
+            self._delays[item_id] = self._initial_delay
+            self._error_counts[item_id] = 0
+            self._results[item_id] = None
+            if callback:
+                self._callbacks[item_id] = callback
+            heapq.heappush(self._schedule, (time.time() + self._with_jitter(first_delay), next(self._schedule_counter),
+                                            item_id))
+            self._condition.notify()
+
+    def wait(self, timeout=None):
+        """
+        Polls in the calling thread till all the watched items finish (or timeout)
+
+        :return: a dictionary with item id as key and final status as value (None if the item did not finish)
+        :raises: the exception raised by the check_status function for an item whose status checks failed more than
+                 max_errors times in a row
+        """
+        self._poll(timeout=timeout, raise_errors=True)
+        return dict(self._results)
+
+    def start(self):
+        # polls in a background thread - use callbacks to get notified as items finish
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._poll, kwargs={'keep_running': True})
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def get_results(self):
+        with self._condition:
+            return dict(self._results)
+
+    def get_errors(self):
+        # the last exception raised while checking the status of each item or by its callback
+        with self._condition:
+            return dict(self._errors)
+
+    def _poll(self, timeout=None, raise_errors=False, keep_running=False):
+        end_time = time.time() + timeout if timeout is not None else None
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    now = time.time()
+                    if end_time is not None and now >= end_time:
+                        return
+                    if self._schedule and self._schedule[0][0] <= now:
+                        break
+                    if not self._schedule and not keep_running:
+                        return
+
+                    wait_time = self._schedule[0][0] - now if self._schedule else None
+                    if end_time is not None:
+                        wait_time = min(wait_time, end_time - now) if wait_time is not None else end_time - now
+                    self._condition.wait(wait_time)
+
+                if self._stopped:
+                    return
+                _, _, item_id = heapq.heappop(self._schedule)
+
+            try:
+                status = self._check_status(item_id)
+            except Exception as ex:
+                with self._condition:
+                    self._errors[item_id] = ex
+                    self._error_counts[item_id] += 1
+                    if self._error_counts[item_id] <= self._max_errors:
+                        self._schedule_next_check(item_id)
+                        continue
+                    callback = self._callbacks.pop(item_id, None)
+
+                self._run_callback(callback, item_id, None)
+                if raise_errors:
+                    raise
+                continue
+
+            self._on_status(item_id, status)
+
+    def _on_status(self, item_id, status):
+        with self._condition:
+            self._error_counts[item_id] = 0
+            if status not in self._final_states:
+                self._schedule_next_check(item_id)
+                return
+
+            self._results[item_id] = status
+            callback = self._callbacks.pop(item_id, None)
+
+        self._run_callback(callback, item_id, status)
+
+    def _schedule_next_check(self, item_id):
+        delay = min(self._delays[item_id] * self._backoff_factor, self._max_delay)
+        self._delays[item_id] = delay
+        heapq.heappush(self._schedule, (time.time() + self._with_jitter(delay), next(self._schedule_counter),
+                                        item_id))
+
+    def _run_callback(self, callback, item_id, status):
+        # a failing callback must not stop the polling of the other items
+        if callback is None:
+            return
+        try:
+            callback(item_id, status)
+        except Exception as ex:
+            with self._condition:
+                self._errors[item_id] = ex
+
+    def _with_jitter(self, delay):
+        return delay * random.uniform(1 - self._jitter, 1 + self._jitter)
+
+
+class RetryPolicy(object):
+    # data services that must not be called again once the request may have reached the server
+    default_non_idempotent_services = frozenset(['hydroshare/createresource'])
+
+    def __init__(self, max_retries=3, backoff_factor=1, max_backoff=30, jitter=0.2, retry_exceptions=None,
+                 non_idempotent_services=None, retry_read_timeouts=False):
+        """
+        Create a policy for retrying failed HydroDS data service calls. A call is retried if it failed with one of
+        retry_exceptions (by default server errors, service unavailable, connection errors and timeouts - but not
+        client errors like bad request or not found), waiting backoff_factor * 2 ** (retry number - 1) seconds (with
+        random jitter, up to max_backoff) before each retry. A non idempotent service is retried only if the
+        request did not reach the server (e.g. connection refused). A call that timed out waiting for the response is
+        not retried by default - the server may have been working on it for the whole read timeout (15 minutes by
+        default) and a retry would only repeat that
+
+        :param max_retries: (optional) max number of retries of a call (default is 3)
+        :param backoff_factor: (optional) seconds to wait before the first retry (default is 1)
+        :param max_backoff: (optional) max seconds to wait before a retry (default is 30)
+        :param jitter: (optional) random +/- fraction applied to each wait time (default is 0.2)
+        :param retry_exceptions: (optional) tuple of exception types that are retried
+        :param non_idempotent_services: (optional) names of the non idempotent data services (default is
+                                        RetryPolicy.default_non_idempotent_services)
+        :param retry_read_timeouts: (optional) if calls that timed out waiting for the response are to be retried
+                                    (default is False)
+        :return: RetryPolicy object
+
+        Example usage:
+            retry_policy = RetryPolicy(max_retries=5, non_idempotent_services=['hydroshare/createresource',
+                                                                               'myfiles/zip'])
+            hds = HydroDS(username=your_username, password=your_password, retry_policy=retry_policy)
+            # run a job with hds ...
+            print(retry_policy.get_stats())
+        """
+        if int(max_retries) < 0:
+            raise HydroDSArgumentException("max_retries must not be a negative value")
+        if not 0 <= jitter < 1:
+            raise HydroDSArgumentException("jitter must be a value between 0 and 1")
+
+        self._max_retries = int(max_retries)
+        self._backoff_factor = backoff_factor
+        self._max_backoff = max_backoff
+        self._jitter = jitter
+        if retry_exceptions is None:
+            retry_exceptions = (HydroDSServerException, HydroDSServiceUnavailableException,
+                                requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                                requests.exceptions.ChunkedEncodingError)
+        self._retry_exceptions = tuple(retry_exceptions)
+        if non_idempotent_services is None:
+            non_idempotent_services = self.default_non_idempotent_services
+        self._non_idempotent_services = frozenset(non_idempotent_services)
+        self._retry_read_timeouts = retry_read_timeouts
+        self._lock = threading.Lock()
+        self._retries = {}
+        self._gave_up = {}
+
+    def is_idempotent(self, service_name):
+        return service_name not in self._non_idempotent_services
+
+    def should_retry(self, exception, retry_number, idempotent):
+        if retry_number > self._max_retries:
+            return False
+        if isinstance(exception, requests.exceptions.ReadTimeout) and not self._retry_read_timeouts:
+            return False
+        if idempotent:
+            return isinstance(exception, self._retry_exceptions)
+        return self._is_connect_error(exception)
+
+    def get_delay(self, retry_number):
+        delay = min(self._backoff_factor * 2 ** (retry_number - 1), self._max_backoff)
+        return delay * random.uniform(1 - self._jitter, 1 + self._jitter)
+
+    def record_retry(self, service_name):
+        with self._lock:
+            self._retries[service_name] = self._retries.get(service_name, 0) + 1
+
+    def record_give_up(self, service_name):
+        with self._lock:
+            self._gave_up[service_name] = self._gave_up.get(service_name, 0) + 1
+
+    def get_stats(self):
+        with self._lock:
+            return {'retries': dict(self._retries), 'gave_up': dict(self._gave_up)}
+
+    @staticmethod
+    def _is_connect_error(exception):
+        return is_connect_error(exception)
+
+
+class WorkspaceSweeper(object):
+    def __init__(self, hydrods, interval=3600, pattern=None, older_than=24 * 3600, keep=None, max_workers=4):
+        """
+        Create a sweeper that deletes leftover files from a HydroDS user workspace from a background thread at a
+        fixed interval, so that jobs don't need to clean up the workspace before they start
+
+        :param hydrods: HydroDS object for the user whose workspace is to be cleaned up
+        :type hydrods: HydroDS
+        :param interval: (optional) seconds between two sweeps (default is 3600)
+        :param pattern: (optional) shell style file name pattern of the files to delete (default is all the files)
+        :param older_than: (optional) min age in seconds of the files to delete (default is 1 day)
+        :param keep: (optional) names or shell style file name patterns of the files not to delete
+        :param max_workers: (optional) max number of files to delete at the same time (default is 4)
+        :return: WorkspaceSweeper object
+
+        Example usage:
+            hds = HydroDS(username=your_username, password=your_password)
+            sweeper = WorkspaceSweeper(hds, interval=1800, older_than=6 * 3600)
+            sweeper.start()
+            ...
+            sweeper.stop()
+            print(sweeper.get_stats())
+        """
+        if interval <= 0:
+            raise HydroDSArgumentException("interval must be a positive value")
+
+        self._hydrods = hydrods
+        self._interval = interval
+        self._pattern = pattern
+        self._older_than = older_than
+        self._keep = keep
+        self._max_workers = max_workers
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stats = {'sweeps': 0, 'files_deleted': 0, 'files_failed': 0, 'last_sweep_time': None,
+                       'last_error': None}
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='hydrods-workspace-sweeper')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, wait=True):
+        self._stop_event.set()
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    def sweep(self):
+        """
+        Deletes the matching files now (from the calling thread)
+
+        :return: the result of HydroDS.delete_my_files()
+        """
+        try:
+            delete_result = self._hydrods.delete_my_files(pattern=self._pattern, older_than=self._older_than,
+                                                          keep=self._keep, max_workers=self._max_workers)
+        except Exception as ex:
+            with self._lock:
+                self._stats['last_error'] = ex
+            raise
+
+        with self._lock:
+            self._stats['sweeps'] += 1
+            self._stats['files_deleted'] += len(delete_result['deleted'])
+            self._stats['files_failed'] += len(delete_result['failed'])
+            self._stats['last_sweep_time'] = time.time()
+            self._stats['last_error'] = None
+        return delete_result
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _run(self):
+        while not self._stop_event.wait(self._interval):
+            try:
+                self.sweep()
+            except Exception:
+                # try again on the next sweep (the error is kept in the stats)
+                continue
+
+
+class _SessionPool(object):
+    # holds one keep-alive requests.Session per host base url so that repeated calls to the same host reuse
+    # pooled TCP/TLS connections instead of opening a new connection for every call. Calls to a host whose circuit
+    # breaker is open fail fast and every call has a timeout.
+    def __init__(self, pool_size=10, keep_alive=True, timeout=default_timeout):
+        if int(pool_size) < 1:
+            raise HydroDSArgumentException("pool_size must be a positive integer value")
+
+        self._pool_size = int(pool_size)
+        self._keep_alive = keep_alive
+        self._timeout = timeout
+        self._sessions = {}
+        self._request_counts = {}
+        self._lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def request(self, http_method, url, **kwargs):
+        base_url = self._get_base_url(url)
+        circuit_breaker = get_circuit_breaker(base_url)
+        if not circuit_breaker.allow_request():
+            raise EndpointUnavailableException("{base_url} is not available.".format(base_url=base_url))
+
+        kwargs.setdefault('timeout', self._timeout)
+        session = self._get_session(base_url)
+        try:
+            response = session.request(http_method, url, **kwargs)
+        except Exception as ex:
+            if is_host_failure(exception=ex):
+                circuit_breaker.record_failure()
+            else:
+                circuit_breaker.record_success()
+            raise
+
+        if is_host_failure(response=response):
+            circuit_breaker.record_failure()
+        else:
+            circuit_breaker.record_success()
+        with self._lock:
+            self._request_counts[base_url] = self._request_counts.get(base_url, 0) + 1
+        return response
+
+    def get_stats(self):
+        with self._lock:
+            sessions = list(self._sessions.items())
+            request_counts = dict(self._request_counts)
+
+        stats = {}
+        for base_url, session in sessions:
+            connections_opened = 0
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    connection_pool = pools.get(key)
+                    if connection_pool is not None:
+                        connections_opened += connection_pool.num_connections
+
+            request_count = request_counts.get(base_url, 0)
+            stats[base_url] = {'requests': request_count, 'connections_opened': connections_opened,
+                               'connections_reused': max(request_count - connections_opened, 0)}
+        return stats
+
+    def close(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions = {}
+        for session in sessions:
+            session.close()
+
+    def _get_session(self, base_url):
+        with self._lock:
+            session = self._sessions.get(base_url)
+            if session is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_maxsize=self._pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                if not self._keep_alive:
+                    session.headers['Connection'] = 'close'
+                self._sessions[base_url] = session
+            return session
+
+    @staticmethod
+    def _get_base_url(url):
+        parsed_url = requests.compat.urlparse(url)
+        return "{scheme}://{host}".format(scheme=parsed_url.scheme, host=parsed_url.netloc)
+
+
+class _MultipartFileStream(object):
+    # a multipart/form-data request body for uploading a file that reads the file content from the disk as the body
+    # is being sent (requests would otherwise read the whole file into memory to build the body)
+    def __init__(self, file_path, field_name='file', fields=None):
+        self._boundary = uuid.uuid4().hex
+        head = b''
+        for name, value in (fields or {}).items():
+            head += self._encode('--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+                                 .format(boundary=self._boundary, name=name, value=value))
+        head += self._encode('--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{file_name}"'
+                             '\r\nContent-Type: application/octet-stream\r\n\r\n'
+                             .format(boundary=self._boundary, name=field_name,
+                                     file_name=os.path.basename(file_path)))
+        tail = self._encode('\r\n--{boundary}--\r\n'.format(boundary=self._boundary))
+
+        self._file_obj = open(file_path, 'rb')
+        self._length = len(head) + os.path.getsize(file_path) + len(tail)
+        self._parts = [head, self._file_obj, tail]
+        self._part_index = 0
+
+    @property
+    def content_type(self):
+        return 'multipart/form-data; boundary={boundary}'.format(boundary=self._boundary)
+
+    def __len__(self):
+        return self._length
+
+    def read(self, size=-1):
+        data = b''
+        while self._part_index < len(self._parts) and (size < 0 or len(data) < size):
+            part = self._parts[self._part_index]
+            wanted_size = size - len(data) if size >= 0 else -1
+            if isinstance(part, bytes):
+                if wanted_size < 0 or wanted_size >= len(part):
+                    data += part
+                    self._part_index += 1
+                else:
+                    data += part[:wanted_size]
+                    self._parts[self._part_index] = part[wanted_size:]
+            else:
+                block = part.read(wanted_size)
+                if block:
+                    data += block
+                if not block or wanted_size < 0:
+                    self._part_index += 1
+        return data
+
+    def close(self):
+        self._file_obj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @staticmethod
+    def _encode(text):
+        return text.encode('utf-8')
+
+
+class _FileDownloader(object):
+    # downloads a file using large read buffers. If the server supports http range requests, a large file is
+    # downloaded in parts concurrently, and an interrupted download is resumed from the partially downloaded file
+    # (<save_as>.part) using the download state saved in <save_as>.part.json. The file is asked for without content
+    # encoding (e.g. gzip), as the sizes, ranges and checksum are those of the file as stored on the server.
+    _identity_encoding = {'Accept-Encoding': 'identity'}
+
+    def __init__(self, http, chunk_size=1024 * 1024, part_size=16 * 1024 * 1024, max_workers=4):
+        self._http = http
+        self._chunk_size = chunk_size
+        self._part_size = part_size
+        self._max_workers = max_workers
+
+    def download(self, url, save_as, on_error, checksum=None, cache=None, **request_kwargs):
+        # on_error: function to call with the failed response - expected to raise an exception
+        partial_file = save_as + '.part'
+        state_file = partial_file + '.json'
+
+        file_info = self._get_file_info(url, **request_kwargs)
+        if cache is not None and cache.get(url, file_info['etag'], file_info['size'], save_as,
+                                           last_modified=file_info['last_modified']):
+            return
+        state = self._load_state(state_file)
+        # HydroDS reuses the output file names, so without a strong validator an overwritten file of the same size
+        # can't be told apart from the partially downloaded one
+        if state is None or not self._get_range_validator(file_info) or state.get('url') != url or \
+                state.get('etag') != file_info['etag'] or state.get('last_modified') != file_info['last_modified'] or \
+                state.get('size') != file_info['size'] or not os.path.isfile(partial_file):
+            # can't resume - start a new download
+            state = {'url': url, 'etag': file_info['etag'], 'last_modified': file_info['last_modified'],
+                     'size': file_info['size'], 'completed_parts': []}
+            if os.path.isfile(partial_file):
+                os.remove(partial_file)
+
+        if file_info['accept_ranges'] and file_info['size'] and file_info['size'] >= 2 * self._part_size:
+            self._download_parts(url, partial_file, state, state_file, on_error, **request_kwargs)
+            expected_size = file_info['size']
+        else:
+            encoded = self._download_stream(url, partial_file, state, state_file, file_info['accept_ranges'],
+                                            on_error, **request_kwargs)
+            # a server that encodes the content anyway reports the size of the encoded content - requests decodes it
+            expected_size = None if encoded else file_info['size']
+
+        if checksum is None:
+            checksum = file_info['md5']
+        self._verify(partial_file, expected_size, checksum)
+
+        if os.path.isfile(save_as):
+            os.remove(save_as)
+        os.rename(partial_file, save_as)
+        if os.path.isfile(state_file):
+            os.remove(state_file)
+
+        if cache is not None:
+            cache.put(url, file_info['etag'], file_info['size'], save_as, last_modified=file_info['last_modified'])
+
+    def _get_file_info(self, url, **request_kwargs):
+        file_info = {'size': None, 'etag': None, 'last_modified': None, 'md5': None, 'accept_ranges': False}
+        try:
+            response = self._http.head(url, allow_redirects=True, headers=self._identity_encoding, **request_kwargs)
+        except requests.exceptions.RequestException:
+            return file_info
+
+        if not response.ok:
+            # the GET request will report the error
+            return file_info
+
+        if self._is_encoded(response):
+            # the size, ranges and checksum would be those of the encoded content
+            file_info['etag'] = response.headers.get('ETag')
+            file_info['last_modified'] = response.headers.get('Last-Modified')
+            return file_info
+
+        content_length = response.headers.get('Content-Length')
+        if content_length and content_length.isdigit():
+            file_info['size'] = int(content_length)
+        file_info['etag'] = response.headers.get('ETag')
+        file_info['last_modified'] = response.headers.get('Last-Modified')
+        file_info['accept_ranges'] = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+        content_md5 = response.headers.get('Content-MD5')
+        if content_md5:
+            try:
+                file_info['md5'] = binascii.hexlify(base64.b64decode(content_md5)).decode('ascii')
+            except (TypeError, ValueError):
+                pass
+        return file_info
+
+    def _download_stream(self, url, partial_file, state, state_file, accept_ranges, on_error, **request_kwargs):
+        # returns True if the server sent the content encoded (it is decoded as it is written)
+        headers = dict(self._identity_encoding)
+        downloaded_size = os.path.getsize(partial_file) if os.path.isfile(partial_file) else 0
+        if downloaded_size and accept_ranges:
+            headers['Range'] = 'bytes={start}-'.format(start=downloaded_size)
+            # the server sends the whole file if it has changed since the partial download
+            headers['If-Range'] = self._get_range_validator(state)
+        else:
+            downloaded_size = 0
+
+        response = self._http.get(url, stream=True, headers=headers, **request_kwargs)
+        if downloaded_size and response.status_code == 416 and downloaded_size == state['size']:
+            # the partial file is already complete (e.g. the download stopped before it was renamed)
+            response.close()
+            return False
+        if not response.ok:
+            on_error(response)
+
+        encoded = self._is_encoded(response)
+        if downloaded_size and encoded:
+            # a range of the encoded content can't be decoded on its own - download the whole file again
+            response.close()
+            del headers['Range']
+            del headers['If-Range']
+            response = self._http.get(url, stream=True, headers=headers, **request_kwargs)
+            if not response.ok:
+                on_error(response)
+            encoded = self._is_encoded(response)
+            downloaded_size = 0
+
+        if downloaded_size and response.status_code != 206:
+            # server sent the whole file
+            downloaded_size = 0
+
+        self._save_state(state_file, state)
+        with open(partial_file, 'ab' if downloaded_size else 'wb') as file_obj:
+            for block in response.iter_content(self._chunk_size):
+                if block:
+                    file_obj.write(block)
+        return encoded
+
+    def _download_parts(self, url, partial_file, state, state_file, on_error, **request_kwargs):
+        file_size = state['size']
+        if not os.path.isfile(partial_file):
+            with open(partial_file, 'wb') as file_obj:
+                file_obj.truncate(file_size)
+
+        completed_parts = set(state['completed_parts'])
+        parts = [(start, min(start + self._part_size, file_size) - 1)
+                 for start in range(0, file_size, self._part_size) if start not in completed_parts]
+        state_lock = threading.Lock()
+        range_validator = self._get_range_validator(state)
+
+        def download_part(part):
+            start, end = part
+            headers = dict(self._identity_encoding, Range='bytes={start}-{end}'.format(start=start, end=end))
+            if range_validator:
+                # the server sends the whole file (and the part fails) if the file has changed since the first part
+                headers['If-Range'] = range_validator
+            response = self._http.get(url, stream=True, headers=headers, **request_kwargs)
+            if response.status_code != 206:
+                if not response.ok:
+                    on_error(response)
+                raise HydroDSException("Error in downloading file part. Server did not return the requested "
+                                       "range {start}-{end}".format(start=start, end=end))
+            if self._is_encoded(response):
+                raise HydroDSException("Error in downloading file part. Server sent the range {start}-{end} "
+                                       "encoded".format(start=start, end=end))
+
+            with open(partial_file, 'r+b') as file_obj:
+                file_obj.seek(start)
+                for block in response.iter_content(self._chunk_size):
+                    if block:
+                        file_obj.write(block)
+
+            with state_lock:
+                state['completed_parts'].append(start)
+                self._save_state(state_file, state)
+
+        self._save_state(state_file, state)
+        executor = futures.ThreadPoolExecutor(max_workers=self._max_workers)
+        try:
+            part_futures = [executor.submit(download_part, part) for part in parts]
+            # raises the first failure - completed parts are kept for resuming the download
+            gather(*part_futures)
+        finally:
+            executor.shutdown(wait=True)
+
+    def _verify(self, partial_file, expected_size, checksum):
+        actual_size = os.path.getsize(partial_file)
+        if expected_size is not None and actual_size != expected_size:
+            os.remove(partial_file)
+            raise HydroDSException("Downloaded file size ({actual}) does not match the expected file size "
+                                   "({expected}).".format(actual=actual_size, expected=expected_size))
+        if checksum:
+            md5 = hashlib.md5()
+            with open(partial_file, 'rb') as file_obj:
+                for block in iter(lambda: file_obj.read(self._chunk_size), b''):
+                    md5.update(block)
+            if md5.hexdigest() != checksum.lower():
+                os.remove(partial_file)
+                raise HydroDSException("Checksum of the downloaded file does not match the expected checksum.")
+
+    @staticmethod
+    def _get_range_validator(file_info):
+        # the strong ETag or else the Last-Modified time of the file - None if there is neither
+        etag = file_info.get('etag')
+        if etag and not etag.startswith('W/'):
+            return etag
+        return file_info.get('last_modified')
+
+    @staticmethod
+    def _is_encoded(response):
+        return response.headers.get('Content-Encoding', 'identity').lower() not in ('', 'identity')
+
+    @staticmethod
+    def _load_state(state_file):
+        if not os.path.isfile(state_file):
+            return None
+        try:
+            with open(state_file, 'r') as f:
+                return json.load(f)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _save_state(state_file, state):
+        with open(state_file, 'w') as f:
+            json.dump(state, f)
+
+
+class _TokenManager(object):
+    # caches the HydroGate token along with the expiry time reported by the server so that the token expire time
+    # does not need to be checked with the server before every HydroGate call. The token is shared by all threads
+    # using the same HydroDS object.
+    def __init__(self, request_token, request_expire_time, refresh_margin=60, auto_refresh=False):
+        self._request_token = request_token
+        self._request_expire_time = request_expire_time
+        self._refresh_margin = refresh_margin
+        self._auto_refresh = auto_refresh
+        self._token = None
+        self._expires_at = None
+        self._refresh_timer = None
+        self._lock = threading.RLock()
+
+    def get_token(self):
+        with self._lock:
+            if self._token is None or time.time() >= self._expires_at - self._refresh_margin:
+                self._refresh()
+            return self._token
+
+    def get_remaining_time(self):
+        # returns the number of seconds (as per local clock) before the cached token expires
+        with self._lock:
+            if self._token is None:
+                return 0
+            return max(self._expires_at - time.time(), 0)
+
+    def invalidate(self):
+        with self._lock:
+            self._cancel_refresh_timer()
+            self._token = None
+            self._expires_at = None
+
+    def _refresh(self):
+        token = self._request_token()
+        remaining_time = float(self._request_expire_time(token))
+        self._token = token
+        self._expires_at = time.time() + remaining_time
+        if self._auto_refresh:
+            self._schedule_refresh(remaining_time)
+
+    def _schedule_refresh(self, remaining_time):
+        self._cancel_refresh_timer()
+        refresh_wait_time = max(remaining_time - self._refresh_margin, 1)
+        self._refresh_timer = threading.Timer(refresh_wait_time, self._on_refresh_timer)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _on_refresh_timer(self):
+        with self._lock:
+            try:
+                self._refresh()
+            except Exception:
+                # leave it to the next get_token() call to request a new token
+                self._token = None
+
+    def _cancel_refresh_timer(self):
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+            self._refresh_timer = None
+
+
 class _ServiceLog(object):
-    _service_requests = []
-    _pickle_file_name = r'hg_service_log.pkl'
+    # service requests are appended to a per process JSON lines log file one record per request. Only the most recent
+    # requests are kept in memory. Writers (add) hold a lock only to swap in a new immutable snapshot of the buffer and
+    # to queue the request for the background flusher thread, so readers (print_log, get_most_recent_request) never
+    # take a lock and no request path ever waits on file io.
+    _service_requests = ()
+    _max_buffer_size = 1000
+    _pending_requests = collections.deque()
+    _latest_by_service_name = {}
+    _latest_by_service_id_name = {}
+    _latest_by_service_id = {}
+    _log_dir = os.path.join(tempfile.gettempdir(), 'hydrods_service_log')
+    _max_log_file_size = 10 * 1024 * 1024
+    _max_rotated_files = 3
+    _flush_interval = 2
+    _write_lock = threading.Lock()
+    _file_lock = threading.RLock()
+    _flush_event = threading.Event()
+    _flusher_thread = None
+    _flusher_pid = None
+
+    @classmethod
+    def configure(cls, log_dir=None, max_buffer_size=None, max_log_file_size=None, max_rotated_files=None,
+                  flush_interval=None):
+        with cls._write_lock:
+            if log_dir:
+                cls.flush()
+                cls._log_dir = os.path.abspath(log_dir)
+            if max_buffer_size:
+                cls._max_buffer_size = int(max_buffer_size)
+                cls._set_buffer(cls._service_requests)
+            if max_log_file_size:
+                cls._max_log_file_size = int(max_log_file_size)
+            if max_rotated_files is not None:
+                cls._max_rotated_files = int(max_rotated_files)
+            if flush_interval:
+                cls._flush_interval = flush_interval
 
     @classmethod
     def add(cls, service_request):
         if isinstance(service_request, ServiceRequest):
-            cls._service_requests.append(service_request)
+            with cls._write_lock:
+                cls._index(service_request)
+                cls._set_buffer(cls._service_requests + (service_request,))
+                cls._pending_requests.append(service_request)
+            cls._start_flusher()
         else:
             raise Exception("Internal Error: Only an object of type 'ServiceRequest' can be added to the log.")
 
@@ -2578,45 +4208,243 @@ class _ServiceLog(object):
 
     @classmethod
     def delete_all(cls):
-        cls._service_requests = []
-        if os.path.isfile(cls._pickle_file_name):
-            os.remove(cls._pickle_file_name)
+        # removes the log files of this process only - other processes may still be writing to theirs
+        with cls._write_lock:
+            cls._service_requests = ()
+            cls._clear_index()
+            with cls._file_lock:
+                cls._pending_requests.clear()
+                for file_name in [cls._get_log_file_name()] + cls._get_rotated_file_names():
+                    if os.path.isfile(file_name):
+                        os.remove(file_name)
 
     @classmethod
     def load(cls):
-        if len(cls._service_requests) == 0:
-            if os.path.isfile(cls._pickle_file_name):
-                with open(cls._pickle_file_name, "rb") as f:
-                    cls._service_requests = pickle.load(f)
+        # a new process starts from the most recent requests in the log files of all processes (e.g. the other workers
+        # or the processes that ran before a server restart). The log files of processes that are no longer running
+        # are merged into the log file of this process and removed so they don't pile up in the log dir.
+        with cls._write_lock:
+            if len(cls._service_requests) > 0:
+                return
+
+            log_file_names_by_pid = cls._get_log_file_names_by_pid()
+            if not log_file_names_by_pid:
+                return
+
+            service_requests = []
+            stale_pids = set()
+            for pid, log_file_names in log_file_names_by_pid.items():
+                if not cls._is_process_running(pid):
+                    stale_pids.add(pid)
+                # only the newest files of a process that hold the last max_buffer_size requests are read
+                pid_service_requests = []
+                for log_file_name in reversed(log_file_names):
+                    pid_service_requests = list(cls._read_log_file(log_file_name)) + pid_service_requests
+                    if len(pid_service_requests) >= cls._max_buffer_size:
+                        break
+                service_requests.extend((service_request, pid)
+                                        for service_request in pid_service_requests[-cls._max_buffer_size:])
+
+            # sort is stable so the requests with the same time stay in the order they were written
+            service_requests.sort(key=lambda request_pid: request_pid[0].request_time)
+            service_requests = service_requests[-cls._max_buffer_size:]
+            for service_request, _ in service_requests:
+                cls._index(service_request)
+            cls._service_requests = tuple(service_request for service_request, _ in service_requests)
+
+            if stale_pids:
+                with cls._file_lock:
+                    cls._pending_requests.extend(service_request for service_request, pid in service_requests
+                                                 if pid in stale_pids)
+                    try:
+                        cls.flush()
+                    except (IOError, OSError):
+                        # the flusher thread writes the merged requests later - the stale files are removed by the
+                        # next process that loads the log
+                        return
+                    for pid in stale_pids:
+                        for log_file_name in log_file_names_by_pid[pid]:
+                            try:
+                                os.remove(log_file_name)
+                            except OSError:
+                                # another process is merging the same stale file
+                                pass
 
     @classmethod
     def save(cls):
-        if len(cls._service_requests) > 0:
-            with open(cls._pickle_file_name, "wb") as f:
-                pickle.dump(cls._service_requests, f)
-        elif os.path.isfile(cls._pickle_file_name):
-            os.remove(cls._pickle_file_name)
+        # the requests are written by the flusher thread - this only asks it to write them now
+        cls._start_flusher()
+        cls._flush_event.set()
+
+    @classmethod
+    def flush(cls):
+        # writes the requests added since the last flush (blocks till they are written)
+        with cls._file_lock:
+            if len(cls._pending_requests) == 0:
+                return
+
+            log_file_name = cls._get_log_file_name()
+            if not os.path.isdir(cls._log_dir):
+                os.makedirs(cls._log_dir)
+            pending_requests = []
+            while cls._pending_requests:
+                pending_requests.append(cls._pending_requests.popleft())
+            try:
+                with open(log_file_name, "a") as f:
+                    f.write(''.join(json.dumps(service_request.to_dict()) + '\n'
+                                    for service_request in pending_requests))
+            except (IOError, OSError):
+                # put the requests back in front of the ones added meanwhile to be written on the next flush
+                cls._pending_requests.extendleft(reversed(pending_requests))
+                raise
+
+            if os.path.getsize(log_file_name) > cls._max_log_file_size:
+                cls._rotate()
+
+    @classmethod
+    def compact(cls):
+        # rewrites the current log file keeping only the most recent record for each service id (e.g. the last status
+        # check of a job) and all the records that don't have a service id
+        with cls._file_lock:
+            cls.flush()
+            log_file_name = cls._get_log_file_name()
+            if not os.path.isfile(log_file_name):
+                return
+
+            compacted_requests = []
+            seen_service_ids = set()
+            for service_request in reversed(list(cls._read_log_file(log_file_name))):
+                if service_request.service_id_name:
+                    service_id = (service_request.service_name, service_request.service_id_name,
+                                  service_request.service_id_value)
+                    if service_id in seen_service_ids:
+                        continue
+                    seen_service_ids.add(service_id)
+                compacted_requests.append(service_request)
+
+            temp_file_name = log_file_name + '.tmp'
+            with open(temp_file_name, "w") as f:
+                for service_request in reversed(compacted_requests):
+                    f.write(json.dumps(service_request.to_dict()) + '\n')
+            if os.path.isfile(log_file_name):
+                os.remove(log_file_name)
+            os.rename(temp_file_name, log_file_name)
+
+    @classmethod
+    def _start_flusher(cls):
+        # the flusher thread doesn't survive a fork (e.g. pre-forking wsgi servers) so each process starts its own
+        if cls._flusher_pid == os.getpid() and cls._flusher_thread.is_alive():
+            return
+        with cls._write_lock:
+            if cls._flusher_pid == os.getpid() and cls._flusher_thread.is_alive():
+                return
+            cls._flusher_thread = threading.Thread(target=cls._run_flusher, name='hydrods-service-log-flusher')
+            cls._flusher_thread.daemon = True
+            cls._flusher_pid = os.getpid()
+            cls._flusher_thread.start()
+
+    @classmethod
+    def _run_flusher(cls):
+        while True:
+            cls._flush_event.wait(cls._flush_interval)
+            cls._flush_event.clear()
+            try:
+                cls.flush()
+            except (IOError, OSError):
+                # keep the requests queued and try again on the next round
+                pass
+
+    @classmethod
+    def _get_log_file_name(cls):
+        return os.path.join(cls._log_dir, 'hg_service_log.{0}.jsonl'.format(os.getpid()))
+
+    @classmethod
+    def _get_log_file_names_by_pid(cls):
+        # {pid: [hg_service_log.<pid>.jsonl.3, ..., hg_service_log.<pid>.jsonl.1, hg_service_log.<pid>.jsonl]} - the
+        # file names of each process ordered from the oldest to the newest records
+        if not os.path.isdir(cls._log_dir):
+            return {}
+        log_files_by_pid = collections.defaultdict(list)
+        for file_name in os.listdir(cls._log_dir):
+            name_parts = file_name.split('.')
+            if len(name_parts) not in (3, 4) or name_parts[0] != 'hg_service_log' or name_parts[2] != 'jsonl':
+                continue
+            try:
+                pid = int(name_parts[1])
+                rotation_index = int(name_parts[3]) if len(name_parts) == 4 else 0
+            except ValueError:
+                continue
+            log_files_by_pid[pid].append((rotation_index, os.path.join(cls._log_dir, file_name)))
+        return dict((pid, [file_name for _, file_name in sorted(log_files, reverse=True)])
+                    for pid, log_files in log_files_by_pid.items())
+
+    @staticmethod
+    def _is_process_running(pid):
+        if pid == os.getpid() or os.name == 'nt':
+            # os.kill() would terminate the process on windows
+            return True
+        try:
+            os.kill(pid, 0)
+        except OSError as ex:
+            return ex.errno == errno.EPERM
+        return True
+
+    @classmethod
+    def _rotate(cls):
+        # hg_service_log.<pid>.jsonl -> hg_service_log.<pid>.jsonl.1 -> hg_service_log.<pid>.jsonl.2 ...
+        log_file_name = cls._get_log_file_name()
+        rotated_file_names = cls._get_rotated_file_names()
+        if not rotated_file_names:
+            os.remove(log_file_name)
+            return
+
+        if os.path.isfile(rotated_file_names[-1]):
+            os.remove(rotated_file_names[-1])
+        for index in range(len(rotated_file_names) - 1, 0, -1):
+            if os.path.isfile(rotated_file_names[index - 1]):
+                os.rename(rotated_file_names[index - 1], rotated_file_names[index])
+        os.rename(log_file_name, rotated_file_names[0])
+
+    @classmethod
+    def _get_rotated_file_names(cls):
+        log_file_name = cls._get_log_file_name()
+        return ['{0}.{1}'.format(log_file_name, index) for index in range(1, cls._max_rotated_files + 1)]
+
+    @staticmethod
+    def _read_log_file(file_name):
+        if not os.path.isfile(file_name):
+            return
+        with open(file_name, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield ServiceRequest.from_dict(json.loads(line))
+                except (ValueError, KeyError):
+                    # skip a partially written record
+                    continue
 
     @classmethod
     def print_log(cls, order='first', count=None):
-        if len(cls._service_requests) == 0:
+        # the snapshot is immutable - later adds swap in a new one
+        service_requests = cls._service_requests
+        if len(service_requests) == 0:
             return
 
         if order == 'last':
             # reverse all items in the list
-            service_requests = cls._service_requests[::-1]
-        else:
-            service_requests = cls._service_requests
+            service_requests = service_requests[::-1]
 
         if count:
             try:
                 count = int(count)
             except:
                 raise ValueError("Count must be an integer value.")
-            if count > len(cls._service_requests):
-                count = len(cls._service_requests)
+            if count > len(service_requests):
+                count = len(service_requests)
         else:
-            count = len(cls._service_requests)
+            count = len(service_requests)
 
         service_requests = service_requests[0:count]
         for req in service_requests:
@@ -2624,37 +4452,65 @@ class _ServiceLog(object):
 
     @classmethod
     def get_most_recent_request(cls, service_name=None, service_id_name=None, service_id_value=None):
-        if len(cls._service_requests) == 0:
+        service_requests = cls._service_requests
+        if len(service_requests) == 0:
             return None
 
-        if not service_name and not service_id_name:
-            return cls._service_requests[-1]
+        if service_id_name:
+            if service_id_value:
+                return cls._latest_by_service_id.get((service_id_name, service_id_value))
+            return cls._latest_by_service_id_name.get(service_id_name)
+        elif service_name:
+            return cls._latest_by_service_name.get(service_name)
         else:
-            reversed_list = reversed(cls._service_requests)
-            for item in reversed_list:
-                selected_item = None
-                if service_name:
-                    if item.service_name == service_name:
-                       selected_item = item
-                if service_id_name:
-                    if item.service_id_name == service_id_name:
-                        if service_id_value:
-                            if item.service_id_value == service_id_value:
-                                selected_item = item
-                            else:
-                                selected_item = None
-                        else:
-                            selected_item = item
-                    else:
-                        selected_item = None
-
-                if selected_item:
-                    return selected_item
+            return service_requests[-1]
 
-            return None
+    @classmethod
+    def _index(cls, service_request):
+        # keeps track of the most recent request for each service name, service id name and service id (single dict
+        # item assignments, so readers can do lookups without a lock)
+        cls._latest_by_service_name[service_request.service_name] = service_request
+        if service_request.service_id_name:
+            cls._latest_by_service_id_name[service_request.service_id_name] = service_request
+            service_id = (service_request.service_id_name, service_request.service_id_value)
+            cls._latest_by_service_id[service_id] = service_request
+
+    @classmethod
+    def _set_buffer(cls, service_requests):
+        # keeps the most recent requests - the index entries of the requests that drop out of the buffer are removed,
+        # so the index doesn't keep them in memory and finds the same requests as after a restart (load)
+        evicted_requests = service_requests[:-cls._max_buffer_size]
+        cls._service_requests = service_requests[-cls._max_buffer_size:]
+        for service_request in evicted_requests:
+            cls._unindex(service_request)
+
+    @classmethod
+    def _unindex(cls, service_request):
+        # removes the index entries that still point to the request
+        index_items = [(cls._latest_by_service_name, service_request.service_name)]
+        if service_request.service_id_name:
+            index_items.append((cls._latest_by_service_id_name, service_request.service_id_name))
+            index_items.append((cls._latest_by_service_id, (service_request.service_id_name,
+                                                            service_request.service_id_value)))
+        for index, key in index_items:
+            if index.get(key) is service_request:
+                index.pop(key, None)
+
+    @classmethod
+    def _clear_index(cls):
+        cls._latest_by_service_name = {}
+        cls._latest_by_service_id_name = {}
+        cls._latest_by_service_id = {}
+
+
+atexit.register(_ServiceLog.flush)
 
 
 class ServiceRequest(object):
+    # __slots__ keeps each request object small as the service log can hold a very large number of them
+    __slots__ = ('service_name', 'service_id_name', 'service_id_value', 'service_status', 'file_path', 'request_time')
+    _time_format = '%Y-%m-%d %H:%M:%S.%f'
+
     def __init__(self, service_name, service_id_name, service_id_value, service_status, file_path=None, request_time=None):
         self.service_name = service_name            # e.g. upload_package
         self.service_id_name = service_id_name      # e.g package_id
@@ -2666,6 +4522,18 @@ class ServiceRequest(object):
         else:
             self.request_time = datetime.datetime.now()
 
+    def to_dict(self):
+        return {'service_name': self.service_name, 'service_id_name': self.service_id_name,
+                'service_id_value': self.service_id_value, 'service_status': self.service_status,
+                'file_path': self.file_path, 'request_time': self.request_time.strftime(self._time_format)}
+
+    @classmethod
+    def from_dict(cls, object_data):
+        request_time = datetime.datetime.strptime(object_data['request_time'], cls._time_format)
+        return cls(service_name=object_data['service_name'], service_id_name=object_data['service_id_name'],
+                   service_id_value=object_data['service_id_value'], service_status=object_data['service_status'],
+                   file_path=object_data['file_path'], request_time=request_time)
+
     def to_json(self):
         object_data = {}
         object_data['Service name'] = self.service_name
@@ -9,4 +9,94 @@ file_contents_dict = {
 site_initial_variable_codes = ['USic', 'WSic', 'Tic', 'WCic', 'df', 'apr', 'Aep', 'cc', 'hcan', 'lai', 'Sbar', 'ycage', 'slope', 'aspect', 'latitude', 'longitude', 'subalb', 'subtype', 'gsurf', 'Ts_last', 'b01', 'b02', 'b03', 'b04', 'b05', 'b06', 'b07', 'b08', 'b09', 'b10', 'b11', 'b12']
 
 
-input_vairable_codes = ['Prec', 'Ta', 'Tmin', 'Tmax', 'v', 'RH', 'Vp', 'AP', 'Qsi', 'Qli', 'Qnet', 'Qg', 'Snowalb']
\ No newline at end of file
+input_vairable_codes = ['Prec', 'Ta', 'Tmin', 'Tmax', 'v', 'RH', 'Vp', 'AP', 'Qsi', 'Qli', 'Qnet', 'Qg', 'Snowalb']
+
+class ParameterFileTemplate(object):
+    # immutable, precompiled template of a model parameter file: the file is stored as the static text between the
+    # lines that change per job, so rendering a file is a single join over a few strings
+    __slots__ = ('file_name', 'field_names', '_parts')
+
+    def __init__(self, file_name, lines, fields):
+        """
+        Create a template of a parameter file
+
+        :param file_name: name of the parameter file (e.g. 'control.dat')
+        :param lines: default lines of the file
+        :param fields: a dict of line index to (field name, format function) for the lines that change per job
+        :return: ParameterFileTemplate object
+        """
+        # static text (at even indexes) and (field name, format function) (at odd indexes)
+        parts = []
+        static_text = ''
+        for index, line in enumerate(lines):
+            line_separator = '\r\n' if index > 0 else ''
+            if index in fields:
+                parts.extend([static_text + line_separator, fields[index]])
+                static_text = ''
+            else:
+                static_text += line_separator + line
+        parts.append(static_text)
+
+        object.__setattr__(self, 'file_name', file_name)
+        object.__setattr__(self, 'field_names', frozenset(field_name for field_name, _ in fields.values()))
+        object.__setattr__(self, '_parts', tuple(parts))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ParameterFileTemplate objects are immutable")
+
+    def render(self, **values):
+        """
+        Renders the file content (the line separator is \\r\\n) for the given field values
+
+        :raises: KeyError if a value is missing, ValueError if a value is not of the type of its field
+        """
+        return ''.join(part if index % 2 == 0 else part[1](values[part[0]])
+                       for index, part in enumerate(self._parts))
+
+
+def _format_date(value):
+    # a datetime.date (or datetime) as 'yyyy mm dd hour'
+    return value.strftime('%Y %m %d') + ' 0.0'
+
+
+def _format_number(value):
+    float(value)
+    return str(value)
+
+
+# parameter file templates with the lines that are set for each model instance
+parameter_file_templates = tuple(ParameterFileTemplate(file_name, file_contents_dict[file_name], fields) for
+                                 file_name, fields in (
+    ('control.dat', {8: ('start_date', _format_date), 9: ('end_date', _format_date)}),
+    ('siteinitial.dat', {3: ('usic', _format_number), 6: ('wsic', _format_number), 9: ('tic', _format_number),
+                         12: ('wcic', _format_number), 45: ('latitude', _format_number),
+                         93: ('ts_last', _format_number), 96: ('longitude', _format_number)}),
+    ('param.dat', {}),
+    ('inputcontrol.dat', {}),
+    ('outputcontrol.dat', {}),
+))
+
+model_parameter_files = tuple(template.file_name for template in parameter_file_templates)
+
+
+def render_parameter_files(start_date, end_date, latitude, longitude, usic, wsic, tic, wcic, ts_last):
+    """
+    Renders the model parameter files of a model instance without changing the shared templates, so it is safe to
+    call from concurrent jobs
+
+    :param start_date: start date of the model run
+    :type start_date: datetime.date
+    :param end_date: end date of the model run
+    :type end_date: datetime.date
+    :param latitude: latitude of the center of the watershed
+    :param longitude: longitude of the center of the watershed
+    :param usic: energy content initial condition (kg m-3)
+    :param wsic: snow water equivalent initial condition (m)
+    :param tic: snow surface dimensionless age initial condition
+    :param wcic: snow water equivalent of canopy initial condition (m)
+    :param ts_last: snow surface temperature one day prior to the model start
+    :return: a list of (file name, file content) for the parameter files
+    """
+    values = {'start_date': start_date, 'end_date': end_date, 'latitude': latitude, 'longitude': longitude,
+              'usic': usic, 'wsic': wsic, 'tic': tic, 'wcic': wcic, 'ts_last': ts_last}
+    return [(template.file_name, template.render(**values)) for template in parameter_file_templates]
@@ -13,7 +13,9 @@ import xmltodict
 import requests
 from user_settings import *
 
-from hydrogate import HydroDS
+from hydrogate import hydrods_client_pool, hydrods_client_wait_timeout, hydrods_service_endpoints, \
+    HydroDSClientUnavailableException
+from hydrods_model_input import tile_cache
 from model_parameters_list import site_initial_variable_codes, input_vairable_codes
 
 
@@ -88,7 +90,7 @@ def submit_model_run_job_single_call(res_id, OAuthHS):
     try:
 
         # url = 'http://hydro-ds.uwrl.usu.edu/api/dataservice/runuebmodel'
-        url = 'http://129.123.41.218:20199/api/dataservice/runuebmodel'
+        url_path = '/api/dataservice/runuebmodel'
         auth = (hydrods_name, hydrods_password)
         payload = {'resource_id': res_id,
                    'hs_client_id': OAuthHS['client_id'],
@@ -96,7 +98,7 @@ def submit_model_run_job_single_call(res_id, OAuthHS):
                    'token': json.dumps(OAuthHS['token']),
                    'hs_username': OAuthHS['user_name']
                    }
-        response = requests.get(url, params=payload, auth=auth)
+        response = hydrods_service_endpoints.get(url_path, params=payload, auth=auth, idempotent=False)
         response_dict = json.loads(response.text)
 
         if response.status_code == 200:
@@ -120,18 +122,22 @@ def submit_model_run_job_single_call(res_id, OAuthHS):
 def submit_model_run_job(res_id, OAuthHS, hydrods_name, hydrods_password):
     # TODO: call model run service
 
+    # a job of the same HydroDS account that is already running has the workspace till it is done
+    try:
+        client = hydrods_client_pool.acquire(username=hydrods_name, password=hydrods_password,
+                                             timeout=hydrods_client_wait_timeout)
+    except HydroDSClientUnavailableException:
+        return {
+            'status': 'Error',
+            'result': 'The HydroDS account is busy with another job. Please try again in a few minutes.'
+        }
+
     try:
         # authentication
         hs = OAuthHS['hs']
-        client = HydroDS(username=hydrods_name, password=hydrods_password)
-        
-        # clean up the HydroDS space
-        for item in client.list_my_files():
-            try:
-                client.delete_my_file(item.split('/')[-1])
 
-            except Exception as e:
-                continue
+        # clean up the HydroDS space (the recently used static data tiles of the model input jobs are kept)
+        client.delete_my_files(keep=tile_cache.get_tiles_to_keep(client))
 
         # download resource bag
         try:
@@ -261,6 +267,9 @@ def submit_model_run_job(res_id, OAuthHS, hydrods_name, hydrods_password):
             'result': 'Failed to run the model execution service.' + e.message
         }
 
+    finally:
+        hydrods_client_pool.release(client)
+
     return model_run_job
 
 
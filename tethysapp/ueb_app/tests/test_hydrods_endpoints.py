@@ -0,0 +1,85 @@
+"""
+Tests of the circuit breakers and endpoint pools of the HydroDS hosts
+
+Run from the command line:
+    python -m unittest discover -s tethysapp/ueb_app/tests
+"""
+
+import os
+import sys
+import threading
+import unittest
+
+import requests
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+
+# the app modules import each other as top level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hydrods_endpoints
+from hydrods_endpoints import CircuitBreaker, EndpointPool, EndpointUnavailableException
+
+
+class _RedirectLoopHandler(BaseHTTPRequestHandler):
+    # redirects every request to itself
+    def do_GET(self):
+        if self.path.startswith('/ok'):
+            self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(302)
+        self.send_header('Location', self.path)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class EndpointPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.server = HTTPServer(('127.0.0.1', 0), _RedirectLoopHandler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.base_url = 'http://127.0.0.1:{0}'.format(self.server.server_address[1])
+
+        # a half open circuit - the next call is the trial call
+        self.circuit_breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        self.circuit_breaker.record_failure()
+        hydrods_endpoints._circuit_breakers[self.base_url] = self.circuit_breaker
+        self.pool = EndpointPool([self.base_url])
+
+    def tearDown(self):
+        self.pool.stop_health_checks()
+        hydrods_endpoints._circuit_breakers.pop(self.base_url, None)
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_trial_call_failing_for_other_reason_than_host_ends_trial(self):
+        self.assertEqual(self.circuit_breaker.state, 'half-open')
+        with self.assertRaises(requests.exceptions.TooManyRedirects):
+            self.pool.get('/loop')
+
+        # the next call is let through as a new trial call, and closes the circuit when it succeeds
+        response = self.pool.get('/ok')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.circuit_breaker.state, 'closed')
+
+    def test_trial_call_failing_for_other_reason_than_host_does_not_block_later_calls(self):
+        for _ in range(3):
+            try:
+                self.pool.get('/loop')
+            except EndpointUnavailableException:
+                self.fail("the circuit breaker was left with a trial call in progress")
+            except requests.exceptions.TooManyRedirects:
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()